@@ -1,6 +1,22 @@
-from maze_environment import load_level, show_level, save_level_costs
+from maze_environment import load_level, show_level, save_level_costs, load_level_grid, cell_to_index, index_to_cell
+from itertools import repeat
 from math import inf, sqrt
 from heapq import heappop, heappush
+import hashlib
+import os
+import sys
+
+import numpy
+
+# the shared search module lives in the directory above
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from graph_search import EXPAND, STOP, SearchSpace, dijkstra
+
+# the eight moves of navigation_edges, in the same order
+NEIGHBOR_DELTAS = [(x, y) for x in [-1,0,1] for y in [-1,0,1] if not (x==0 and y==0)]
+
+# bump when the layout of the cached waypoint matrix changes
+MATRIX_VERSION = 2
 
 
 def dijkstras_shortest_path(initial_position, destination, graph, adj):
@@ -17,33 +33,283 @@ def dijkstras_shortest_path(initial_position, destination, graph, adj):
         Otherwise, return None.
 
     """
-    paths = {initial_position: []}          # maps cells to previous cells on path
-    pathcosts = {initial_position: 0}       # maps cells to their pathcosts (found so far)
-    queue = []
-    heappush(queue, (0, initial_position))  # maintain a priority queue of cells
-    
+    cells = list(graph['spaces'])           # cells by node id
+    ids = {cell: i for i, cell in enumerate(cells)}
+    target = ids.get(destination, -1)
+
+    # ties are broken by cell, as with a queue of (cost, cell) pairs
+    space = SearchSpace(len(cells), key=cells.__getitem__)
+    space.start(ids[initial_position])
+
+    def neighbors(i):
+        for (child, step_cost) in adj(graph, cells[i]):
+            yield ids[child], step_cost, None
+
+    cell = dijkstra(space, neighbors, lambda i, priority: STOP if i == target else EXPAND)
+    if cell < 0:
+        return False
+    return [cells[i] for i in space.path_to(cell)]
+
+
+def path_to_cell(cell, paths):
+    """ Follows the backpointers of paths (cell -> previous cell, [] at the start) back from cell.
+
+    dijkstras_shortest_path no longer keeps such a dict; this is kept for code that still builds one.
+    """
+    path = []
+    while cell != []:
+        path.append(cell)
+        cell = paths[cell]
+    path.reverse()
+    return path
+
+
+def grid_edge_costs(grid):
+    """ Computes the cost of every move of every cell of a grid at once.
+
+    Args:
+        grid: A loaded grid, containing cell costs, walkability, and waypoints.
+
+    Returns:
+        An N x 8 float array with the cost of moving from each flat index along each of NEIGHBOR_DELTAS,
+        inf when either cell is not walkable.
+    """
+    height = grid['costs'].shape[1]
+    costs = numpy.where(grid['walkable'], grid['costs'], inf).ravel()
+    offsets = numpy.array([dx * height + dy for dx, dy in NEIGHBOR_DELTAS])
+    distances = numpy.array([sqrt(dx**2 + dy**2) for dx, dy in NEIGHBOR_DELTAS])
+
+    # the padding ring is not walkable, so clipping only ever lands on inf cells
+    neighbors = (numpy.arange(costs.size)[:, None] + offsets).clip(0, costs.size - 1)
+    return distances * ((costs[:, None] + costs[neighbors]) / 2)
+
+
+def grid_shortest_path(initial_position, destination, grid, edge_costs=None, expanded=None):
+    """ Dijkstra's algorithm over the flat indices of a grid, with the same result as dijkstras_shortest_path.
+
+    Args:
+        initial_position: The initial cell from which the path extends.
+        destination: The end location for the path.
+        grid: A loaded grid, containing cell costs, walkability, and waypoints.
+        edge_costs: The grid_edge_costs of the grid, if already computed.
+        expanded: A list each expanded flat index is appended to, if given.
+
+    Returns:
+        If a path exits, return a list containing all cells from initial_position to destination.
+        Otherwise, return False.
+
+    """
+    if edge_costs is None:
+        edge_costs = grid_edge_costs(grid)
+    height = grid['costs'].shape[1]
+    offsets = [dx * height + dy for dx, dy in NEIGHBOR_DELTAS]
+
+    target = cell_to_index(grid, destination)
+    space = SearchSpace(len(edge_costs))
+    space.start(cell_to_index(grid, initial_position))
+
+    cell = dijkstra(space, grid_neighbors(edge_costs, offsets), lambda i, priority: STOP if i == target else EXPAND)
+    if expanded is not None:
+        expanded.extend(space.expanded)
+    if cell < 0:
+        return False
+    return [index_to_cell(grid, i) for i in space.path_to(cell)]
+
+
+def grid_neighbors(edge_costs, offsets):
+    """ Returns the neighbors callback of graph_search over the flat indices of a grid, from its grid_edge_costs
+    and the flat index offset of every move.
+    """
+    def neighbors(cell):
+        return zip([cell + offset for offset in offsets], edge_costs[cell].tolist(), repeat(None))
+    return neighbors
+
+
+def uniform_cells(grid):
+    """ Finds the walkable cells whose walkable neighbors all cost the same as the cell itself.
+
+    Returns:
+        A flat bool array. Around these cells every move costs the same, so jump_shortest_path may prune
+        moves and jump over them as on a uniform grid with walls; every other cell is expanded like
+        Dijkstra's algorithm does.
+    """
+    walkable = grid['walkable']
+    costs = numpy.where(walkable, grid['costs'], -1.)
+    uniform = walkable.copy()
+    inner = (slice(1, -1), slice(1, -1))
+    for dx, dy in NEIGHBOR_DELTAS:
+        neighbor = (slice(1 + dx, costs.shape[0] - 1 + dx), slice(1 + dy, costs.shape[1] - 1 + dy))
+        uniform[inner] &= ~walkable[neighbor] | (costs[neighbor] == costs[inner])
+    uniform[0, :] = uniform[-1, :] = uniform[:, 0] = uniform[:, -1] = False
+    return uniform.ravel()
+
+
+def jump_tables(grid):
+    """ Precomputes what jump_shortest_path needs to know about a grid, independent of the query.
+
+    Returns:
+        The tables (dict) containing the cell costs (list, inf where not walkable), the uniform_cells (list),
+        and per move: its flat index offset, its length, the moves it naturally continues in, the straight
+        moves a diagonal run probes, its forced moves as (offset that must be blocked, offset that must be
+        open, forced move), and one byte per cell telling whether a run along the move stops there.
+    """
+    height = grid['costs'].shape[1]
+    walkable = grid['walkable'].ravel()
+    uniform = uniform_cells(grid)
+
+    offset = {(dx, dy): dx * height + dy for dx, dy in NEIGHBOR_DELTAS}
+    direction = {delta: d for d, delta in enumerate(NEIGHBOR_DELTAS)}
+
+    natural, probes, forced = [], [], []
+    for dx, dy in NEIGHBOR_DELTAS:
+        if dx and dy:
+            natural.append([direction[(dx, 0)], direction[(0, dy)], direction[(dx, dy)]])
+            probes.append([direction[(dx, 0)], direction[(0, dy)]])
+            forced.append([(offset[(-dx, 0)], offset[(-dx, dy)], direction[(-dx, dy)]),
+                           (offset[(0, -dy)], offset[(dx, -dy)], direction[(dx, -dy)])])
+        else:
+            natural.append([direction[(dx, dy)]])
+            probes.append([])
+            sides = [(0, 1), (0, -1)] if dx else [(1, 0), (-1, 0)]
+            forced.append([(offset[side], offset[(dx + side[0], dy + side[1])], direction[(dx + side[0], dy + side[1])])
+                           for side in sides])
+
+    # a run stops at cells that are not uniform or have a forced move; the padding ring is never walked on
+    inner = numpy.arange(height + 1, walkable.size - height - 1)
+    stop = []
+    for d in range(len(NEIGHBOR_DELTAS)):
+        stops = ~uniform
+        for blocked, opened, _ in forced[d]:
+            stops[inner] |= ~walkable[inner + blocked] & walkable[inner + opened]
+        stop.append(stops.astype(numpy.uint8).tobytes())
+
+    tables = {'costs': numpy.where(grid['walkable'], grid['costs'], inf).ravel().tolist(),
+              'uniform': uniform.tolist(),
+              'offsets': [offset[delta] for delta in NEIGHBOR_DELTAS],
+              'distances': [sqrt(dx**2 + dy**2) for dx, dy in NEIGHBOR_DELTAS],
+              'natural': natural,
+              'probes': probes,
+              'forced': forced,
+              'stop': stop}
+
+    return tables
+
+
+def jump_shortest_path(initial_position, destination, grid, tables=None, expanded=None):
+    """ Jump Point Search over the flat indices of a grid, falling back to Dijkstra's expansion on weighted cells.
+
+    In uniform cells (see uniform_cells) a cell reached along some move only continues along the natural
+    and forced moves of Jump Point Search, and runs of cells without forced moves are jumped over. A jump
+    stops at the destination, at a cell with a forced move, at a cell that is not uniform or (diagonally)
+    at a cell from which a straight run would stop. Cells that are not uniform have all eight moves
+    expanded. Diagonal moves may cut corners, as in navigation_edges. Costs are accumulated move by move,
+    so the cost of the returned path is optimal, equal to that of dijkstras_shortest_path.
+
+    Args:
+        initial_position: The initial cell from which the path extends.
+        destination: The end location for the path.
+        grid: A loaded grid, containing cell costs, walkability, and waypoints.
+        tables: The jump_tables of the grid, if already computed.
+        expanded: A list each expanded flat index is appended to, if given.
+
+    Returns:
+        If a path exits, return a list containing all cells from initial_position to destination.
+        Otherwise, return False.
+
+    """
+    if tables is None:
+        tables = jump_tables(grid)
+    costs, uniform, stop = tables['costs'], tables['uniform'], tables['stop']
+    offsets, distances = tables['offsets'], tables['distances']
+    natural, probes, forced = tables['natural'], tables['probes'], tables['forced']
+    every_move = list(range(len(NEIGHBOR_DELTAS)))
+
+    source = cell_to_index(grid, initial_position)
+    target = cell_to_index(grid, destination)
+
+    # (cell, straight move) -> whether a run from cell along the move stops at a jump point
+    probed = {}
+
+    def probe(cell, d):
+        run = []
+        while True:
+            known = probed.get((cell, d))
+            if known is not None:
+                stops = known
+                break
+            run.append(cell)
+            cell += offsets[d]
+            if costs[cell] == inf:
+                stops = False
+                break
+            if cell == target or stop[d][cell]:
+                stops = True
+                break
+        # every cell of the run ends where the first one does
+        for visited in run:
+            probed[(visited, d)] = stops
+        return stops
+
+    def jump(cell, d, cost):
+        # follows move d from cell, returning the next jump point and the cost to it, or None
+        while True:
+            child = cell + offsets[d]
+            if costs[child] == inf:
+                return None
+            cost += distances[d] * ((costs[cell] + costs[child]) / 2)
+            cell = child
+            if cell == target or stop[d][cell]:
+                return cell, cost
+            for straight in probes[d]:
+                if probe(cell, straight):
+                    return cell, cost
+
+    pathcosts = {source: 0}
+    paths = {source: (None, None)}  # jump point -> (previous jump point, move it was entered along)
+    queue = [(0, source)]
+
     while queue:
         priority, cell = heappop(queue)
-        if cell == destination:
-            return path_to_cell(cell, paths)
-        
-        # investigate children
-        for (child, step_cost) in adj(graph, cell):
-            # calculate cost along this path to child
-            cost_to_child = priority + transition_cost(graph, cell, child)
+        if cell == target:
+            return jump_path_to_cell(grid, cell, paths)
+        if priority > pathcosts[cell]:
+            continue  # stale entry
+        if expanded is not None:
+            expanded.append(cell)
+
+        entered = paths[cell][1]
+        if entered is None or not uniform[cell]:
+            moves = every_move
+        else:
+            moves = natural[entered] + [move for blocked, opened, move in forced[entered]
+                                        if costs[cell + blocked] == inf and costs[cell + opened] != inf]
+        for d in moves:
+            found = jump(cell, d, priority)
+            if found is None:
+                continue
+            child, cost_to_child = found
             if child not in pathcosts or cost_to_child < pathcosts[child]:
-                pathcosts[child] = cost_to_child            # update the cost
-                paths[child] = cell                         # set the backpointer
-                heappush(queue, (cost_to_child, child))     # put the child on the priority queue
-            
+                pathcosts[child] = cost_to_child
+                paths[child] = (cell, d)
+                heappush(queue, (cost_to_child, child))
+
     return False
 
-def path_to_cell(cell, paths):
-    if cell == []:
-        return []
-    return path_to_cell(paths[cell], paths) + [cell]
-    
 
+def jump_path_to_cell(grid, cell, paths):
+    """ Expands the jump points leading to cell back into the full list of cells. """
+    path = [index_to_cell(grid, cell)]
+    previous, d = paths[cell]
+    while previous is not None:
+        dx, dy = NEIGHBOR_DELTAS[d]
+        x, y = path[-1]
+        start = index_to_cell(grid, previous)
+        while (x, y) != start:
+            x, y = x - dx, y - dy
+            path.append((x, y))
+        previous, d = paths[previous]
+    path.reverse()
+    return path
 
 
 def navigation_edges(level, cell):
@@ -76,13 +342,119 @@ def transition_cost(level, cell, cell2):
     return distance * average_cost
 
 
-def test_route(filename, src_waypoint, dst_waypoint):
+def grid_distances(initial_position, grid, edge_costs=None):
+    """ Runs Dijkstra's algorithm from a cell over the whole grid.
+
+    Args:
+        initial_position: The cell the costs are measured from.
+        grid: A loaded grid, containing cell costs, walkability, and waypoints.
+        edge_costs: The grid_edge_costs of the grid, if already computed.
+
+    Returns:
+        A float array with the path cost to every flat index (inf where unreachable), and an int array with
+        the previous flat index on each cheapest path (-1 at initial_position and where unreachable).
+    """
+    if edge_costs is None:
+        edge_costs = grid_edge_costs(grid)
+    height = grid['costs'].shape[1]
+    offsets = [dx * height + dy for dx, dy in NEIGHBOR_DELTAS]
+
+    space = SearchSpace(len(edge_costs))
+    space.start(cell_to_index(grid, initial_position))
+    dijkstra(space, grid_neighbors(edge_costs, offsets))
+    return numpy.array(space.costs), numpy.array(space.parents)
+
+
+def waypoint_matrix(filename, cache_dir=None):
+    """ Builds, or loads from the cache, the costs and cheapest paths between every pair of waypoints.
+
+    One grid_distances run per waypoint gives its row of the cost matrix and its tree of cheapest paths.
+    The result is cached under the hash of the level file, so a changed level never reuses a stale matrix.
+
+    Args:
+        filename: The name of the text file containing the level.
+        cache_dir: The directory holding cached matrices, by default the one holding the level file.
+
+    Returns:
+        The matrix (dict) containing the waypoint characters in order (list), their cells (W x 2 int
+        array), the W x W costs (float array, inf where unreachable), the W x N path trees over flat grid
+        indices, and the grid shape.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.dirname(os.path.abspath(filename))
+    with open(filename, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    cache_file = os.path.join(cache_dir, 'waypoint_matrix_v%d_%s.npz' % (MATRIX_VERSION, digest[:16]))
+
+    if os.path.exists(cache_file):
+        with numpy.load(cache_file) as cached:
+            matrix = {key: cached[key] for key in cached.files}
+        matrix['waypoints'] = matrix['waypoints'].tolist()
+        return matrix
+
+    grid = load_level_grid(filename)
+    edge_costs = grid_edge_costs(grid)
+    waypoints = sorted(grid['waypoints'])
+    sources = [cell_to_index(grid, grid['waypoints'][w]) for w in waypoints]
+
+    costs = numpy.full((len(waypoints), len(waypoints)), inf)
+    trees = numpy.empty((len(waypoints), len(edge_costs)), dtype=numpy.int64)
+
+    for i, waypoint in enumerate(waypoints):
+        pathcosts, trees[i] = grid_distances(grid['waypoints'][waypoint], grid, edge_costs)
+        costs[i] = pathcosts[sources]
+
+    matrix = {'waypoints': waypoints,
+              'cells': numpy.array([grid['waypoints'][w] for w in waypoints]).reshape(-1, 2),
+              'costs': costs,
+              'trees': trees,
+              'shape': numpy.array(grid['costs'].shape)}
+
+    os.makedirs(cache_dir, exist_ok=True)
+    numpy.savez(cache_file, **matrix)
+    print("Saved file:", cache_file)
+
+    return matrix
+
+
+def tree_path(tree, source, target):
+    """ Returns the flat indices from source to target along a path tree of grid_distances, or [] if none. """
+    path = [target]
+    while path[-1] != source:
+        if tree[path[-1]] < 0:
+            return []
+        path.append(int(tree[path[-1]]))
+    path.reverse()
+    return path
+
+
+def matrix_route(matrix, src_waypoint, dst_waypoint):
+    """ Looks up the cheapest route between two waypoints in a waypoint_matrix.
+
+    Returns:
+        If a path exits, return a list containing all cells from src_waypoint to dst_waypoint.
+        Otherwise, return False.
+    """
+    i = matrix['waypoints'].index(src_waypoint)
+    j = matrix['waypoints'].index(dst_waypoint)
+    if matrix['costs'][i, j] == inf:
+        return False
+
+    grid = {'costs': numpy.broadcast_to(0., tuple(matrix['shape']))}  # the index helpers only need the shape
+    source, target = (cell_to_index(grid, tuple(matrix['cells'][k])) for k in (i, j))
+    return [index_to_cell(grid, index) for index in tree_path(matrix['trees'][i], source, target)]
+
+
+def test_route(filename, src_waypoint, dst_waypoint, engine='dict'):
     """ Loads a level, searches for a path between the given waypoints, and displays the result.
 
     Args:
         filename: The name of the text file containing the level.
         src_waypoint: The character associated with the initial waypoint.
         dst_waypoint: The character associated with the destination waypoint.
+        engine: 'dict' to search the level dict, 'grid' to search the array grid of the level, 'matrix' to
+            look the route up in the cached waypoint_matrix of the level, 'jps' for Jump Point Search over the
+            grid, printing its expansions next to those of Dijkstra's algorithm on the same grid.
 
     """
 
@@ -95,7 +467,18 @@ def test_route(filename, src_waypoint, dst_waypoint):
     dst = level['waypoints'][dst_waypoint]
 
     # Search for and display the path from src to dst.
-    path = dijkstras_shortest_path(src, dst, level, navigation_edges)
+    if engine == 'grid':
+        path = grid_shortest_path(src, dst, load_level_grid(filename))
+    elif engine == 'matrix':
+        path = matrix_route(waypoint_matrix(filename), src_waypoint, dst_waypoint)
+    elif engine == 'jps':
+        grid = load_level_grid(filename)
+        dijkstra_expanded, jump_expanded = [], []
+        grid_shortest_path(src, dst, grid, expanded=dijkstra_expanded)
+        path = jump_shortest_path(src, dst, grid, expanded=jump_expanded)
+        print("Expanded cells: Dijkstra %d, Jump Point Search %d" % (len(dijkstra_expanded), len(jump_expanded)))
+    else:
+        path = dijkstras_shortest_path(src, dst, level, navigation_edges)
     if path:
         show_level(level, path)
     else:
@@ -105,6 +488,9 @@ def test_route(filename, src_waypoint, dst_waypoint):
 if __name__ == '__main__':
     filename, src_waypoint, dst_waypoint = 'example.txt', 'a','e'
 
+    # Pick the search with e.g. `python Dijkstra_forward_search.py jps`.
+    engine = sys.argv[1] if len(sys.argv) > 1 else 'dict'
+
     # Use this function call to find the route between two waypoints.
-    test_route(filename, src_waypoint, dst_waypoint)
+    test_route(filename, src_waypoint, dst_waypoint, engine)
 
@@ -3,8 +3,13 @@
 from math import inf
 from csv import writer
 
+import numpy
+
 WALL = 'X'
 
+# grids keep a ring of wall cells around the level so neighbor offsets never leave the array
+GRID_PAD = 1
+
 
 def load_level(filename):
     """ Loads a level from a given text file.
@@ -110,4 +115,52 @@ def save_level_costs(level, costs, filename='distance_map.csv'):
         for row in rows:
             csv_writer.writerow(row)
 
-    print("Saved file:", filename)
\ No newline at end of file
+    print("Saved file:", filename)
+
+
+def load_level_grid(filename):
+    """ Loads a level from a given text file into arrays, for the flat-index searches.
+
+    Args:
+        filename: The name of the txt file containing the maze.
+
+    Returns:
+        The loaded grid (dict) containing the cost of every cell (float array indexed [x, y], 0 where not
+        walkable), the walkability mask (bool array of the same shape), and a mapping of waypoints to
+        locations (dict). Both arrays are padded by GRID_PAD wall cells on every side.
+
+    """
+    with open(filename, "r") as f:
+        lines = f.read().split('\n')
+
+    width = max((len(line) for line in lines), default=0)
+    chars = numpy.full((width + 2 * GRID_PAD, len(lines) + 2 * GRID_PAD), ord(' '), dtype=numpy.uint8)
+    for j, line in enumerate(lines):
+        chars[GRID_PAD:GRID_PAD + len(line), GRID_PAD + j] = numpy.frombuffer(
+            line.encode('ascii', 'replace'), dtype=numpy.uint8)
+
+    digits = (chars >= ord('0')) & (chars <= ord('9'))
+    waypoint_mask = (chars >= ord('a')) & (chars <= ord('z'))
+    costs = numpy.where(digits, chars.astype(numpy.float64) - ord('0'), 0.)
+    costs[waypoint_mask] = 1.
+
+    # in file order, so a repeated waypoint letter ends up where load_level puts it
+    waypoints = {chr(chars[i, j]): (i - GRID_PAD, j - GRID_PAD)
+                 for j, i in numpy.argwhere(waypoint_mask.T).tolist()}
+
+    grid = {'costs': costs,
+            'walkable': digits | waypoint_mask,
+            'waypoints': waypoints}
+
+    return grid
+
+
+def cell_to_index(grid, cell):
+    """ Returns the flat index into the grid arrays of an (x, y) cell. """
+    return (cell[0] + GRID_PAD) * grid['costs'].shape[1] + cell[1] + GRID_PAD
+
+
+def index_to_cell(grid, index):
+    """ Returns the (x, y) cell of a flat index into the grid arrays. """
+    x, y = divmod(index, grid['costs'].shape[1])
+    return (x - GRID_PAD, y - GRID_PAD)
\ No newline at end of file
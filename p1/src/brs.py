@@ -1,26 +1,36 @@
+import time
+
 from utils import *
 
 
-def find_path_brs(source_point, destination_point, mesh):
-    mesh_adj = mesh[ADJ]
+def find_path_brs(source_point, destination_point, mesh, stats=None):
+    mesh = as_array_mesh(mesh)
 
-    explored = {}  # all boxes explored so far: from
-    frontier = []
+    if stats is not None:
+        started = time.perf_counter()
 
     # find box containing src & dest point
-    src_box = find_box_of_point(source_point, mesh)
-    dest_box = find_box_of_point(destination_point, mesh)
+    src_box = find_box_id(source_point, mesh)
+    dest_box = find_box_id(destination_point, mesh)
+
+    if stats is not None:
+        located = time.perf_counter()
+        stats.locate_time = located - started
 
-    explored[src_box] = None  # special case for src box
-    # add src into frontier
-    frontier.append(src_box)
+    # boxes in different components of the mesh can never be joined
+    if not connected(src_box, dest_box, mesh):
+        return [], {}
+
+    explored = {src_box: -1}  # all boxes explored so far: from
+    frontier = [src_box]
+    pops = 0
 
     while frontier:  # continue if frontier is not empty
         current_box = frontier.pop()
-        neighbors = mesh_adj[current_box]
-        for nei_box in neighbors:
+        pops += 1
+        for nei_box in neighbors_of(current_box, mesh).tolist():
             if nei_box in explored:
-                continue  # skip exolored boxes
+                continue  # skip explored boxes
 
             explored[nei_box] = current_box
             frontier.append(nei_box)
@@ -29,16 +39,27 @@ def find_path_brs(source_point, destination_point, mesh):
         if dest_box in explored:
             break
 
+    if stats is not None:
+        searched = time.perf_counter()
+        stats.search_time = searched - located
+        stats.pushes = len(explored)
+        stats.pops = pops
+        stats.forward_expansions = pops
+        stats.meeting_box = dest_box if dest_box in explored else None
+
     # generate path
     boxes_path = []
-    _box = dest_box
-    while _box:
-        boxes_path.append(_box)
-        _box = explored[_box]
-
+    box = dest_box
+    while box >= 0:
+        boxes_path.append(box_of(box, mesh))
+        box = explored[box]
     boxes_path.reverse()
 
-    return (
-        gen_path_from_boxes(boxes_path, source_point, destination_point),
-        explored,
-    )
+    path = gen_path_from_boxes(boxes_path, source_point, destination_point)
+    explored = {box_of(box, mesh): box_of(parent, mesh) if parent >= 0 else None
+                for box, parent in explored.items()}
+
+    if stats is not None:
+        stats.reconstruct_time = time.perf_counter() - searched
+
+    return path, explored
@@ -0,0 +1,250 @@
+from heapq import heappush, heappop
+from math import inf
+
+# Dijkstra_Forward_Search and p5 run as scripts from their own directory and
+# put this directory on sys.path to import it
+
+# what a `visit` callback tells `astar` to do with a popped node
+EXPAND = 0
+SKIP = 1  # leave the node unexpanded and go on
+STOP = 2  # end the search at this node
+
+
+class SearchSpace:
+    """
+    Costs, parents and open list of one best-first search over integer node ids.
+
+    Costs, parents and per-node data are kept in lists indexed by node id, and
+    `grow` makes room for ids discovered during the search. The open list is a
+    heap of `(priority, key, node)` entries, `key` being the node id itself
+    unless a `key` function is given (to break ties like a search over other
+    node objects would).
+
+    Stale entries are deleted lazily: `pop` skips an entry when its node has
+    been expanded and not improved since. Popping a node that was improved after
+    its expansion expands it again, as a search without closed set would.
+    """
+
+    def __init__(self, num_nodes=0, key=None):
+        self.costs = [inf] * num_nodes
+        self.parents = [-1] * num_nodes
+        self.data = [None] * num_nodes  # whatever the neighbor callback attached
+        self.closed = bytearray(num_nodes)  # expanded and not improved since
+        self.seen = bytearray(num_nodes)  # expanded at least once
+        self.heap = []
+        self.key = key
+        self.expanded = []  # nodes in order of expansion, with repeats
+        self.stale_pops = 0
+
+    def grow(self, num_nodes):
+        """
+        Makes room for node ids below `num_nodes`.
+        """
+        extra = num_nodes - len(self.costs)
+        if extra > 0:
+            self.costs += [inf] * extra
+            self.parents += [-1] * extra
+            self.data += [None] * extra
+            self.closed += bytearray(extra)
+            self.seen += bytearray(extra)
+
+    def start(self, node, data=None, cost=0, priority=None):
+        self.relax(node, cost, -1, cost if priority is None else priority, data)
+
+    def relax(self, node, cost, parent, priority, data=None):
+        """
+        Records a path of `cost` to `node` through `parent` if it is cheaper
+        than the best so far, and queues the node with `priority`.
+
+        Returns:
+            - Whether the node was improved
+        """
+        if cost >= self.costs[node]:
+            return False
+        self.costs[node] = cost
+        self.parents[node] = parent
+        self.data[node] = data
+        self.closed[node] = 0
+        heappush(self.heap, (priority, node if self.key is None else self.key(node), node))
+        return True
+
+    def pop(self):
+        """
+        Pops the open node with the lowest priority.
+
+        Returns:
+            - The priority of the entry
+            - The node id, or -1 if the entry was stale
+        """
+        priority, _, node = heappop(self.heap)
+        if self.closed[node]:
+            self.stale_pops += 1
+            return priority, -1
+        return priority, node
+
+    def close(self, node):
+        """
+        Marks `node` as expanded.
+        """
+        self.closed[node] = 1
+        self.seen[node] = 1
+        self.expanded.append(node)
+
+    def expand(self, node, neighbors, heuristic=None):
+        """
+        Closes `node` and relaxes every `(neighbor, step_cost, data)` from
+        `neighbors(node)`, with priority cost + `heuristic(neighbor, data)`.
+
+        Returns:
+            - The neighbors that were improved
+        """
+        # `close` and `relax` inlined, as this runs once per expanded node and
+        # its loop once per edge
+        costs, parents, node_data, closed = self.costs, self.parents, self.data, self.closed
+        heap, key = self.heap, self.key
+        closed[node] = 1
+        self.seen[node] = 1
+        self.expanded.append(node)
+        cost = costs[node]
+        improved = []
+        for neighbor, step_cost, data in neighbors(node):
+            new_cost = cost + step_cost
+            if new_cost < costs[neighbor]:
+                costs[neighbor] = new_cost
+                parents[neighbor] = node
+                node_data[neighbor] = data
+                closed[neighbor] = 0
+                priority = new_cost if heuristic is None else new_cost + heuristic(neighbor, data)
+                heappush(heap, (priority, neighbor if key is None else key(neighbor), neighbor))
+                improved.append(neighbor)
+        return improved
+
+    def path_to(self, node):
+        """
+        Returns:
+            - The node ids from the start of the search to `node`
+        """
+        path = []
+        while node != -1:
+            path.append(node)
+            node = self.parents[node]
+        path.reverse()
+        return path
+
+    def pushes(self):
+        # every push is eventually popped (expanded or skipped) or still queued
+        return len(self.expanded) + self.stale_pops + len(self.heap)
+
+    def pops(self):
+        return len(self.expanded) + self.stale_pops
+
+
+def astar(space, neighbors, heuristic=None, visit=None):
+    """
+    Runs A* on `space`, which has been given its start node(s).
+
+    `neighbors(node)` yields `(neighbor, step_cost, data)` and
+    `heuristic(neighbor, data)` estimates the remaining cost; without one the
+    search is Dijkstra's algorithm. `visit(node, priority)` is called on every
+    popped node before it is expanded and returns `EXPAND`, `SKIP` or `STOP`.
+
+    Returns:
+        - The node the search stopped at, or -1 if the open list ran out
+    """
+    heap, closed = space.heap, space.closed
+    while heap:
+        # `pop` inlined, as this runs once per queued entry
+        priority, _, node = heappop(heap)
+        if closed[node]:
+            space.stale_pops += 1
+            continue
+        action = EXPAND if visit is None else visit(node, priority)
+        if action == STOP:
+            return node
+        if action == SKIP:
+            continue
+        space.expand(node, neighbors, heuristic)
+    return -1
+
+
+def dijkstra(space, neighbors, visit=None):
+    """
+    Runs Dijkstra's algorithm on `space`; see `astar`.
+    """
+    return astar(space, neighbors, None, visit)
+
+
+def bidirectional_astar(forward, backward, forward_neighbors, backward_neighbors,
+                        forward_heuristic=None, backward_heuristic=None):
+    """
+    Runs A* from the start of `forward` and from the start of `backward` in
+    turns, one pop each, until one side pops a node the other side has already
+    expanded. A stale pop uses up its side's turn.
+
+    Returns:
+        - The node where the searches met, or -1 if either open list ran out
+    """
+    sides = ((forward, backward, forward_neighbors, forward_heuristic),
+             (backward, forward, backward_neighbors, backward_heuristic))
+
+    while forward.heap and backward.heap:
+        for space, other, neighbors, heuristic in sides:
+            _, node = space.pop()
+            if node < 0:
+                continue
+            if other.seen[node]:
+                space.close(node)
+                return node
+            space.expand(node, neighbors, heuristic)
+    return -1
+
+
+def bidirectional_astar_optimal(forward, backward, forward_neighbors, backward_neighbors,
+                                forward_heuristic=None, backward_heuristic=None, meeting_cost=None):
+    """
+    Runs A* from the start of `forward` and from the start of `backward` until
+    the best meeting found so far is proven shortest.
+
+    Both sides meet at every node they both have a path to, joined at
+    `meeting_cost(node)` (by default the sum of both costs). With admissible
+    heuristics no path through a side's open nodes is cheaper than its lowest
+    priority, so the search stops once either lowest priority reaches the best
+    meeting cost. Each turn expands the side whose lowest priority is higher,
+    the one closer to that bound, rather than alternating.
+
+    Returns:
+        - The node of the best meeting, or -1 if the sides never met
+        - Its meeting cost
+    """
+    if meeting_cost is None:
+        meeting_cost = lambda node: forward.costs[node] + backward.costs[node]
+
+    best, best_cost = -1, inf
+
+    def meet(nodes, other):
+        nonlocal best, best_cost
+        for node in nodes:
+            if other.costs[node] < inf:
+                cost = meeting_cost(node)
+                # the best meeting is rebuilt from the current paths, so its
+                # cost follows them
+                if cost < best_cost or node == best:
+                    best, best_cost = node, cost
+
+    meet([entry[2] for entry in forward.heap], backward)
+
+    while forward.heap and backward.heap:
+        if max(forward.heap[0][0], backward.heap[0][0]) >= best_cost:
+            break
+
+        if forward.heap[0][0] >= backward.heap[0][0]:
+            space, other, neighbors, heuristic = forward, backward, forward_neighbors, forward_heuristic
+        else:
+            space, other, neighbors, heuristic = backward, forward, backward_neighbors, backward_heuristic
+
+        _, node = space.pop()
+        if node < 0:
+            continue
+        meet(space.expand(node, neighbors, heuristic), other)
+
+    return best, best_cost
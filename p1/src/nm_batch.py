@@ -0,0 +1,178 @@
+import csv
+import math
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy
+
+from graph_search import EXPAND, STOP, SearchSpace, dijkstra
+from nm_mesh import ADJ_OFFSETS, ADJ_NEIGHBORS, COMPONENTS, EDGE_COSTS, load_mesh, portal_path
+from nm_spatial import locate_points
+
+# mesh shared by the process pool workers, set by `init_worker`
+worker_mesh = None
+
+
+def find_paths(queries, mesh, workers=1):
+    """
+    Answers many `(source_point, destination_point)` queries at once.
+
+    All endpoints are located in one vectorized pass, queries are grouped by
+    source box, and each group is answered by a single Dijkstra from that box
+    that stops once every destination box of the group is settled. Queries
+    whose endpoints lie in different components are answered without any
+    search. Groups run in a process pool when `workers` > 1.
+
+    The search costs are the static `EDGE_COSTS` (box middle to portal to box
+    middle), not the distances between the points a path actually crosses
+    that `find_path` searches by, so a query may get a different (in total a
+    few percent longer) path than `find_path` gives for the same endpoints.
+    The returned lengths are those of the returned points.
+
+    Returns:
+        - Float array with the length of every path, inf where there is none
+        - Int array of Q+1 offsets into the point array, one slice per query
+        - Px2 float array with the points of all paths
+    """
+    queries = numpy.asarray(queries, dtype=numpy.float64).reshape(-1, 4)
+    src_boxes = locate_points(queries[:, :2], mesh)
+    dest_boxes = locate_points(queries[:, 2:], mesh)
+
+    located = (src_boxes >= 0) & (dest_boxes >= 0)
+    components = mesh[COMPONENTS]
+    reachable = located & (components[src_boxes] == components[dest_boxes])
+
+    groups = defaultdict(list)
+    for i, (src_box, dest_box) in enumerate(zip(src_boxes.tolist(), dest_boxes.tolist())):
+        if reachable[i]:
+            groups[src_box].append((i, dest_box, tuple(queries[i, :2]), tuple(queries[i, 2:])))
+    groups = list(groups.items())
+
+    if workers > 1 and len(groups) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(mesh,)) as pool:
+            chunksize = max(1, len(groups) // (workers * 4))
+            answers = pool.map(answer_group, groups, chunksize=chunksize)
+            paths = dict(pair for answer in answers for pair in answer)
+    else:
+        init_worker(mesh)
+        paths = dict(pair for group in groups for pair in answer_group(group))
+
+    costs = numpy.full(len(queries), numpy.inf)
+    path_offsets = numpy.zeros(len(queries) + 1, dtype=numpy.int64)
+    points = []
+    for i in range(len(queries)):
+        path = paths.get(i, [])
+        if path:
+            costs[i] = sum(math.dist(a, b) for a, b in zip(path, path[1:]))
+        points.extend(path)
+        path_offsets[i + 1] = len(points)
+
+    return costs, path_offsets, numpy.asarray(points, dtype=numpy.float64).reshape(-1, 2)
+
+
+def init_worker(mesh):
+    global worker_mesh
+    worker_mesh = mesh
+
+
+def answer_group(group):
+    """
+    Answers all queries sharing one source box.
+
+    Returns:
+        - List of (query index, path) pairs, with an empty path when unreachable
+    """
+    src_box, members = group
+    came_from = multi_target_search(src_box, {dest_box for _, dest_box, _, _ in members}, worker_mesh)
+
+    answers = []
+    for i, dest_box, src_pt, dest_pt in members:
+        if dest_box not in came_from:
+            answers.append((i, []))
+            continue
+        box_path = []
+        box = dest_box
+        while box is not None:
+            box_path.append(box)
+            box = came_from[box]
+        box_path.reverse()
+        answers.append((i, portal_path(box_path, src_pt, dest_pt, worker_mesh)))
+    return answers
+
+
+def multi_target_search(source, targets, mesh):
+    """
+    Dijkstra over the box graph from `source` until every box in `targets` is
+    settled or the reachable part of the mesh is exhausted.
+
+    Returns:
+        - Dict of box -> previous box on the cheapest path from `source`
+    """
+    offsets = mesh[ADJ_OFFSETS]
+    neighbors = mesh[ADJ_NEIGHBORS]
+    edge_costs = mesh[EDGE_COSTS]
+
+    remaining = set(targets)
+    space = SearchSpace(len(offsets) - 1)
+    space.start(source, cost=0.0)
+
+    def box_neighbors(box):
+        start, end = offsets[box], offsets[box + 1]
+        return zip(neighbors[start:end].tolist(), edge_costs[start:end].tolist(), repeat(None))
+
+    def visit(box, cost):
+        # the last target is still expanded, so stop at the pop after it
+        if not remaining:
+            return STOP
+        remaining.discard(box)
+        return EXPAND
+
+    dijkstra(space, box_neighbors, visit)
+
+    parents = space.parents
+    return {box: (None if parents[box] < 0 else parents[box])
+            for box in numpy.flatnonzero(numpy.isfinite(space.costs)).tolist()}
+
+
+def read_queries(filename):
+    """
+    Reads `sx,sy,dx,dy` rows from a CSV file, skipping a header row if present.
+    """
+    queries = []
+    with open(filename, newline='') as f:
+        for row in csv.reader(f):
+            try:
+                queries.append([float(v) for v in row[:4]])
+            except ValueError:
+                continue  # header
+    return queries
+
+
+if __name__ == '__main__':
+
+    workers = 1
+
+    if len(sys.argv) == 3:
+        mesh_filename, queries_filename = sys.argv[1:]
+    elif len(sys.argv) == 4:
+        mesh_filename, queries_filename = sys.argv[1:3]
+        workers = int(sys.argv[3])
+    else:
+        print("usage: %s map.mesh queries.csv [workers]" % sys.argv[0])
+        sys.exit(-1)
+
+    mesh = load_mesh(mesh_filename)
+    queries = read_queries(queries_filename)
+
+    start = time.perf_counter()
+    costs, path_offsets, path_points = find_paths(queries, mesh, workers)
+    elapsed = time.perf_counter() - start
+
+    numpy.savez(queries_filename + '.paths.npz', costs=costs,
+                path_offsets=path_offsets, path_points=path_points)
+
+    print("Answered %d queries (%d without a path) in %.3fs."
+          % (len(queries), int(numpy.isinf(costs).sum()), elapsed))
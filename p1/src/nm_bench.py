@@ -0,0 +1,167 @@
+import io
+import json
+import math
+import os
+import sys
+import time
+import contextlib
+from functools import partial
+
+import numpy
+from matplotlib.pyplot import imread
+
+import nm_pathfinder
+from brs import find_path_brs
+from nm_mesh import COMPONENTS
+from nm_meshbuilder import build_mesh
+from nm_spatial import locate_points
+
+INPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input')
+MAPS = ('homer.png', 'ucsc_banana_slug.png', 'test_image.png')
+MIN_FEATURE_SIZES = (8, 16, 32)
+NUM_QUERIES = 200
+BUILD_REPEATS = 3
+SEED = 0
+
+
+def load_image(filename):
+    img = (imread(filename) * 255).astype(dtype=numpy.uint8)
+    if len(img.shape) > 2:
+        img = img[:, :, 0]
+    return img
+
+
+def reachable_queries(image, mesh, count, seed=SEED):
+    """
+    Draws `count` seeded pairs of free pixels whose boxes are connected in `mesh`.
+
+    Returns:
+        - List of `(source_point, destination_point)` pairs
+    """
+    rng = numpy.random.default_rng(seed)
+    free = numpy.argwhere(image == 255).astype(numpy.float64)
+    components = mesh[COMPONENTS]
+    queries = []
+
+    for _ in range(100):  # rounds; a mesh with no reachable pairs gives up
+        pairs = free[rng.integers(0, len(free), size=(count, 2))]
+        src_boxes = locate_points(pairs[:, 0], mesh)
+        dest_boxes = locate_points(pairs[:, 1], mesh)
+        ok = (src_boxes >= 0) & (dest_boxes >= 0)
+        ok[ok] = components[src_boxes[ok]] == components[dest_boxes[ok]]
+        queries += [(tuple(src), tuple(dest)) for src, dest in pairs[ok].tolist()]
+        if len(queries) >= count:
+            break
+
+    return queries[:count]
+
+
+def path_length(path):
+    return sum(math.dist(a, b) for a, b in zip(path, path[1:]))
+
+
+def time_queries(search, queries, mesh):
+    """
+    Runs `search(source_point, destination_point, mesh)` over `queries`.
+
+    Returns:
+        - Dict with p50/p99 latency (ms), total wall-clock time (ms), mean
+          explored boxes and mean path length
+    """
+    latencies, explored, lengths = [], [], []
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # silence "No Path"
+        for src, dest in queries:
+            start = time.perf_counter()
+            path, boxes = search(src, dest, mesh)
+            latencies.append(time.perf_counter() - start)
+            explored.append(len(boxes))
+            lengths.append(path_length(path))
+    total = time.perf_counter() - started
+
+    p50, p99 = numpy.percentile(latencies, [50, 99]).tolist() if latencies else (0.0, 0.0)
+    return {'p50_ms': p50 * 1000, 'p99_ms': p99 * 1000, 'total_ms': total * 1000,
+            'explored': float(numpy.mean(explored)) if explored else 0.0,
+            'path_length': float(numpy.mean(lengths)) if lengths else 0.0}
+
+
+def run(maps=MAPS, min_feature_sizes=MIN_FEATURE_SIZES, num_queries=NUM_QUERIES):
+    """
+    Benchmarks mesh building and the path searches on every map and
+    `min_feature_size`.
+
+    Returns:
+        - Dict of "<map>@<min_feature_size>" -> measurements
+    """
+    results = {}
+    for map_name in maps:
+        image = load_image(os.path.join(INPUT_DIR, map_name))
+        for min_feature_size in min_feature_sizes:
+            build_times = []
+            for _ in range(BUILD_REPEATS):
+                start = time.perf_counter()
+                mesh = build_mesh(image, min_feature_size)
+                build_times.append(time.perf_counter() - start)
+
+            queries = reachable_queries(image, mesh, num_queries)
+            results["%s@%d" % (map_name, min_feature_size)] = {
+                'boxes': len(mesh['boxes']),
+                'queries': len(queries),
+                'build_ms': min(build_times) * 1000,
+                'find_path': time_queries(nm_pathfinder.find_path, queries, mesh),
+                'find_path_optimal': time_queries(partial(nm_pathfinder.find_path, optimal=True),
+                                                  queries, mesh),
+                'find_path_brs': time_queries(find_path_brs, queries, mesh),
+            }
+    return results
+
+
+def flatten(results):
+    """
+    Returns:
+        - Dict of "<map>@<size> <metric>" -> number, for comparisons
+    """
+    flat = {}
+    for case, measurements in results.items():
+        for key, value in measurements.items():
+            if isinstance(value, dict):
+                for metric, number in value.items():
+                    flat["%s %s.%s" % (case, key, metric)] = number
+            else:
+                flat["%s %s" % (case, key)] = value
+    return flat
+
+
+def compare(results, baseline):
+    """
+    Prints every metric next to its baseline value and the relative change.
+    """
+    current, before = flatten(results), flatten(baseline)
+    for name in sorted(current):
+        if name not in before:
+            print("%-60s %12.3f %12s" % (name, current[name], "new"))
+            continue
+        change = (current[name] - before[name]) / before[name] * 100 if before[name] else 0.0
+        print("%-60s %12.3f %12.3f %+8.1f%%" % (name, current[name], before[name], change))
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) not in (2, 3):
+        print("usage: %s results.json [baseline.json]" % sys.argv[0])
+        sys.exit(-1)
+
+    results = run()
+    with open(sys.argv[1], 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+    if len(sys.argv) == 3:
+        with open(sys.argv[2]) as f:
+            compare(results, json.load(f))
+    else:
+        for case, measurements in results.items():
+            print("%-28s boxes %5d  build %8.1fms" % (case, measurements['boxes'], measurements['build_ms']))
+            for search in ('find_path', 'find_path_optimal', 'find_path_brs'):
+                timing = measurements[search]
+                print("    %-18s p50 %6.2fms p99 %6.2fms total %8.1fms length %8.1f"
+                      % (search, timing['p50_ms'], timing['p99_ms'], timing['total_ms'], timing['path_length']))
@@ -0,0 +1,194 @@
+import math
+
+import numpy
+
+from nm_mesh import ADJ_OFFSETS, ADJ_NEIGHBORS, BOXES, PORTAL_SEGMENTS
+
+BOX_CLEARANCE = 'box_clearance'
+PORTAL_CLEARANCE = 'portal_clearance'
+
+# clearances are only told apart up to this many pixels
+MAX_CLEARANCE = 64
+
+
+def distance_transform(image, max_distance=MAX_CLEARANCE):
+    """
+    Euclidean distance from every pixel of `image` to the nearest non-free
+    (not 255) pixel, with everything outside the image counting as blocked.
+
+    Runs a column pass for the vertical distance, then takes the minimum over
+    horizontal offsets up to `max_distance`, so the cost is one array operation
+    per offset rather than per pixel. Distances are exact up to `max_distance`
+    and clamped to it beyond.
+
+    Returns:
+        - A float32 array shaped like `image`, 0 on blocked pixels
+    """
+    blocked = image != 255
+    rows, cols = blocked.shape
+    index = numpy.arange(rows)[:, None]
+
+    # rows to the nearest blocked pixel above and below, in the same column
+    above = numpy.maximum.accumulate(numpy.where(blocked, index, -1), axis=0)
+    below = numpy.minimum.accumulate(numpy.where(blocked, index, rows)[::-1], axis=0)[::-1]
+    vertical = numpy.minimum(index - above, below - index).clip(max=max_distance + 1)
+
+    padded = numpy.zeros((rows, cols + 2 * max_distance), dtype=numpy.float32)
+    padded[:, max_distance:max_distance + cols] = numpy.square(vertical, dtype=numpy.float32)
+
+    squared = padded[:, max_distance:max_distance + cols].copy()
+    for offset in range(1, max_distance + 1):
+        left = padded[:, max_distance - offset:max_distance - offset + cols]
+        right = padded[:, max_distance + offset:max_distance + offset + cols]
+        numpy.minimum(squared, numpy.minimum(left, right) + offset * offset, out=squared)
+
+    return numpy.sqrt(squared).clip(max=max_distance)
+
+
+def add_clearance(mesh, image, distances=None):
+    """
+    Stores how large an agent each box and each portal of `mesh` admits, in
+    pixels of `image`:
+
+        - `BOX_CLEARANCE`: the largest distance to an obstacle inside the box
+        - `PORTAL_CLEARANCE`: aligned with `mesh[ADJ_NEIGHBORS]`, the distance
+          to an obstacle where paths cross the portal, at its midpoint (see
+          `nm_mesh.PORTAL_POINTS`), taking the smallest of the pixels around it
+
+    Boxes that only touch at a corner get the clearance at that corner, the
+    smallest distance of the four pixels around it (see `portal_contacts`).
+    `distances` may hold a precomputed `distance_transform(image)`.
+
+    Returns:
+        - `mesh`, with the clearance arrays added
+    """
+    if distances is None:
+        distances = distance_transform(image)
+    mesh[BOX_CLEARANCE] = box_clearances(mesh[BOXES], distances)
+    mesh[PORTAL_CLEARANCE] = portal_clearances(portal_contacts(mesh), distances)
+    return mesh
+
+
+def repair_clearance(mesh, image, rect, box_clearance, portal_clearance, max_distance=MAX_CLEARANCE):
+    """
+    Updates the clearance of `mesh` after the pixels of `image` inside `rect`
+    (xmin, xmax, ymin, ymax) changed, from a distance transform of the area
+    around the change only.
+
+    `box_clearance` holds the clearance of the boxes from before the change,
+    which keep their ids, and `portal_clearance` the clearance from before of
+    each portal of `mesh`, or NaN for a portal that is new. Only distances
+    within `max_distance` of `rect` can have changed, so everything else keeps
+    its clearance; boxes past `box_clearance` and removed boxes are new.
+
+    Returns:
+        - `mesh`, with the clearance arrays replaced
+    """
+    boxes = numpy.asarray(mesh[BOXES], dtype=numpy.float64)
+    segments = portal_contacts(mesh)
+    rows, cols = image.shape
+    reach = max_distance + 1
+    x1, x2, y1, y2 = rect
+
+    valid = (boxes[:, 0] < boxes[:, 1]) & (boxes[:, 2] < boxes[:, 3])
+    stale_boxes = valid & ((boxes[:, 0] <= x2 + reach) & (x1 - reach <= boxes[:, 1])
+                           & (boxes[:, 2] <= y2 + reach) & (y1 - reach <= boxes[:, 3]))
+    stale_boxes[len(box_clearance):] = valid[len(box_clearance):]
+    sx = numpy.minimum(segments[:, 0], segments[:, 2]), numpy.maximum(segments[:, 0], segments[:, 2])
+    sy = numpy.minimum(segments[:, 1], segments[:, 3]), numpy.maximum(segments[:, 1], segments[:, 3])
+    stale_portals = numpy.isnan(portal_clearance) | ((sx[0] <= x2 + reach) & (x1 - reach <= sx[1])
+                                                     & (sy[0] <= y2 + reach) & (y1 - reach <= sy[1]))
+
+    box_clearance = numpy.concatenate([box_clearance, numpy.zeros(len(boxes) - len(box_clearance))])
+    box_clearance = numpy.where(valid, box_clearance, 0).astype(numpy.float32)
+    portal_clearance = numpy.asarray(portal_clearance, dtype=numpy.float32).copy()
+
+    # the distances of the stale boxes and portals only depend on pixels this close
+    stale = boxes[stale_boxes]
+    wx1 = min([x1] + stale[:, 0].tolist() + sx[0][stale_portals].tolist()) - reach
+    wx2 = max([x2] + stale[:, 1].tolist() + sx[1][stale_portals].tolist()) + reach
+    wy1 = min([y1] + stale[:, 2].tolist() + sy[0][stale_portals].tolist()) - reach
+    wy2 = max([y2] + stale[:, 3].tolist() + sy[1][stale_portals].tolist()) + reach
+    wx1, wy1 = max(math.floor(wx1), 0), max(math.floor(wy1), 0)
+    wx2, wy2 = min(math.ceil(wx2), rows), min(math.ceil(wy2), cols)
+    distances = distance_transform(image[wx1:wx2, wy1:wy2], max_distance)
+
+    box_clearance[stale_boxes] = box_clearances(boxes[stale_boxes], distances, (wx1, wy1))
+    portal_clearance[stale_portals] = portal_clearances(segments[stale_portals], distances, (wx1, wy1))
+
+    mesh[BOX_CLEARANCE] = box_clearance
+    mesh[PORTAL_CLEARANCE] = portal_clearance
+    return mesh
+
+
+def portal_contacts(mesh):
+    """
+    The portal segments of `mesh`, except that the portal of two boxes that only
+    touch at a corner is that corner, rather than the middle of the neighbor
+    box it collapses to in `mesh[PORTAL_SEGMENTS]`.
+    """
+    segments = numpy.array(mesh[PORTAL_SEGMENTS], dtype=numpy.float64)
+    corner = (segments[:, 0] == segments[:, 2]) & (segments[:, 1] == segments[:, 3])
+    boxes = numpy.asarray(mesh[BOXES], dtype=numpy.float64)
+    src = boxes[numpy.repeat(numpy.arange(len(boxes)), numpy.diff(mesh[ADJ_OFFSETS]))[corner]]
+    dst = boxes[numpy.asarray(mesh[ADJ_NEIGHBORS])[corner]]
+    x = numpy.where(src[:, 1] == dst[:, 0], src[:, 1], src[:, 0])
+    y = numpy.where(src[:, 3] == dst[:, 2], src[:, 3], src[:, 2])
+    segments[corner] = numpy.stack([x, y, x, y], axis=1)
+    return segments
+
+
+def box_clearances(boxes, distances, origin=(0, 0)):
+    """
+    The largest of `distances` inside each of `boxes`, given in coordinates
+    shifted by `origin` (the position of `distances` inside the image).
+    """
+    ox, oy = origin
+    rows, cols = distances.shape
+    clearance = numpy.zeros(len(boxes), dtype=numpy.float32)
+    for i, (x1, x2, y1, y2) in enumerate(numpy.asarray(boxes).tolist()):
+        x1, y1 = max(math.floor(x1) - ox, 0), max(math.floor(y1) - oy, 0)
+        x2, y2 = min(math.ceil(x2) - ox, rows), min(math.ceil(y2) - oy, cols)
+        if x1 < x2 and y1 < y2:  # removed boxes have inverted extents
+            clearance[i] = distances[x1:x2, y1:y2].max()
+    return clearance
+
+
+def portal_clearances(segments, distances, origin=(0, 0)):
+    """
+    The smallest of `distances` around the midpoint of each of the portal
+    `segments`, on both sides of it and, when the midpoint falls between two
+    pixels along the portal, of both, with coordinates as in `box_clearances`.
+    A segment collapsed to a point is a corner contact (see `portal_contacts`)
+    and takes the smallest of the four pixels around it.
+    """
+    ox, oy = origin
+    rows, cols = distances.shape
+    clearance = numpy.zeros(len(segments), dtype=numpy.float32)
+    for i, (x1, y1, x2, y2) in enumerate(numpy.asarray(segments).tolist()):
+        x1, x2, y1, y2 = x1 - ox, x2 - ox, y1 - oy, y2 - oy
+        if x1 == x2 and y1 < y2:
+            # a border at a fixed x, between rows x - 1 and x, crossed at its midpoint
+            x = math.floor(x1)
+            span = slice(*crossing_pixels(y1, y2, cols))
+            sides = distances[max(x - 1, 0):min(x + 1, rows), span]
+        elif y1 == y2 and x1 < x2:
+            y = math.floor(y1)
+            span = slice(*crossing_pixels(x1, x2, rows))
+            sides = distances[span, max(y - 1, 0):min(y + 1, cols)]
+        else:
+            # the agent squeezes between the pixels on both diagonals of the corner
+            x, y = math.floor(x1), math.floor(y1)
+            sides = distances[max(x - 1, 0):min(x + 1, rows), max(y - 1, 0):min(y + 1, cols)].reshape(-1, 1)
+        if sides.size:
+            clearance[i] = sides.min()
+    return clearance
+
+
+def crossing_pixels(lo, hi, size):
+    """
+    The range of pixels, along a portal from `lo` to `hi`, that touch its
+    midpoint: one, or the two on either side of a midpoint between pixels.
+    """
+    middle = (lo + hi) / 2
+    return max(math.ceil(middle) - 1, math.floor(lo), 0), min(math.floor(middle) + 1, math.ceil(hi), size)
@@ -0,0 +1,154 @@
+import math
+from heapq import heappush, heappop
+
+from nm_mesh import ADJ_OFFSETS, ADJ_NEIGHBORS, EDGE_COSTS, box_middles, boxes_of, portal_path
+from nm_spatial import locate_points
+
+
+class DStarLite:
+    """
+    D* Lite planner over the box graph of a mesh, toward a fixed destination.
+
+    The search runs backward from the destination box and keeps its g/rhs
+    values between calls to `replan`, so a moving start or a few changed edges
+    only repair the part of the search they affect. `expansions` holds the
+    number of boxes expanded by the last `replan`, `total_expansions` the sum
+    over all of them.
+    """
+
+    def __init__(self, mesh, destination_point):
+        self.mesh = mesh
+        self.offsets = mesh[ADJ_OFFSETS]
+        self.neighbors = mesh[ADJ_NEIGHBORS]
+        self.edge_costs = mesh[EDGE_COSTS]
+        self.middles = box_middles(mesh)
+
+        self.destination_point = destination_point
+        self.goal = int(locate_points([destination_point], mesh)[0])
+
+        self.overrides = {}  # (box, box) -> cost set by `set_edge_cost`
+        self.g = {}
+        self.rhs = {}
+        self.queue = []
+        self.queued = {}  # box -> key of its live queue entry
+        self.km = 0.0
+        self.start = None
+        self.last = None
+
+        self.expansions = 0
+        self.total_expansions = 0
+
+        if self.goal >= 0:
+            self.rhs[self.goal] = 0.0
+
+    def set_edge_cost(self, box_a, box_b, cost):
+        """
+        Changes the cost of the edge between two adjacent boxes, in both
+        directions; `math.inf` closes it. Takes effect on the next `replan`.
+        """
+        self.overrides[(box_a, box_b)] = cost
+        self.overrides[(box_b, box_a)] = cost
+        if self.start is not None:
+            self.update_box(box_a)
+            self.update_box(box_b)
+
+    def replan(self, source_point):
+        """
+        Returns the cheapest path from `source_point` to the destination,
+        reusing the previous search.
+
+        Returns:
+            - A path (list of points) from `source_point` to the destination if exists
+            - List of boxes expanded by this replan
+        """
+        start = int(locate_points([source_point], self.mesh)[0])
+        self.expansions = 0
+        if start < 0 or self.goal < 0:
+            print("No Path")
+            return ([], [])
+
+        if self.start is None:
+            self.start = self.last = start
+            self.push(self.goal)
+        elif start != self.start:
+            # keys computed against the old start stay valid lower bounds
+            self.start = start
+            self.km += self.heuristic(self.last, start)
+            self.last = start
+
+        expanded = self.compute_shortest_path()
+        self.total_expansions += self.expansions
+
+        if math.isinf(self.g.get(start, math.inf)):
+            print("No Path")
+            return ([], boxes_of(expanded, self.mesh))
+
+        box_path = [start]
+        box = start
+        while box != self.goal:
+            box = min(self.successors(box), key=lambda pair: pair[1] + self.g.get(pair[0], math.inf))[0]
+            box_path.append(box)
+
+        path = portal_path(box_path, source_point, self.destination_point, self.mesh)
+        return (path, boxes_of(expanded, self.mesh))
+
+    def heuristic(self, box_a, box_b):
+        (ax, ay), (bx, by) = self.middles[box_a].tolist(), self.middles[box_b].tolist()
+        return math.hypot(bx - ax, by - ay)
+
+    def successors(self, box):
+        start, end = self.offsets[box], self.offsets[box + 1]
+        for nb, cost in zip(self.neighbors[start:end].tolist(), self.edge_costs[start:end].tolist()):
+            yield nb, self.overrides.get((box, nb), cost)
+
+    def key(self, box):
+        best = min(self.g.get(box, math.inf), self.rhs.get(box, math.inf))
+        return (best + self.heuristic(self.start, box) + self.km, best)
+
+    # D* Lite re-keys queued boxes as km grows instead of relaxing costs, so it
+    # keeps its own heap rather than a graph_search.SearchSpace
+    def push(self, box):
+        key = self.key(box)
+        self.queued[box] = key
+        heappush(self.queue, (key, box))
+
+    def update_box(self, box):
+        if box != self.goal:
+            self.rhs[box] = min((cost + self.g.get(nb, math.inf) for nb, cost in self.successors(box)),
+                                default=math.inf)
+        self.queued.pop(box, None)  # any older entry becomes stale
+        if self.g.get(box, math.inf) != self.rhs.get(box, math.inf):
+            self.push(box)
+
+    def compute_shortest_path(self):
+        expanded = set()
+        start = self.start
+
+        while self.queue:
+            key, box = self.queue[0]
+            if self.queued.get(box) != key:
+                heappop(self.queue)  # stale entry
+                continue
+            if key >= self.key(start) and self.rhs.get(start, math.inf) == self.g.get(start, math.inf):
+                break
+
+            heappop(self.queue)
+            del self.queued[box]
+            new_key = self.key(box)
+            if key < new_key:
+                self.push(box)
+                continue
+
+            self.expansions += 1
+            expanded.add(box)
+            if self.g.get(box, math.inf) > self.rhs[box]:
+                self.g[box] = self.rhs[box]
+                for nb, _ in self.successors(box):
+                    self.update_box(nb)
+            else:
+                self.g[box] = math.inf
+                self.update_box(box)
+                for nb, _ in self.successors(box):
+                    self.update_box(nb)
+
+        return expanded
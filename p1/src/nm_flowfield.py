@@ -0,0 +1,117 @@
+import math
+from collections import OrderedDict
+
+import numpy
+
+from graph_search import SearchSpace, dijkstra
+from nm_mesh import ADJ_OFFSETS, ADJ_NEIGHBORS, EDGE_COSTS, PORTAL_POINTS, boxes_of, connected, get_reverse_edges
+from nm_spatial import locate_points
+
+# flow fields kept per cache before the least recently used one is dropped
+CACHE_SIZE = 32
+
+
+def build_flow_field(dest_box, mesh):
+    """
+    Runs one reverse Dijkstra from `dest_box` over the box graph and records,
+    for every box, which box to move into next and through which portal.
+
+    Returns:
+        - A dict of three arrays indexed by box id: `next_box` and `next_edge`
+          (the CSR position of the portal to cross, -1 at the destination and
+          where it is unreachable) and `cost` (inf where unreachable)
+    """
+    offsets = mesh[ADJ_OFFSETS]
+    neighbors = mesh[ADJ_NEIGHBORS]
+    edge_costs = mesh[EDGE_COSTS]
+    reverse = get_reverse_edges(mesh)
+    n = len(offsets) - 1
+
+    # each box keeps the edge agents cross from it toward its parent
+    space = SearchSpace(n)
+    space.start(dest_box, -1, cost=0.0)
+
+    def box_neighbors(box):
+        start, end = offsets[box], offsets[box + 1]
+        return zip(neighbors[start:end].tolist(), edge_costs[start:end].tolist(), reverse[start:end].tolist())
+
+    dijkstra(space, box_neighbors)
+
+    next_edge = numpy.array([-1 if edge is None else edge for edge in space.data], dtype=numpy.int64)
+    return {'dest_box': dest_box, 'next_box': numpy.array(space.parents, dtype=numpy.int32),
+            'next_edge': next_edge, 'cost': numpy.array(space.costs)}
+
+
+def follow_flow_field(source_point, destination_point, field, mesh):
+    """
+    Walks the flow field from the box of `source_point`: O(path length) lookups.
+
+    Returns:
+        - A path (list of points) from `source_point` to `destination_point` if exists
+        - List of boxes along the path
+    """
+    portal_points = mesh[PORTAL_POINTS]
+    next_box = field['next_box']
+    next_edge = field['next_edge']
+
+    box = int(locate_points([source_point], mesh)[0])
+    if box < 0 or box >= len(next_box) or math.isinf(field['cost'][box]):
+        print("No Path")
+        return ([], [])
+
+    path = [source_point]
+    box_path = [box]
+    while box != field['dest_box']:
+        path.append(tuple(portal_points[next_edge[box]].tolist()))
+        box = int(next_box[box])
+        box_path.append(box)
+    path.append(destination_point)
+
+    return (path, boxes_of(box_path, mesh))
+
+
+class FlowFieldCache:
+    """
+    Flow fields of one mesh, keyed by destination box, with LRU eviction.
+    Agents sharing a destination box reuse one reverse search.
+    """
+
+    def __init__(self, mesh, maxsize=CACHE_SIZE):
+        self.mesh = mesh
+        self.maxsize = maxsize
+        self.fields = OrderedDict()
+
+    def get(self, dest_box):
+        field = self.fields.get(dest_box)
+        if field is None:
+            field = build_flow_field(dest_box, self.mesh)
+            self.fields[dest_box] = field
+            if len(self.fields) > self.maxsize:
+                self.fields.popitem(last=False)
+        else:
+            self.fields.move_to_end(dest_box)
+        return field
+
+    def invalidate(self, box_ids):
+        """
+        Drops the fields that reach any of `box_ids`. Fields that reach none of
+        them describe a part of the mesh a repair around those boxes can't change.
+        """
+        box_ids = numpy.asarray(box_ids, dtype=numpy.int64)
+        for dest_box, field in list(self.fields.items()):
+            costs = field['cost']
+            inside = box_ids[box_ids < len(costs)]
+            if dest_box in box_ids or numpy.isfinite(costs[inside]).any():
+                del self.fields[dest_box]
+
+    def find_path(self, source_point, destination_point):
+        """
+        Same return values as `follow_flow_field`, for any source and destination.
+        Like `nm_batch.find_paths`, this follows the `EDGE_COSTS` box graph, so the
+        path may differ from the one `find_path` gives.
+        """
+        src_box, dest_box = locate_points([source_point, destination_point], self.mesh).tolist()
+        if src_box < 0 or dest_box < 0 or not connected(src_box, dest_box, self.mesh):
+            print("No Path")
+            return ([], [])
+        return follow_flow_field(source_point, destination_point, self.get(dest_box), self.mesh)
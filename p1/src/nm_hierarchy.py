@@ -0,0 +1,211 @@
+import math
+from heapq import heappush, heappop
+
+import numpy
+
+from nm_mesh import (ADJ_OFFSETS, ADJ_NEIGHBORS, EDGE_COSTS, box_middles, boxes_of, connected,
+                     portal_path)
+from nm_spatial import locate_points
+
+HIER_REGIONS = 'hier_regions'
+HIER_OFFSETS = 'hier_offsets'
+HIER_NEIGHBORS = 'hier_neighbors'
+HIER_COSTS = 'hier_costs'
+
+# side, in pixels, of the square cells boxes are clustered into
+REGION_SIZE = 64
+
+
+def build_hierarchy(mesh, region_size=REGION_SIZE):
+    """
+    Adds an HPA*-style abstraction layer to `mesh`.
+
+    Boxes are clustered into regions by the cell of a `region_size` grid their
+    middle falls in. Boxes with a neighbor in another region are entrances. The
+    abstract graph links every entrance to its neighbors across the region
+    border and to the other entrances of its own region, with the cost of the
+    shortest path that stays inside the region.
+
+    The abstract graph is stored as CSR arrays over box ids (non-entrances have
+    no abstract edges), so `save_mesh` writes it next to the mesh arrays and
+    `load_mesh` brings it back.
+
+    Returns:
+        - `mesh`, with the hierarchy arrays added
+    """
+    offsets = mesh[ADJ_OFFSETS]
+    neighbors = mesh[ADJ_NEIGHBORS]
+    costs = mesh[EDGE_COSTS]
+    n = len(offsets) - 1
+
+    cells = numpy.floor(box_middles(mesh) / region_size).astype(numpy.int64)
+    _, regions = numpy.unique(cells, axis=0, return_inverse=True)
+    regions = regions.reshape(-1).astype(numpy.int32)
+
+    src = numpy.repeat(numpy.arange(n), numpy.diff(offsets))
+    crossing = regions[src] != regions[neighbors]
+    is_entrance = numpy.bincount(src[crossing], minlength=n) > 0
+
+    # inter-region edges are plain mesh edges between entrances
+    edge_src = [src[crossing]]
+    edge_dst = [neighbors[crossing].astype(numpy.int64)]
+    edge_cost = [costs[crossing]]
+
+    # intra-region edges join the entrances of a region through the region
+    for entrance in numpy.flatnonzero(is_entrance).tolist():
+        dist, _ = region_search(entrance, regions[entrance], mesh, regions)
+        others = [box for box in dist if box != entrance and is_entrance[box]]
+        edge_src.append(numpy.full(len(others), entrance, dtype=numpy.int64))
+        edge_dst.append(numpy.asarray(others, dtype=numpy.int64))
+        edge_cost.append(numpy.asarray([dist[box] for box in others], dtype=numpy.float64))
+
+    edge_src = numpy.concatenate(edge_src)
+    order = numpy.argsort(edge_src, kind='stable')
+
+    hier_offsets = numpy.zeros(n + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(edge_src, minlength=n), out=hier_offsets[1:])
+
+    mesh[HIER_REGIONS] = regions
+    mesh[HIER_OFFSETS] = hier_offsets
+    mesh[HIER_NEIGHBORS] = numpy.concatenate(edge_dst)[order].astype(numpy.int32)
+    mesh[HIER_COSTS] = numpy.concatenate(edge_cost)[order]
+    return mesh
+
+
+def region_search(start, region, mesh, regions, goal=None):
+    """
+    Dijkstra over the box graph from `start`, never leaving `region`.
+
+    Returns:
+        - Dict of box -> cost from `start`
+        - Dict of box -> previous box on the cheapest path
+    """
+    offsets = mesh[ADJ_OFFSETS]
+    neighbors = mesh[ADJ_NEIGHBORS]
+    costs = mesh[EDGE_COSTS]
+
+    # dicts rather than a graph_search.SearchSpace, whose per-box lists would
+    # cost a pass over the whole mesh for every entrance
+    dist = {start: 0.0}
+    prev = {start: None}
+    frontier = [(0.0, start)]
+
+    while frontier:
+        cost, box = heappop(frontier)
+        if cost > dist[box]:
+            continue  # stale entry
+        if box == goal:
+            break
+
+        start_i, end_i = offsets[box], offsets[box + 1]
+        box_neighbors = neighbors[start_i:end_i]
+        for nb, nb_region, step in zip(box_neighbors.tolist(), regions[box_neighbors].tolist(),
+                                       costs[start_i:end_i].tolist()):
+            new_cost = cost + step
+            if nb_region != region or new_cost >= dist.get(nb, math.inf):
+                continue
+            dist[nb] = new_cost
+            prev[nb] = box
+            heappush(frontier, (new_cost, nb))
+
+    return dist, prev
+
+
+def find_path_hierarchical(source_point, destination_point, mesh):
+    """
+    Searches for a path through the abstract graph built by `build_hierarchy`,
+    then refines every abstract step into boxes inside the region it crosses.
+
+    Returns:
+        - A path (list of points) from `source_point` to `destination_point` if exists
+        - List of boxes explored by the algorithm
+    """
+    regions = mesh[HIER_REGIONS]
+    hier_offsets = mesh[HIER_OFFSETS]
+    hier_neighbors = mesh[HIER_NEIGHBORS]
+    hier_costs = mesh[HIER_COSTS]
+    middles = box_middles(mesh)
+
+    src_box, dest_box = locate_points([source_point, destination_point], mesh).tolist()
+    if src_box < 0 or dest_box < 0 or not connected(src_box, dest_box, mesh):
+        print("No Path")
+        return ([], [])
+
+    # connect both endpoints to the entrances of their regions
+    src_region, dest_region = int(regions[src_box]), int(regions[dest_box])
+    src_dist, src_prev = region_search(src_box, src_region, mesh, regions)
+    dest_dist, dest_prev = region_search(dest_box, dest_region, mesh, regions)
+    explored = set(src_dist) | set(dest_dist)
+
+    goal_x, goal_y = middles[dest_box].tolist()
+
+    def heuristic(box):
+        x, y = middles[box].tolist()
+        return math.hypot(goal_x - x, goal_y - y)
+
+    def successors(box):
+        if box == src_box:
+            for nb, cost in src_dist.items():
+                if nb != box and (hier_offsets[nb] < hier_offsets[nb + 1] or nb == dest_box):
+                    yield nb, cost
+        start, end = hier_offsets[box], hier_offsets[box + 1]
+        yield from zip(hier_neighbors[start:end].tolist(), hier_costs[start:end].tolist())
+        if box in dest_dist and box != dest_box:
+            yield dest_box, dest_dist[box]
+
+    # the abstract graph only touches entrances, so dicts again
+    costs = {src_box: 0.0}
+    came_from = {src_box: None}
+    closed = set()
+    frontier = [(heuristic(src_box), src_box)]
+
+    while frontier:
+        _, box = heappop(frontier)
+        if box == dest_box:
+            break
+        if box in closed:
+            continue  # stale entry
+        closed.add(box)
+
+        for nb, step in successors(box):
+            new_cost = costs[box] + step
+            if new_cost < costs.get(nb, math.inf):
+                costs[nb] = new_cost
+                came_from[nb] = box
+                heappush(frontier, (new_cost + heuristic(nb), nb))
+
+    if dest_box not in came_from:
+        print("No Path")
+        return ([], boxes_of(explored | closed, mesh))
+
+    abstract_path = trace(dest_box, came_from)
+
+    # refine each abstract step into the boxes it crosses
+    box_path = [src_box]
+    for box_a, box_b in zip(abstract_path, abstract_path[1:]):
+        if box_a == src_box and box_b in src_prev:
+            leg = trace(box_b, src_prev)
+        elif box_b == dest_box and box_a in dest_prev:
+            leg = trace(box_a, dest_prev)[::-1]
+        elif regions[box_a] == regions[box_b]:
+            _, prev = region_search(box_a, int(regions[box_a]), mesh, regions, goal=box_b)
+            explored.update(prev)
+            leg = trace(box_b, prev)
+        else:
+            leg = [box_a, box_b]  # neighbors across a region border
+        box_path.extend(leg[1:])
+
+    path = portal_path(box_path, source_point, destination_point, mesh)
+    return (path, boxes_of(explored | closed, mesh))
+
+
+def trace(box, came_from):
+    """
+    Follows `came_from` back from `box`, returning the boxes from the root to `box`.
+    """
+    boxes = []
+    while box is not None:
+        boxes.append(box)
+        box = came_from[box]
+    boxes.reverse()
+    return boxes
@@ -1,89 +1,272 @@
 import sys
-import random
-import pickle
+import json
+import time
+import queue
+import threading
 import traceback
 import tkinter
 
+import numpy
+
+import nm_mesh
 import nm_pathfinder
 
-if len(sys.argv) != 4:
-    print("usage: %s map.gif map.mesh.pickle subsample_factor" % sys.argv[0])
-    sys.exit(-1)
+# how often (ms) the Tk loop picks up paths the worker has finished
+POLL_INTERVAL = 15
+
+
+class PathWorker:
+    """
+    Runs `find_path` on a background thread so the Tk event loop never waits on it.
+
+    Only the newest query matters: submitting replaces a query still waiting
+    to run. Finished queries are put on `results` as
+    `(query_id, path, visited_boxes, error, timings)`, where `timings` holds the
+    perf_counter times the query was submitted, started and finished; the Tk
+    loop picks them up through `after()`, as Tk may only be touched from its
+    own thread.
+    """
+
+    def __init__(self, mesh):
+        self.mesh = mesh
+        self.results = queue.Queue()
+        self.pending = None
+        self.condition = threading.Condition()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def submit(self, query_id, source_point, destination_point):
+        with self.condition:
+            self.pending = (query_id, source_point, destination_point, time.perf_counter())
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                query_id, source_point, destination_point, submitted = self.pending
+                self.pending = None
+
+            started = time.perf_counter()
+            try:
+                path, visited_boxes = nm_pathfinder.find_path(source_point, destination_point, self.mesh)
+                error = None
+            except Exception:
+                path, visited_boxes = [], []
+                error = traceback.format_exc()
+            self.results.put((query_id, path, visited_boxes, error,
+                              (submitted, started, time.perf_counter())))
+
+
+class Session:
+    """
+    What the clicks so far have selected: a source, a destination, and the
+    path found between them. Clicks alternate between picking the source,
+    picking the destination (which starts a query) and clearing both.
+    """
+
+    def __init__(self, worker):
+        self.worker = worker
+        self.source_point = None
+        self.destination_point = None
+        self.visited_boxes = []
+        self.path = []
+        self.query_id = 0  # a result for any other query has been overtaken
+        self.waiting = False
+
+    def click(self, point):
+        if self.source_point and self.destination_point:
+            self.source_point = None
+            self.destination_point = None
+            self.visited_boxes = []
+            self.path = []
+            self.query_id += 1
+            self.waiting = False
+
+        elif not self.source_point:
+            self.source_point = point
+
+        else:
+            self.destination_point = point
+            self.query_id += 1
+            self.waiting = True
+            self.worker.submit(self.query_id, self.source_point, self.destination_point)
+
+    def receive(self, result):
+        """
+        Takes a result from the worker.
+
+        Returns:
+            - Whether it was for the current query, and so changed the session
+        """
+        query_id, path, visited_boxes, error, _ = result
+        if query_id != self.query_id:
+            return False
+        self.waiting = False
+        if error:
+            self.destination_point = None
+            print(error, end='', file=sys.stderr)
+        else:
+            self.path, self.visited_boxes = path, visited_boxes
+        return True
+
+
+class MapView:
+    """
+    The subsampled map with a session drawn over it.
+
+    Every canvas item is created once and then moved, shown or hidden: one
+    line for the whole path, one oval per endpoint, and a pool of rectangles
+    (tagged "box") that grows to the most boxes any search has visited.
+    """
+
+    def __init__(self, master, map_filename, subsample):
+        self.subsample = subsample
+        big_image = tkinter.PhotoImage(file=map_filename)
+        self.small_image = big_image.subsample(subsample, subsample)
+
+        self.canvas = tkinter.Canvas(master, width=self.small_image.width(), height=self.small_image.height())
+        self.canvas.pack()
+        self.canvas.create_image((0,0), anchor=tkinter.NW, image=self.small_image)
+
+        self.boxes = []
+        self.shown_boxes = None  # the visited_boxes list the pool shows
+        self.path_line = self.canvas.create_line(0,0,0,0, width=2.0, fill='red', state=tkinter.HIDDEN)
+        self.source_oval = self.canvas.create_oval(0,0,0,0, width=2, outline='red', state=tkinter.HIDDEN)
+        self.destination_oval = self.canvas.create_oval(0,0,0,0, width=2, outline='red', state=tkinter.HIDDEN)
 
-_, MAP_FILENAME, MESH_FILENAME, SUBSAMPLE = sys.argv
-SUBSAMPLE = int(SUBSAMPLE)
+    def shrink(self, values):
+        return [v/self.subsample for v in values]
 
-with open(MESH_FILENAME, 'rb') as f:
-  mesh = pickle.load(f)
+    def redraw(self, session):
+        canvas = self.canvas
 
-master = tkinter.Tk()
+        if session.visited_boxes is not self.shown_boxes:
+            canvas.itemconfigure('box', state=tkinter.HIDDEN)
+            for i, box in enumerate(session.visited_boxes):
+                x1,x2,y1,y2 = self.shrink(box)
+                if i == len(self.boxes):
+                    self.boxes.append(canvas.create_rectangle(y1,x1,y2,x2, outline='pink', tags='box'))
+                else:
+                    canvas.coords(self.boxes[i], y1,x1,y2,x2)
+                    canvas.itemconfigure(self.boxes[i], state=tkinter.NORMAL)
+            self.shown_boxes = session.visited_boxes
+            # the path and the endpoints stay on top of the boxes
+            canvas.tag_raise(self.path_line)
+            canvas.tag_raise(self.source_oval)
+            canvas.tag_raise(self.destination_oval)
 
-big_image = tkinter.PhotoImage(file=MAP_FILENAME)
-small_image = big_image.subsample(SUBSAMPLE,SUBSAMPLE)
-BIG_WIDTH, BIG_HEIGHT = big_image.width(), big_image.height()
-SMALL_WIDTH, SMALL_HEIGHT = small_image.width(), small_image.height()
+        if len(session.path) > 1:
+            canvas.coords(self.path_line, *[v for x, y in session.path for v in self.shrink((y, x))])
+            canvas.itemconfigure(self.path_line, state=tkinter.NORMAL)
+        else:
+            canvas.itemconfigure(self.path_line, state=tkinter.HIDDEN)
 
-canvas = tkinter.Canvas(master, width=SMALL_WIDTH, height=SMALL_HEIGHT)
-canvas.pack()
+        for oval, point in ((self.source_oval, session.source_point),
+                            (self.destination_oval, session.destination_point)):
+            if point:
+                x,y = self.shrink(point)
+                canvas.coords(oval, y-5,x-5,y+5,x+5)
+                canvas.itemconfigure(oval, state=tkinter.NORMAL)
+            else:
+                canvas.itemconfigure(oval, state=tkinter.HIDDEN)
 
 
-def shrink(values):
-    return [v/SUBSAMPLE for v in values]
+def run_interactive(map_filename, mesh, subsample, session_filename=None):
+    """
+    Opens the map; clicks pick a source, then a destination, then clear both.
+    With `session_filename`, every click is recorded there for `replay`.
+    """
+    master = tkinter.Tk()
+    view = MapView(master, map_filename, subsample)
+    session = Session(PathWorker(mesh))
+    record = open(session_filename, 'w') if session_filename else None
+    started = time.perf_counter()
 
-source_point = None
-destination_point = None
-visited_boxes = []
-path = []
+    def on_click(event):
+        point = event.y*subsample, event.x*subsample
+        if record:
+            record.write(json.dumps({'time': time.perf_counter() - started, 'point': point}) + '\n')
+            record.flush()
+        session.click(point)
+        view.redraw(session)
 
+    def poll():
+        changed = False
+        while not session.worker.results.empty():
+            changed |= session.receive(session.worker.results.get())
+        if changed:
+            view.redraw(session)
+        master.after(POLL_INTERVAL, poll)
 
-def redraw():
+    view.canvas.bind('<Button-1>', on_click)
+    view.redraw(session)
+    master.after(POLL_INTERVAL, poll)
+    master.mainloop()
+    if record:
+        record.close()
 
-    canvas.delete(tkinter.ALL)
-    canvas.create_image((0,0), anchor=tkinter.NW, image=small_image)
 
-    for box in visited_boxes:
-        x1,x2,y1,y2 = shrink(box)
-        canvas.create_rectangle(y1,x1,y2,x2,outline='pink')
+def replay(mesh, clicks, realtime=False):
+    """
+    Replays recorded `(time, point)` clicks without a window. Each query is
+    awaited before the next click, unless `realtime` spaces the clicks as
+    recorded, in which case a click may overtake a query still running.
 
-    for i in range(len(path) - 1):
-        x1, y1 = shrink(path[i])
-        x2, y2 = shrink(path[i + 1])
-        canvas.create_line(y1,x1,y2,x2,width=2.0,fill='red')
+    Returns:
+        - Dict of "latency" (submit to result) and "search" (find_path) -> list
+          of seconds, one per query answered
+    """
+    session = Session(PathWorker(mesh))
+    timings = {'latency': [], 'search': []}
+    started = time.perf_counter()
 
-    if source_point:
-        x,y = shrink(source_point)
-        canvas.create_oval(y-5,x-5,y+5,x+5,width=2,outline='red')
+    def receive(result):
+        submitted, searched, finished = result[4]
+        if session.receive(result):
+            timings['latency'].append(finished - submitted)
+            timings['search'].append(finished - searched)
 
-    if destination_point:
-        x,y = shrink(destination_point)
-        canvas.create_oval(y-5,x-5,y+5,x+5,width=2,outline='red')
+    for click_time, point in clicks:
+        if realtime:
+            time.sleep(max(0.0, click_time - (time.perf_counter() - started)))
+            while not session.worker.results.empty():
+                receive(session.worker.results.get())
+        session.click(tuple(point))
+        while session.waiting and not realtime:
+            receive(session.worker.results.get())
 
+    while session.waiting:
+        receive(session.worker.results.get())
+    return timings
 
-def on_click(event):
 
-    global source_point, destination_point, visited_boxes, path
+def read_session(filename):
+    with open(filename) as f:
+        return [(click['time'], click['point']) for click in map(json.loads, f) if click]
 
-    if source_point and destination_point:
-        source_point = None
-        destination_point = None
-        visited_boxes = []
-        path = []
 
-    elif not source_point:
-        source_point = event.y*SUBSAMPLE, event.x*SUBSAMPLE
+if __name__ == '__main__':
 
-    else:
-        destination_point = event.y*SUBSAMPLE, event.x*SUBSAMPLE
-        try:
-            path, visited_boxes = nm_pathfinder.find_path(source_point, destination_point, mesh)
+    if len(sys.argv) in (4, 5) and sys.argv[1] == '--replay':
+        mesh = nm_mesh.as_array_mesh(nm_mesh.load_mesh(sys.argv[2]))
+        timings = replay(mesh, read_session(sys.argv[3]), realtime=sys.argv[4:] == ['realtime'])
 
-        except:
-            destination_point = None
-            traceback.print_exc()
+        print("%d queries replayed." % len(timings['latency']))
+        print("%-16s %12s %12s %12s %12s" % ("", "p50", "p90", "p99", "max"))
+        for name, values in timings.items():
+            if values:
+                print("%-16s" % (name + " (ms)")
+                      + "".join(" %12.3f" % (v * 1000) for v in numpy.percentile(values, [50, 90, 99, 100])))
+        sys.exit(0)
 
-    redraw()
+    if len(sys.argv) not in (4, 5):
+        print("usage: %s map.gif map.mesh subsample_factor [session.jsonl]" % sys.argv[0])
+        print("       %s --replay map.mesh session.jsonl [realtime]" % sys.argv[0])
+        sys.exit(-1)
 
-canvas.bind('<Button-1>', on_click)
+    _, MAP_FILENAME, MESH_FILENAME, SUBSAMPLE = sys.argv[:4]
 
-redraw()
-master.mainloop()
+    # accepts both a `.mesh` array directory and a legacy `.mesh.pickle`
+    mesh = nm_mesh.as_array_mesh(nm_mesh.load_mesh(MESH_FILENAME))
+    run_interactive(MAP_FILENAME, mesh, int(SUBSAMPLE), sys.argv[4] if len(sys.argv) == 5 else None)
@@ -0,0 +1,204 @@
+import io
+import random
+import sys
+import contextlib
+from itertools import repeat
+
+import numpy
+
+from graph_search import SearchSpace, dijkstra
+from nm_mesh import (ADJ_OFFSETS, ADJ_NEIGHBORS, PORTAL_POINTS, box_middles, get_reverse_edges,
+                     load_mesh, save_mesh)
+
+LANDMARKS = 'landmarks'
+LANDMARK_DISTS = 'landmark_dists'
+LANDMARK_DISTS_TO = 'landmark_dists_to'
+LANDMARK_KEYS = (LANDMARKS, LANDMARK_DISTS, LANDMARK_DISTS_TO)
+
+# stands in for "unreachable" so differences of two unreachable edges stay 0
+UNREACHABLE = numpy.finfo(numpy.float32).max
+
+
+def build_landmarks(mesh, count=8, seed_box=0):
+    """
+    Picks `count` landmarks by farthest-point selection and stores the
+    distances from every landmark to every node of the portal graph (see
+    `portal_graph`) and back.
+
+    Paths are measured between portal points as `nm_pathfinder.find_path`
+    measures them, so the bounds of `landmark_bounds` never overestimate its
+    costs. Landmarks are nodes of the portal graph, that is edge ids, starting
+    from the first edge out of `seed_box`. Distances are kept as two E x count
+    float32 arrays, one row per edge, so the bounds for all edges out of a box
+    come from one gather.
+
+    Returns:
+        - `mesh`, with `LANDMARKS`, `LANDMARK_DISTS` (from the landmarks) and
+          `LANDMARK_DISTS_TO` (to them) added
+    """
+    offsets, targets, weights = portal_graph(mesh)
+    reverse_offsets, reverse_targets, reverse_weights = transpose_graph(offsets, targets, weights)
+    n = len(offsets) - 1
+    count = min(count, n)
+
+    landmarks = []
+    dists = numpy.empty((n, count), dtype=numpy.float32)
+    dists_to = numpy.empty((n, count), dtype=numpy.float32)
+    nearest = numpy.full(n, numpy.inf)
+
+    edge = int(mesh[ADJ_OFFSETS][seed_box])
+    for k in range(count):
+        landmarks.append(edge)
+        dist = graph_distances(edge, offsets, targets, weights)
+        dists[:, k] = numpy.where(numpy.isinf(dist), UNREACHABLE, dist)
+        dist_to = graph_distances(edge, reverse_offsets, reverse_targets, reverse_weights)
+        dists_to[:, k] = numpy.where(numpy.isinf(dist_to), UNREACHABLE, dist_to)
+
+        # the next landmark is the reachable edge farthest from all landmarks so far
+        nearest = numpy.minimum(nearest, dist)
+        candidates = numpy.where(numpy.isinf(nearest), -1.0, nearest)
+        edge = int(candidates.argmax())
+
+    mesh[LANDMARKS] = numpy.asarray(landmarks, dtype=numpy.int32)
+    mesh[LANDMARK_DISTS] = dists
+    mesh[LANDMARK_DISTS_TO] = dists_to
+    return mesh
+
+
+def portal_graph(mesh):
+    """
+    The graph paths through `mesh` take: a node per directed edge, standing for
+    its portal point, linked to every edge out of the box it leads into, at the
+    distance between their portal points.
+
+    Returns:
+        - CSR offsets, targets and weights of the graph
+    """
+    box_offsets = numpy.asarray(mesh[ADJ_OFFSETS], dtype=numpy.int64)
+    neighbors = numpy.asarray(mesh[ADJ_NEIGHBORS], dtype=numpy.int64)
+    points = numpy.asarray(mesh[PORTAL_POINTS], dtype=numpy.float64)
+
+    counts = numpy.diff(box_offsets)[neighbors]
+    offsets = numpy.zeros(len(neighbors) + 1, dtype=numpy.int64)
+    numpy.cumsum(counts, out=offsets[1:])
+    sources = numpy.repeat(numpy.arange(len(neighbors)), counts)
+    # the k-th successor of an edge is the k-th edge out of the box it leads into
+    targets = box_offsets[neighbors][sources] + numpy.arange(offsets[-1]) - offsets[sources]
+    weights = numpy.hypot(*(points[targets] - points[sources]).T)
+    return offsets, targets, weights
+
+
+def transpose_graph(offsets, targets, weights):
+    """
+    The CSR graph of `offsets`, `targets` and `weights` with every link reversed.
+    """
+    sources = numpy.repeat(numpy.arange(len(offsets) - 1), numpy.diff(offsets))
+    order = numpy.argsort(targets, kind='stable')
+    reverse_offsets = numpy.zeros_like(offsets)
+    numpy.cumsum(numpy.bincount(targets, minlength=len(offsets) - 1), out=reverse_offsets[1:])
+    return reverse_offsets, sources[order], weights[order]
+
+
+def graph_distances(source, offsets, targets, weights):
+    """
+    Dijkstra from node `source` over the whole CSR graph of `offsets`,
+    `targets` and `weights`.
+
+    Returns:
+        - Float array with the cost to every node, inf where unreachable
+    """
+    space = SearchSpace(len(offsets) - 1)
+    space.start(source, cost=0.0)
+
+    def node_neighbors(node):
+        start, end = offsets[node], offsets[node + 1]
+        return zip(targets[start:end].tolist(), weights[start:end].tolist(), repeat(None))
+
+    dijkstra(space, node_neighbors)
+    return numpy.array(space.costs)
+
+
+def landmark_bounds(box, mesh, backward=False):
+    """
+    Returns a function giving, for an array of edge ids, the ALT lower bound on
+    the cost from each edge's portal point into `box`, or with `backward` from
+    `box` to each portal point, over the portal graph.
+
+    With d(L, e) the distance from landmark L to edge e and d(e, L) back, the
+    cost from e into `box` through one of its edges g is at least
+    d(L, g) - d(L, e) and d(e, L) - d(g, L). Taking the least of each over the
+    edges g into `box` before the most over landmarks keeps the bound valid
+    for all of them at once.
+    """
+    dists = mesh[LANDMARK_DISTS]
+    dists_to = mesh[LANDMARK_DISTS_TO]
+    offsets = mesh[ADJ_OFFSETS]
+
+    out_edges = numpy.arange(offsets[box], offsets[box + 1])
+    if backward:
+        # paths start from `box` through one of the edges out of it
+        lowest_to = numpy.asarray(dists_to[out_edges], dtype=numpy.float64).min(axis=0)
+        highest = numpy.asarray(dists[out_edges], dtype=numpy.float64).max(axis=0)
+
+        def bounds(edge_ids):
+            return numpy.maximum(dists[edge_ids] - highest, lowest_to - dists_to[edge_ids]).max(axis=1).tolist()
+    else:
+        in_edges = get_reverse_edges(mesh)[out_edges]
+        lowest = numpy.asarray(dists[in_edges], dtype=numpy.float64).min(axis=0)
+        highest_to = numpy.asarray(dists_to[in_edges], dtype=numpy.float64).max(axis=0)
+
+        def bounds(edge_ids):
+            return numpy.maximum(lowest - dists[edge_ids], dists_to[edge_ids] - highest_to).max(axis=1).tolist()
+
+    return bounds
+
+
+def compare_heuristics(mesh, queries):
+    """
+    Runs every `(source_point, destination_point)` query with the straight-line
+    and the landmark heuristic.
+
+    Returns:
+        - Total boxes explored with each heuristic, as `(straight_line, landmark)`
+    """
+    import nm_pathfinder
+
+    totals = [0, 0]
+    with contextlib.redirect_stdout(io.StringIO()):  # silence "No Path"
+        for src, dest in queries:
+            for i, algorithm in enumerate(("bas", "alt")):
+                _, explored = nm_pathfinder.find_path(src, dest, mesh, algorithm=algorithm)
+                totals[i] += len(explored)
+    return tuple(totals)
+
+
+if __name__ == '__main__':
+
+    count = 8
+    num_queries = 200
+
+    if len(sys.argv) < 2 or len(sys.argv) > 4:
+        print("usage: %s map.mesh [landmark_count] [num_queries]" % sys.argv[0])
+        sys.exit(-1)
+
+    filename = sys.argv[1]
+    if len(sys.argv) > 2:
+        count = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        num_queries = int(sys.argv[3])
+
+    mesh = load_mesh(filename)
+    build_landmarks(mesh, count)
+
+    # keep the landmarks with the mesh when it is stored as an array directory
+    if not filename.endswith('.pickle'):
+        save_mesh(mesh, filename, keys=LANDMARK_KEYS)
+
+    rng = random.Random(0)
+    middles = [tuple(pt) for pt in box_middles(mesh).tolist()]
+    queries = [(rng.choice(middles), rng.choice(middles)) for _ in range(num_queries)]
+    straight, landmark = compare_heuristics(mesh, queries)
+
+    print("Picked %d landmarks." % len(mesh[LANDMARKS]))
+    print("Explored boxes over %d queries: straight-line %d, landmarks %d (%.1f%% fewer)"
+          % (num_queries, straight, landmark, 100.0 * (straight - landmark) / max(straight, 1)))
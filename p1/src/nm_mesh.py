@@ -0,0 +1,371 @@
+import os
+import pickle
+import shutil
+from collections import OrderedDict
+
+import numpy
+
+import nm_spatial
+
+BOXES = 'boxes'
+ADJ = 'adj'  # tuple-keyed adjacency of the legacy pickle format
+ADJ_OFFSETS = 'adj_offsets'
+ADJ_NEIGHBORS = 'adj_neighbors'
+PORTAL_SEGMENTS = 'portal_segments'
+PORTAL_POINTS = 'portal_points'
+EDGE_COSTS = 'edge_costs'
+REVERSE_EDGES = 'reverse_edges'
+BOX_ORDER = 'box_order'
+COMPONENTS = 'components'
+
+# key prefixes of the arrays derived from the boxes and their adjacency, which
+# no longer match once those change: the caches of this module and nm_spatial,
+# then the arrays of nm_clearance, nm_hierarchy, nm_landmarks and nm_pyramid
+DERIVED_PREFIXES = (REVERSE_EDGES, BOX_ORDER, nm_spatial.INDEX,
+                    'box_clearance', 'portal_clearance',
+                    'hier_regions', 'hier_offsets', 'hier_neighbors', 'hier_costs',
+                    'landmarks', 'landmark_dists', 'landmark_dists_to',
+                    'pyramid')
+
+# legacy meshes whose conversion is kept, so repeated queries convert them once
+LEGACY_CACHE_SIZE = 4
+
+MESH_SUFFIX = '.mesh'
+PARTIAL_SUFFIX = '.partial'  # a mesh directory `save_mesh` is still writing
+
+
+def mesh_from_dict(mesh):
+    """
+    Converts a legacy `{'boxes': [...], 'adj': {box: [box, ...]}}` mesh into the
+    array-backed format.
+
+    Box ids follow the order of `mesh['boxes']`, and every adjacency list keeps
+    its order, so searches over the converted mesh visit boxes in the same order.
+
+    Returns:
+        - A mesh dict holding an Nx4 box array and CSR adjacency arrays
+    """
+    boxes = list(mesh[BOXES])
+    adj = mesh[ADJ]
+    box_ids = {box: i for i, box in enumerate(boxes)}
+
+    counts = [len(adj.get(box, ())) for box in boxes]
+    offsets = numpy.zeros(len(boxes) + 1, dtype=numpy.int64)
+    numpy.cumsum(counts, out=offsets[1:])
+    neighbors = numpy.fromiter((box_ids[nb] for box in boxes for nb in adj.get(box, ())),
+                               dtype=numpy.int32, count=int(offsets[-1]))
+
+    return add_components(add_portals({BOXES: box_array(boxes), ADJ_OFFSETS: offsets, ADJ_NEIGHBORS: neighbors}))
+
+
+def mesh_from_edges(boxes, edges):
+    """
+    Builds an array-backed mesh from a list of boxes and undirected box edges.
+
+    Returns:
+        - A mesh dict holding an Nx4 box array and CSR adjacency arrays
+    """
+    boxes = box_array(boxes)
+    edges = numpy.asarray(edges, dtype=numpy.int64).reshape(-1, 2)
+
+    # every undirected edge is stored once per direction, in edge order
+    src = edges.ravel()
+    dst = edges[:, ::-1].ravel()
+    order = numpy.argsort(src, kind='stable')
+
+    offsets = numpy.zeros(len(boxes) + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(src, minlength=len(boxes)), out=offsets[1:])
+
+    return add_components(add_portals({BOXES: boxes, ADJ_OFFSETS: offsets,
+                                       ADJ_NEIGHBORS: dst[order].astype(numpy.int32)}))
+
+
+def add_portals(mesh):
+    """
+    Stores the portal of every directed edge of `mesh`, aligned with
+    `mesh[ADJ_NEIGHBORS]`:
+
+        - `PORTAL_SEGMENTS`: the shared border `(x1, y1, x2, y2)` of the two boxes
+        - `PORTAL_POINTS`: the midpoint of that border, which is where paths cross
+        - `EDGE_COSTS`: the length of the center -> portal -> center polyline,
+          a static edge weight for searches that work on the box graph alone
+
+    Boxes that only touch at a corner have no shared border; their portal
+    collapses to the middle of the neighbor box, as in `find_detail_points`.
+
+    Returns:
+        - `mesh`, with the portal arrays added
+    """
+    offsets = mesh[ADJ_OFFSETS]
+    boxes = numpy.asarray(mesh[BOXES], dtype=numpy.float64)
+    src = boxes[numpy.repeat(numpy.arange(len(boxes)), numpy.diff(offsets))]
+    dst = boxes[mesh[ADJ_NEIGHBORS]]
+    x1min, x1max, y1min, y1max = src.T
+    x2min, x2max, y2min, y2max = dst.T
+
+    # boxes side by side along x share a border at a fixed x
+    y_lo, y_hi = numpy.maximum(y1min, y2min), numpy.minimum(y1max, y2max)
+    across_x = ((x1max == x2min) | (x1min == x2max)) & (y_lo < y_hi)
+    x = numpy.where(x1max == x2min, x1max, x1min)
+
+    # boxes side by side along y share a border at a fixed y
+    x_lo, x_hi = numpy.maximum(x1min, x2min), numpy.minimum(x1max, x2max)
+    across_y = ((y1max == y2min) | (y1min == y2max)) & (x_lo < x_hi) & ~across_x
+    y = numpy.where(y1max == y2min, y1max, y1min)
+
+    middle_x = (x2min + x2max) / 2
+    middle_y = (y2min + y2max) / 2
+    segments = numpy.stack([
+        numpy.select([across_x, across_y], [x, x_lo], middle_x),
+        numpy.select([across_x, across_y], [y_lo, y], middle_y),
+        numpy.select([across_x, across_y], [x, x_hi], middle_x),
+        numpy.select([across_x, across_y], [y_hi, y], middle_y),
+    ], axis=1)
+
+    mesh[PORTAL_SEGMENTS] = segments
+    mesh[PORTAL_POINTS] = (segments[:, :2] + segments[:, 2:]) / 2
+
+    points = mesh[PORTAL_POINTS]
+    src_middle = numpy.stack([(x1min + x1max) / 2, (y1min + y1max) / 2], axis=1)
+    dst_middle = numpy.stack([middle_x, middle_y], axis=1)
+    mesh[EDGE_COSTS] = numpy.hypot(*(points - src_middle).T) + numpy.hypot(*(dst_middle - points).T)
+    return mesh
+
+
+def add_components(mesh):
+    """
+    Labels the connected components of the box graph: `mesh[COMPONENTS][i]` is
+    the smallest box id reachable from box i, so two boxes are connected exactly
+    when their labels match.
+
+    Labels are found by repeatedly pulling the smallest label across every edge
+    and then pointer-jumping, all as whole-array operations.
+
+    Returns:
+        - `mesh`, with `COMPONENTS` added
+    """
+    offsets = mesh[ADJ_OFFSETS]
+    n = len(offsets) - 1
+    src = numpy.repeat(numpy.arange(n, dtype=numpy.int32), numpy.diff(offsets))
+    dst = numpy.asarray(mesh[ADJ_NEIGHBORS])
+
+    labels = numpy.arange(n, dtype=numpy.int32)
+    while True:
+        pulled = labels.copy()
+        numpy.minimum.at(pulled, src, labels[dst])
+        pulled = pulled[pulled]
+        if numpy.array_equal(pulled, labels):
+            break
+        labels = pulled
+
+    mesh[COMPONENTS] = labels
+    return mesh
+
+
+def connected(box_a, box_b, mesh):
+    """
+    Whether any path joins two boxes, in O(1) from the component labels.
+    """
+    components = mesh[COMPONENTS]
+    return components[box_a] == components[box_b]
+
+
+def box_middles(mesh):
+    """
+    Returns an Nx2 array with the middle point of every box.
+    """
+    boxes = numpy.asarray(mesh[BOXES], dtype=numpy.float64)
+    return numpy.stack([(boxes[:, 0] + boxes[:, 1]) / 2, (boxes[:, 2] + boxes[:, 3]) / 2], axis=1)
+
+
+def edge_index(box_a, box_b, mesh):
+    """
+    Returns the position of the `box_a` -> `box_b` edge in the CSR arrays, or None.
+    """
+    start = mesh[ADJ_OFFSETS][box_a]
+    hits = numpy.flatnonzero(neighbors_of(box_a, mesh) == box_b)
+    return int(start + hits[0]) if len(hits) else None
+
+
+def get_reverse_edges(mesh):
+    """
+    Returns, for every CSR edge a -> b, the position of the b -> a edge,
+    computing it on first use.
+    """
+    if REVERSE_EDGES not in mesh:
+        offsets = mesh[ADJ_OFFSETS]
+        n = len(offsets) - 1
+        src = numpy.repeat(numpy.arange(n, dtype=numpy.int64), numpy.diff(offsets))
+        dst = numpy.asarray(mesh[ADJ_NEIGHBORS], dtype=numpy.int64)
+        keys = src * n + dst
+        order = numpy.argsort(keys, kind='stable')
+        found = numpy.searchsorted(keys[order], dst * n + src)
+        mesh[REVERSE_EDGES] = order[found]
+    return mesh[REVERSE_EDGES]
+
+
+def get_box_order(mesh):
+    """
+    Returns, as a list indexed by box id, the rank of every box in
+    `(xmin, xmax, ymin, ymax)` order, computing it on first use. Searches break
+    ties by it to pop boxes in the order a heap of box tuples would.
+    """
+    order = mesh.get(BOX_ORDER)
+    if order is None:
+        boxes = numpy.asarray(mesh[BOXES])
+        ranks = numpy.empty(len(boxes), dtype=numpy.int64)
+        ranks[numpy.lexsort(boxes.T[::-1])] = numpy.arange(len(boxes))
+        order = mesh[BOX_ORDER] = ranks.tolist()
+    return order
+
+
+def drop_derived(mesh):
+    """
+    Removes every array named by `DERIVED_PREFIXES` from `mesh`.
+
+    Returns:
+        - The keys removed
+    """
+    removed = [key for key in mesh if key.startswith(DERIVED_PREFIXES)]
+    for key in removed:
+        del mesh[key]
+    return removed
+
+
+def portal_path(box_path, source_point, destination_point, mesh):
+    """
+    Turns a sequence of adjacent box ids into points: the source, the portal
+    crossed between every pair of consecutive boxes, and the destination.
+    """
+    portal_points = mesh[PORTAL_POINTS]
+    path = [source_point]
+    for box_a, box_b in zip(box_path, box_path[1:]):
+        path.append(tuple(portal_points[edge_index(box_a, box_b, mesh)].tolist()))
+    path.append(destination_point)
+    return path
+
+
+def box_array(boxes):
+    """
+    Packs boxes into an Nx4 array, int32 unless the mesh has fractional coordinates.
+    """
+    boxes = numpy.asarray(boxes, dtype=numpy.float64).reshape(-1, 4)
+    if numpy.array_equal(boxes, numpy.round(boxes)):
+        return boxes.astype(numpy.int32)
+    return boxes
+
+
+# id of a legacy mesh -> (the mesh, its conversion), least recently used first
+converted_meshes = OrderedDict()
+
+
+def as_array_mesh(mesh):
+    """
+    Returns `mesh` unchanged if it is array-backed, otherwise its conversion,
+    which is kept for the last `LEGACY_CACHE_SIZE` legacy meshes rather than in
+    the caller's dict.
+    """
+    if ADJ_OFFSETS in mesh:
+        return mesh
+    cached = converted_meshes.get(id(mesh))
+    if cached is None or cached[0] is not mesh:
+        cached = converted_meshes[id(mesh)] = (mesh, mesh_from_dict(mesh))
+        if len(converted_meshes) > LEGACY_CACHE_SIZE:
+            converted_meshes.popitem(last=False)
+    else:
+        converted_meshes.move_to_end(id(mesh))
+    return cached[1]
+
+
+def neighbors_of(box_id, mesh):
+    """
+    Returns the ids of the boxes adjacent to `box_id`.
+    """
+    offsets = mesh[ADJ_OFFSETS]
+    return mesh[ADJ_NEIGHBORS][offsets[box_id]:offsets[box_id + 1]]
+
+
+def box_of(box_id, mesh):
+    """
+    Returns box `box_id` as a plain `(xmin, xmax, ymin, ymax)` tuple.
+    """
+    return tuple(mesh[BOXES][box_id].tolist())
+
+
+def boxes_of(box_ids, mesh):
+    """
+    Returns the boxes with the given ids, in id order, as plain tuples.
+    """
+    return [tuple(box) for box in mesh[BOXES][sorted(box_ids)].tolist()]
+
+
+def mesh_filename(map_filename):
+    return map_filename + MESH_SUFFIX
+
+
+def save_mesh(mesh, dirname, keys=None):
+    """
+    Saves every array of `mesh` (or only those named in `keys`) as
+    `<dirname>/<key>.npy`.
+
+    Plain `.npy` files (rather than one `.npz` archive) are used so that
+    `load_mesh` can memory-map them instead of reading them into memory.
+
+    A full save writes the arrays to `<dirname>.partial` and then swaps that in
+    for `dirname`, so no array of an earlier mesh is left to be loaded with this
+    one, and a save cut short leaves the earlier mesh whole. Pass `keys` when
+    adding arrays to a loaded mesh: they are written into `dirname` as it is,
+    next to the arrays already there.
+    """
+    if keys is not None:
+        os.makedirs(dirname, exist_ok=True)
+        write_arrays(mesh, dirname, keys)
+        return
+
+    dirname = os.path.normpath(dirname)
+    staging = dirname + PARTIAL_SUFFIX
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    write_arrays(mesh, staging)
+
+    # arrays memory-mapped from the earlier mesh stay valid after it is removed
+    if os.path.isdir(dirname):
+        os.replace(dirname, staging + '.old')
+        os.replace(staging, dirname)
+        shutil.rmtree(staging + '.old')
+    else:
+        os.replace(staging, dirname)
+
+
+def write_arrays(mesh, dirname, keys=None):
+    for key, value in mesh.items():
+        if keys is not None and key not in keys:
+            continue
+        if isinstance(value, numpy.ndarray):
+            numpy.save(os.path.join(dirname, key + '.npy'), value)
+
+
+def load_mesh(filename):
+    """
+    Loads a mesh saved by `save_mesh`, memory-mapping its arrays, or converts a
+    legacy `.mesh.pickle` file. The point-to-box index is built right away.
+
+    Returns:
+        - An array-backed mesh dict
+    """
+    if os.path.isdir(filename):
+        mesh = {}
+        for name in sorted(os.listdir(filename)):
+            key, ext = os.path.splitext(name)
+            if ext == '.npy':
+                mesh[key] = numpy.load(os.path.join(filename, name), mmap_mode='r')
+        if EDGE_COSTS not in mesh:
+            add_portals(mesh)
+        if COMPONENTS not in mesh:
+            add_components(mesh)
+    else:
+        with open(filename, 'rb') as f:
+            mesh = as_array_mesh(pickle.load(f))
+
+    nm_spatial.get_box_index(mesh)
+    return mesh
@@ -1,155 +1,618 @@
-import collections
-import pickle
+import os
 import sys
 import random
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 
-from matplotlib.pyplot import imread, imsave
 import numpy
 from numpy import zeros_like
+from PIL import Image
+
+from nm_clearance import add_clearance
+from nm_hierarchy import build_hierarchy
+from nm_mesh import box_array, mesh_from_edges, mesh_filename, save_mesh
+from nm_pyramid import add_pyramid
+from nm_spatial import boxes_in_rect
+
+# maps with more pixels than this are meshed tile by tile in a process pool
+TILE_AREA = 1024 * 1024
+
+# a mesh only tells pixels apart as free, blocked or neither
+FREE, BLOCKED, PARTIAL = 255, 0, 128
+# `<map>.mesh/<MESH_KEY_FILE>` holds the `mesh_key` the mesh was built for
+MESH_KEY_FILE = 'mesh_key.txt'
+# bump when a change to the builder makes earlier meshes stale; 2 since
+# `save_mesh` stopped leaving arrays of earlier meshes behind
+MESH_KEY_VERSION = 2
+
+
+def integral_image(mask):
+    """
+    Summed-area table of `mask`, padded with a leading row and column of zeros
+    so that `box_count` needs no bounds checks.
+    """
+    dtype = numpy.int32 if mask.size < 2 ** 31 else numpy.int64
+    sat = numpy.zeros((mask.shape[0] + 1, mask.shape[1] + 1), dtype=dtype)
+    inner = sat[1:, 1:]
+    # sum along the contiguous rows, then add each row to the next; a cumsum
+    # down axis 0 walks the array column by column and is several times slower
+    numpy.cumsum(mask, axis=1, dtype=dtype, out=inner)
+    for row in range(1, len(inner)):
+        numpy.add(inner[row], inner[row - 1], out=inner[row])
+    return sat
+
+
+def box_count(sat, box):
+    """
+    Number of set pixels of the mask behind `sat` inside `box`, in O(1).
+    """
+    x1, x2, y1, y2 = box
+    return int(sat[x2, y2]) - int(sat[x1, y2]) - int(sat[x2, y1]) + int(sat[x1, y1])
+
+
+def box_predicates(image, integral=True, offset=(0, 0)):
+    """
+    Returns `(all_free, all_blocked)` tests for boxes of `image`, given in
+    coordinates shifted by `offset` (the position of `image` inside a larger map).
+
+    With `integral` set, "is this box all free / all blocked" is answered in
+    O(1) from summed-area tables instead of rescanning the pixels of each box.
+    """
+    ox, oy = offset
+
+    if integral:
+        free_sat = integral_image(image == 255)
+        blocked_sat = integral_image(image == 0)
+
+        def all_free(box):
+            x1, x2, y1, y2 = box
+            return box_count(free_sat, (x1 - ox, x2 - ox, y1 - oy, y2 - oy)) == (x2 - x1) * (y2 - y1)
+
+        def all_blocked(box):
+            x1, x2, y1, y2 = box
+            return box_count(blocked_sat, (x1 - ox, x2 - ox, y1 - oy, y2 - oy)) == (x2 - x1) * (y2 - y1)
 
+    else:
 
-def build_mesh(image, min_feature_size):
-    def scan(box):
+        def all_free(box):
+            x1, x2, y1, y2 = box
+            return (image[x1 - ox:x2 - ox, y1 - oy:y2 - oy] == 255).all()
 
-        x1, x2, y1, y2 = box
-        area = (x2 - x1) * (y2 - y1)
+        def all_blocked(box):
+            x1, x2, y1, y2 = box
+            return (image[x1 - ox:x2 - ox, y1 - oy:y2 - oy] == 0).all()
 
-        if area < min_feature_size or (image[x1:x2, y1:y2] == 255).all() or (image[x1:x2, y1:y2] == 0).all():
+    return all_free, all_blocked
 
-            # this box is simple enough to handle in one node
-            if (image[x1:x2, y1:y2] == 255).all():
-                return [box], []
-            else:
-                return [], []
 
-        else:
+def split_box(box):
+    """
+    Splits `box` in two on its longest dimension.
 
-            # recursively split this big box on the longest dimension
-            if x2 - x1 > y2 - y1:
+    Returns:
+        - The two halves and the `(axis, cut)` of the split
+    """
+    x1, x2, y1, y2 = box
 
-                cut = int(x1 + (x2 - x1) / 2 + 1)
-                first_box = (x1, cut, y1, y2)
-                second_box = (cut, x2, y1, y2)
+    # the cut is past the middle, which for a side of two pixels is its end
+    if x2 - x1 > y2 - y1:
+        cut = min(int(x1 + (x2 - x1) / 2 + 1), x2 - 1)
+        return (x1, cut, y1, y2), (cut, x2, y1, y2), (0, cut)
+    else:
+        cut = min(int(y1 + (y2 - y1) / 2 + 1), y2 - 1)
+        return (x1, x2, y1, cut), (x1, x2, cut, y2), (1, cut)
 
-                def rank(b): return (b[2], b[3])
 
-                def first_touch(b): return b[1] == cut
+def aligned_splitter(image, min_gap=1):
+    """
+    Returns a split function that cuts boxes along obstacle boundaries.
 
-                def second_touch(b): return b[0] == cut
+    The row and column projections of the non-free pixels of a box (read from
+    a summed-area table) go from zero to non-zero exactly where an obstacle
+    starts or ends. The cut is the change closest to the middle of its side, so
+    walls end up on box borders instead of being chopped into slivers. Cuts
+    closer than `min_gap` to a side are ignored; boxes without any cut left fall
+    back to `split_box`.
+    """
+    sat = integral_image(image != 255)
 
+    def split(box):
+        x1, x2, y1, y2 = box
+        best = None
+
+        for axis, lo, hi in ((0, x1, x2), (1, y1, y2)):
+            if hi - lo < 2 * min_gap:
+                continue
+            if axis == 0:
+                # non-free pixels in each row lo..hi-1 of the box
+                rows = sat[lo:hi + 1, y2] - sat[lo:hi + 1, y1]
             else:
+                rows = sat[x2, lo:hi + 1] - sat[x1, lo:hi + 1]
+            clear = numpy.diff(rows) == 0
+            cuts = lo + 1 + numpy.flatnonzero(clear[1:] != clear[:-1])
+            cuts = cuts[(cuts - lo >= min_gap) & (hi - cuts >= min_gap)]
+            if len(cuts) == 0:
+                continue
+
+            middle = (lo + hi) / 2
+            cut = int(cuts[numpy.abs(cuts - middle).argmin()])
+            score = (abs(cut - middle) / (hi - lo), -(hi - lo))
+            if best is None or score < best[0]:
+                best = (score, axis, cut)
+
+        if best is None:
+            return split_box(box)
+
+        _, axis, cut = best
+        if axis == 0:
+            return (x1, cut, y1, y2), (cut, x2, y1, y2), (0, cut)
+        else:
+            return (x1, x2, y1, cut), (x1, x2, cut, y2), (1, cut)
+
+    return split
+
+
+def merge_spans(boxes):
+    """
+    Merges free boxes that share a whole side, along x and then along y, until
+    no two boxes can be merged.
+    """
+    boxes = set(boxes)
+    merged_any = True
+
+    while merged_any:
+        merged_any = False
+
+        for lo, hi, span in ((0, 1, (2, 3)), (2, 3, (0, 1))):
+
+            # boxes by the side they start at along this axis
+            starts = {(b[lo], b[span[0]], b[span[1]]): b for b in boxes}
+
+            for b in sorted(boxes, key=lambda b: b[lo]):
+                if b not in boxes:
+                    continue
+                current = b
+                while True:
+                    following = starts.get((current[hi], current[span[0]], current[span[1]]))
+                    if following is None:
+                        break
+                    merged = list(current)
+                    merged[hi] = following[hi]
+                    merged = tuple(merged)
+                    boxes -= {current, following}
+                    boxes.add(merged)
+                    del starts[(following[lo], following[span[0]], following[span[1]])]
+                    starts[(merged[lo], merged[span[0]], merged[span[1]])] = merged
+                    current = merged
+                    merged_any = True
+
+    return sorted(boxes)
+
+
+def touching_edges(boxes):
+    """
+    Links every pair of boxes that share a border of positive length.
+    """
+    extents = box_array(boxes).reshape(-1, 4)
+    index = {'boxes': extents}
+    edges = []
+
+    for i, box in enumerate(extents.tolist()):
+        xmin, xmax, ymin, ymax = box
+        for j in boxes_in_rect(box, index, touching=True).tolist():
+            if j <= i:
+                continue
+            oxmin, oxmax, oymin, oymax = extents[j].tolist()
+            across_x = (xmax == oxmin or xmin == oxmax) and min(ymax, oymax) > max(ymin, oymin)
+            across_y = (ymax == oymin or ymin == oymax) and min(xmax, oxmax) > max(xmin, oxmin)
+            if across_x or across_y:
+                edges.append((boxes[i], boxes[j]))
+
+    return edges
+
+
+def merge_halves(first, second, split):
+    """
+    Joins the `(boxes, edges)` of the two halves of a split: boxes touching the
+    cut with identical spans are merged into one, and boxes whose spans overlap
+    across the cut are linked.
+
+    Returns:
+        - The `(boxes, edges)` of the whole box
+    """
+    first_boxes, first_edges = first
+    second_boxes, second_edges = second
+    axis, cut = split
+
+    if axis == 0:
+
+        def rank(b): return (b[2], b[3])
+
+        def first_touch(b): return b[1] == cut
+
+        def second_touch(b): return b[0] == cut
+
+    else:
+
+        def rank(b): return (b[0], b[1])
+
+        def first_touch(b): return b[3] == cut
+
+        def second_touch(b): return b[2] == cut
+
+    my_boxes = []
+    my_edges = []
+
+    my_boxes.extend([fb for fb in first_boxes if not first_touch(fb)])
+    my_boxes.extend(
+        [sb for sb in second_boxes if not second_touch(sb)])
+
+    first_touches = sorted(filter(first_touch, first_boxes), key=rank)
+    second_touches = sorted(
+        filter(second_touch, second_boxes), key=rank)
 
-                cut = int(y1 + (y2 - y1) / 2 + 1)
-                first_box = (x1, x2, y1, cut)
-                second_box = (x1, x2, cut, y2)
+    first_merges = {}
+    second_merges = {}
 
-                def rank(b): return (b[0], b[1])
+    # walk both sorted lists with cursors rather than popping from the front
+    i, j = 0, 0
+    while i < len(first_touches) and j < len(second_touches):
 
-                def first_touch(b): return b[3] == cut
+        f, s = first_touches[i], second_touches[j]
+        rf, rs = rank(f), rank(s)
 
-                def second_touch(b): return b[2] == cut
+        if rf == rs:
 
-            first_boxes, first_edges = scan(first_box)
-            second_boxes, second_edges = scan(second_box)
+            i += 1
+            j += 1
+            merged = (f[0], s[1], f[2], s[3])
+            first_merges[f] = merged
+            second_merges[s] = merged
+            my_boxes.append(merged)
 
-            my_boxes = []
-            my_edges = []
+        elif rf[1] < rs[1]:
 
-            my_boxes.extend([fb for fb in first_boxes if not first_touch(fb)])
-            my_boxes.extend(
-                [sb for sb in second_boxes if not second_touch(sb)])
+            my_boxes.append(f)
+            i += 1
+            if rf[1] >= rs[0]:
+                my_edges.append((f, s))
 
-            first_touches = sorted(filter(first_touch, first_boxes), key=rank)
-            second_touches = sorted(
-                filter(second_touch, second_boxes), key=rank)
+        elif rf[1] > rs[1]:
 
-            first_merges = {}
-            second_merges = {}
+            my_boxes.append(s)
+            j += 1
+            if rf[0] <= rs[1]:
+                my_edges.append((f, s))
 
-            while first_touches and second_touches:
+        else:
+
+            my_boxes.append(f)
+            my_boxes.append(s)
+            i += 1
+            j += 1
+            my_edges.append((f, s))
 
-                f, s = first_touches[0], second_touches[0]
-                rf, rs = rank(f), rank(s)
+    my_boxes.extend(first_touches[i:])
+    my_boxes.extend(second_touches[j:])
 
-                if rf == rs:
+    for a, b in first_edges:
+        my_edges.append(
+            (first_merges.get(a, a), first_merges.get(b, b)))
 
-                    first_touches.pop(0)
-                    second_touches.pop(0)
-                    merged = (f[0], s[1], f[2], s[3])
-                    first_merges[f] = merged
-                    second_merges[s] = merged
-                    my_boxes.append(merged)
+    for a, b in second_edges:
+        my_edges.append(
+            (second_merges.get(a, a), second_merges.get(b, b)))
 
-                elif rf[1] < rs[1]:
+    return my_boxes, my_edges
 
-                    my_boxes.append(first_touches.pop(0))
-                    if rf[1] >= rs[0]:
-                        my_edges.append((f, s))
 
-                elif rf[1] > rs[1]:
+def scan(root, min_feature_size, all_free, all_blocked, split_fn=split_box):
+    """
+    Meshes `root` by splitting it until every box is simple enough to handle in
+    one node, then merging the halves back up.
 
-                    my_boxes.append(second_touches.pop(0))
-                    if rf[0] <= rs[1]:
-                        my_edges.append((f, s))
+    An explicit stack replaces recursion, so deep splits on large maps can't hit
+    the interpreter's recursion limit. Split entries are pushed below their two
+    halves and merged once both halves are finished. A box that `split_fn`
+    returns unchanged as one of its halves (a single pixel, with `split_box`)
+    is kept as a leaf.
 
-                else:
+    Returns:
+        - The `(boxes, edges)` of `root`
+    """
+    results = []
+    stack = [(root, None)]
 
-                    my_boxes.append(first_touches.pop(0))
-                    my_boxes.append(second_touches.pop(0))
-                    my_edges.append((f, s))
+    while stack:
+        box, split = stack.pop()
 
-            my_boxes.extend(first_touches)
-            my_boxes.extend(second_touches)
+        if split is not None:
+            second = results.pop()
+            first = results.pop()
+            results.append(merge_halves(first, second, split))
+            continue
+
+        x1, x2, y1, y2 = box
+        area = (x2 - x1) * (y2 - y1)
+        free = all_free(box)
 
-            for a, b in first_edges:
-                my_edges.append(
-                    (first_merges.get(a, a), first_merges.get(b, b)))
+        if area >= min_feature_size and not free and not all_blocked(box):
 
-            for a, b in second_edges:
-                my_edges.append(
-                    (second_merges.get(a, a), second_merges.get(b, b)))
+            first_box, second_box, split = split_fn(box)
+            # a box too thin for the split to shrink can't be refined any further
+            if box not in (first_box, second_box):
+                stack.append((box, split))
+                stack.append((second_box, None))
+                stack.append((first_box, None))
+                continue
 
-            return my_boxes, my_edges
+        # this box is simple enough to handle in one node
+        results.append(([box], []) if free else ([], []))
 
-            # end of scan
+    return results[0]
 
-    boxes, edges = scan((0, image.shape[0], 0, image.shape[1]))
 
-    adj = collections.defaultdict(list)
+def mesh_from_scan(edges):
+    """
+    Numbers boxes in order of first appearance in `edges` and builds the
+    array-backed mesh. Boxes without edges are dropped.
+    """
+    box_ids = {}
     for a, b in edges:
-        adj[a].append(b)
-        adj[b].append(a)
+        box_ids.setdefault(a, len(box_ids))
+        box_ids.setdefault(b, len(box_ids))
+
+    return mesh_from_edges(list(box_ids), [(box_ids[a], box_ids[b]) for a, b in edges])
+
+
+def build_mesh(image, min_feature_size, integral=True, split="middle"):
+    """
+    Splits `image` into boxes that are either all free (255) or smaller than
+    `min_feature_size`, linking boxes that touch.
 
-    mesh = {'boxes': list(adj.keys()), 'adj': dict(adj)}
+    `split` picks where boxes are cut: "middle" halves the longest side,
+    "aligned" cuts along obstacle boundaries (see `aligned_splitter`) and then
+    merges free boxes with identical spans, which gives fewer boxes and edges.
+
+    Returns:
+        - An array-backed mesh (see `nm_mesh`)
+    """
+    all_free, all_blocked = box_predicates(image, integral)
+    root = (0, image.shape[0], 0, image.shape[1])
+
+    if split == "aligned":
+        # cuts closer than this to a box side mostly peel off anti-aliasing slivers
+        splitter = aligned_splitter(image, max(1, min_feature_size // 4))
+        boxes, _ = scan(root, min_feature_size, all_free, all_blocked, splitter)
+        edges = touching_edges(merge_spans(boxes))
+    else:
+        boxes, edges = scan(root, min_feature_size, all_free, all_blocked)
+
+    mesh = mesh_from_scan(edges)
 
     return mesh
 
 
+def build_pyramid(mesh, image, min_feature_sizes, integral=True):
+    """
+    Adds a coarser level to `mesh` for every one of `min_feature_sizes`, which
+    should all be larger than the size `mesh` was built with (see `nm_pyramid`).
+
+    The cells of a level are the boxes `build_mesh` would split `image` into
+    with the "middle" split, together with the boxes too small to split that
+    are not all blocked, so that the cells cover every box of `mesh`.
+
+    Returns:
+        - `mesh`, with the pyramid arrays added
+    """
+    all_free, all_blocked = box_predicates(image, integral)
+    root = (0, image.shape[0], 0, image.shape[1])
+
+    levels = []
+    for min_feature_size in sorted(min_feature_sizes):
+
+        def passable(box, min_feature_size=min_feature_size):
+            x1, x2, y1, y2 = box
+            if (x2 - x1) * (y2 - y1) < min_feature_size:
+                return not all_blocked(box)
+            return all_free(box)
+
+        cells, _ = scan(root, min_feature_size, passable, all_blocked)
+        levels.append(box_array(cells))
+
+    return add_pyramid(mesh, levels)
+
+
+def mesh_tile(job):
+    """
+    Process pool worker: meshes one tile, given as its pixels and its box in map
+    coordinates.
+    """
+    tile, box, min_feature_size = job
+    all_free, all_blocked = box_predicates(tile, offset=(box[0], box[2]))
+    return scan(box, min_feature_size, all_free, all_blocked)
+
+
+def build_mesh_tiled(image, min_feature_size, tile_area=TILE_AREA, workers=None):
+    """
+    Builds the same mesh as `build_mesh`, meshing tiles of at most `tile_area`
+    pixels in a process pool and stitching them together.
+
+    Tiles are the boxes of the top levels of the split tree, so stitching
+    replays the same `merge_halves` steps `scan` would have taken, and the
+    resulting boxes and edges are identical. Only the tiles need summed-area
+    tables, which keeps memory bounded on very large maps.
+
+    Returns:
+        - An array-backed mesh (see `nm_mesh`)
+    """
+    all_free, all_blocked = box_predicates(image, integral=False)
+
+    # post-order program of the top of the split tree
+    program = []
+    stack = [((0, image.shape[0], 0, image.shape[1]), None)]
+
+    while stack:
+        box, split = stack.pop()
+
+        if split is not None:
+            program.append(('merge', split))
+            continue
+
+        x1, x2, y1, y2 = box
+        area = (x2 - x1) * (y2 - y1)
+        free = all_free(box)
+
+        if area < min_feature_size or free or all_blocked(box):
+            program.append(('done', ([box], []) if free else ([], [])))
+        elif area <= tile_area:
+            program.append(('tile', box))
+        else:
+            first_box, second_box, split = split_box(box)
+            stack.append((box, split))
+            stack.append((second_box, None))
+            stack.append((first_box, None))
+
+    jobs = [(image[x1:x2, y1:y2], (x1, x2, y1, y2), min_feature_size)
+            for op, (x1, x2, y1, y2) in (step for step in program if step[0] == 'tile')]
+
+    if workers == 1 or len(jobs) <= 1:
+        tile_results = iter(list(map(mesh_tile, jobs)))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            tile_results = iter(list(pool.map(mesh_tile, jobs)))
+
+    results = []
+    for op, arg in program:
+        if op == 'done':
+            results.append(arg)
+        elif op == 'tile':
+            results.append(next(tile_results))
+        else:
+            second = results.pop()
+            first = results.pop()
+            results.append(merge_halves(first, second, arg))
+
+    boxes, edges = results[0]
+
+    return mesh_from_scan(edges)
+
+
+def load_occupancy(filename):
+    """
+    Reads the first channel of the map at `filename` and thresholds it straight
+    into bit planes of its free and blocked pixels, packed eight to a byte.
+
+    Returns:
+        - The shape of the map
+        - Packed free plane
+        - Packed blocked plane
+    """
+    with Image.open(filename) as image:
+        if image.mode not in ('L', 'RGB', 'RGBA'):
+            image = image.convert('RGB')
+        channel = numpy.asarray(image.getchannel(0))
+    return channel.shape, numpy.packbits(channel == FREE), numpy.packbits(channel == BLOCKED)
+
+
+def occupancy_image(shape, free, blocked):
+    """
+    Unpacks the planes of `load_occupancy` into a map `build_mesh` takes, with
+    `PARTIAL` for pixels that are neither free nor blocked. It meshes exactly
+    like the map they were read from.
+    """
+    size = shape[0] * shape[1]
+    image = numpy.full(size, PARTIAL, dtype=numpy.uint8)
+    image[numpy.unpackbits(free, count=size).view(bool)] = FREE
+    image[numpy.unpackbits(blocked, count=size).view(bool)] = BLOCKED
+    return image.reshape(shape)
+
+
+def mesh_key(shape, free, blocked, *options):
+    """
+    Hash of the map planes of `load_occupancy` and the build `options`, which
+    names the mesh they build whatever file the pixels came from.
+    """
+    digest = hashlib.sha256(repr((MESH_KEY_VERSION, tuple(shape)) + options).encode())
+    digest.update(free.data)
+    digest.update(blocked.data)
+    return digest.hexdigest()
+
+
+def saved_mesh_key(dirname):
+    """
+    Returns:
+        - The `mesh_key` of the mesh saved in `dirname`, or None if there is none
+    """
+    try:
+        with open(os.path.join(dirname, MESH_KEY_FILE)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
 if __name__ == '__main__':
 
     min_feature_size = 16
+    split = "middle"
+    pyramid_sizes = []
     filename = None
 
+    # find_path only uses the hierarchy with algorithm="hpa", so it is built on request
+    hierarchy = '--hierarchy' in sys.argv
+    if hierarchy:
+        sys.argv.remove('--hierarchy')
+
     if len(sys.argv) == 2:
         filename = sys.argv[1]
     elif len(sys.argv) == 3:
         filename = sys.argv[1]
         min_feature_size = int(sys.argv[2])
+    elif len(sys.argv) == 4:
+        filename = sys.argv[1]
+        min_feature_size = int(sys.argv[2])
+        split = sys.argv[3]
+    elif len(sys.argv) == 5:
+        filename = sys.argv[1]
+        min_feature_size = int(sys.argv[2])
+        split = sys.argv[3]
+        pyramid_sizes = [int(size) for size in sys.argv[4].split(',')]
     else:
-        print("usage: %s map_filename min_feature_size" % sys.argv[0])
+        print("usage: %s [--hierarchy] map_filename min_feature_size [middle|aligned] [pyramid_size,...]" % sys.argv[0])
         sys.exit(-1)
 
-    img = (imread(filename) * 255).astype(dtype=numpy.uint8)
-    if len(img.shape) > 2:
-        img = img[:, :, 0]
+    # a mesh saved for the same pixels and options is kept as it is
+    shape, free, blocked = load_occupancy(filename)
+    key = mesh_key(shape, free, blocked, min_feature_size, split, sorted(pyramid_sizes), hierarchy)
+    dirname = mesh_filename(filename)
+    if saved_mesh_key(dirname) == key:
+        print("Mesh is up to date.")
+        sys.exit(0)
+
+    # matplotlib takes most of a run that finds its mesh up to date to import
+    from matplotlib.image import imsave
 
-    mesh = build_mesh(img, min_feature_size)
+    img = occupancy_image(shape, free, blocked)
+
+    if img.size > TILE_AREA and split == "middle":
+        mesh = build_mesh_tiled(img, min_feature_size)
+    else:
+        mesh = build_mesh(img, min_feature_size, split=split)
+
+    # the hierarchy is saved with the mesh for find_path's "hpa" search, if asked for
+    if hierarchy:
+        build_hierarchy(mesh)
+    # so is the clearance find_path checks against an agent_radius
+    add_clearance(mesh, img)
+    # and the coarser levels of find_path's "pyramid" search, if asked for
+    if pyramid_sizes:
+        build_pyramid(mesh, img, pyramid_sizes)
 
     print(type(mesh))
     print(mesh.keys())
 
-    with open(filename + '.mesh.pickle', 'wb') as f:
-        pickle.dump(mesh, f, protocol=pickle.HIGHEST_PROTOCOL)
+    # replaces the whole directory, old key included
+    save_mesh(mesh, dirname)
 
     atlas = zeros_like(img)
     for x1, x2, y1, y2 in mesh['boxes']:
@@ -157,4 +620,8 @@ if __name__ == '__main__':
 
     imsave(filename + '.mesh.png', atlas)
 
+    # written last, so a run cut short never leaves a mesh taken as current
+    with open(os.path.join(dirname, MESH_KEY_FILE), 'w') as f:
+        f.write(key + '\n')
+
     print("Built a mesh with %d boxes." % len(mesh['boxes']))
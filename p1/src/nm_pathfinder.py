@@ -1,116 +1,278 @@
 import math
-from heapq import heappush, heappop
-
-def find_path(source_point, destination_point, mesh, algorithm="bas"):
+import time
+from itertools import repeat
+
+from graph_search import SearchSpace, bidirectional_astar, bidirectional_astar_optimal
+from nm_clearance import BOX_CLEARANCE, MAX_CLEARANCE, PORTAL_CLEARANCE
+from nm_hierarchy import find_path_hierarchical
+from nm_landmarks import LANDMARK_DISTS_TO, landmark_bounds
+from nm_mesh import (ADJ_OFFSETS, ADJ_NEIGHBORS, PORTAL_POINTS, as_array_mesh, box_of, boxes_of, connected,
+                     get_box_order, get_reverse_edges)
+from nm_pyramid import find_path_pyramid
+from nm_spatial import locate_points
+
+def find_path(source_point, destination_point, mesh, algorithm="bas", agent_radius=None, stats=None,
+              optimal=False):
     """
     Searches for a path from `source_point` to `destination_point` through the `mesh`
     using the Bidirectional A* algorithm with paths crossing over box content and edges.
 
+    `algorithm` selects the search: "bas" for Bidirectional A* over the whole mesh,
+    "alt" for the same search guided by the landmark bounds of `nm_landmarks` as
+    well as straight-line distance, "hpa" for the hierarchical search of
+    `nm_hierarchy`, "pyramid" for the coarse-to-fine search of `nm_pyramid`.
+    The default "bas" works on any mesh; the others need the landmarks, hierarchy
+    or pyramid built for them and are only used when asked for.
+
+    With `agent_radius`, portals and boxes whose clearance (see `nm_clearance`) is
+    smaller than the radius are skipped, so one mesh serves agents of every size
+    up to `nm_clearance.MAX_CLEARANCE`. Neither the hierarchy nor the pyramid
+    knows about clearance.
+
+    By default the bidirectional search alternates between its directions and
+    stops at the first box both have explored, which may not be the best one.
+    With `optimal`, it searches portal crossings instead of boxes (see
+    `search_portals`), keeps the cheapest meeting of the two directions and
+    stops once neither frontier can lead to a cheaper one. This returns the
+    shortest path through the portal points, with either heuristic: the landmark
+    bounds are measured over portal points too.
+    It trades speed for path quality: a box is searched once per portal it is
+    entered through, so this mode is 2 to 3 times slower than the default
+    (see `nm_bench`) for paths about 3% shorter.
+
+    A `nm_stats.SearchStats` passed as `stats` is filled with the heap operations,
+    expansions, meeting box and timings of the bidirectional search, so it is
+    only taken by "bas" and "alt".
+
     Returns:
         - A path (list of points) from `source_point` to `destination_point` if exists
         - List of boxes explored by the algorithm
     """
-    mesh_adj = mesh['adj']
-    boxes = mesh['boxes']
-
-    # Initialize data structures for forward and backward searches
-    f_explored = set()
-    b_explored = set()
-    f_costs = {}
-    b_costs = {}
-    f_came_from = {}
-    b_came_from = {}
-    f_detail_points = {}
-    b_detail_points = {}
-    f_frontier = []
-    b_frontier = []
+    mesh = as_array_mesh(mesh)
+    agent_radius = agent_radius or 0
+    if stats is not None and algorithm in ("hpa", "pyramid"):
+        raise ValueError("stats are only collected by the bidirectional searches, not %r" % algorithm)
+    if algorithm == "alt" and LANDMARK_DISTS_TO not in mesh:
+        raise ValueError('the "alt" search needs landmarks, see nm_landmarks.build_landmarks')
+    if agent_radius:
+        if PORTAL_CLEARANCE not in mesh:
+            raise ValueError("agent_radius needs a mesh with clearance, see nm_clearance.add_clearance")
+        if agent_radius > MAX_CLEARANCE:
+            raise ValueError("agent_radius %r is larger than the largest clearance stored, %d"
+                             % (agent_radius, MAX_CLEARANCE))
+        if algorithm == "hpa":
+            raise ValueError("the hierarchical search does not support agent_radius")
+        if algorithm == "pyramid":
+            raise ValueError("the pyramid search does not support agent_radius")
+    if algorithm == "hpa":
+        return find_path_hierarchical(source_point, destination_point, mesh)
+    if algorithm == "pyramid":
+        return find_path_pyramid(source_point, destination_point, mesh)
+
+    if stats is not None:
+        started = time.perf_counter()
+
+    offsets = mesh[ADJ_OFFSETS]
+    neighbors = mesh[ADJ_NEIGHBORS]
+    portal_points = mesh[PORTAL_POINTS]
+    reverse_edges = get_reverse_edges(mesh)
+
+    # per-edge clearance slices, or a stand-in every edge passes
+    if agent_radius:
+        portal_clearance = mesh[PORTAL_CLEARANCE]
+        edge_clearance = lambda start, end: portal_clearance[start:end].tolist()
+    else:
+        edge_clearance = lambda start, end: repeat(math.inf)
 
     # Find boxes containing source and destination
-    src_box = find_box_of_point(source_point, mesh)
-    dest_box = find_box_of_point(destination_point, mesh)
+    src_box = find_box_id(source_point, mesh)
+    dest_box = find_box_id(destination_point, mesh)
+
+    if stats is not None:
+        located = time.perf_counter()
+        stats.locate_time = located - started
 
     if src_box is None or dest_box is None:
         # Can't find a path if source or destination is not in any box
         print("No Path")
         return ([], [])
 
-    # Initialize forward search
-    f_costs[src_box] = 0
-    f_came_from[src_box] = None
-    f_detail_points[src_box] = source_point
-    heappush(f_frontier, (0, src_box))
-
-    # Initialize backward search
-    b_costs[dest_box] = 0
-    b_came_from[dest_box] = None
-    b_detail_points[dest_box] = destination_point
-    heappush(b_frontier, (0, dest_box))
-
-    meeting_box = None
-
-    while f_frontier and b_frontier:
-        # Expand forward frontier
-        _, f_current_box = heappop(f_frontier)
-        f_explored.add(f_current_box)
-
-        if f_current_box in b_explored:
-            meeting_box = f_current_box
-            break
-
-        f_neighbors = mesh_adj.get(f_current_box, [])
-
-        for neighbor in f_neighbors:
-            prev_pt = f_detail_points[f_current_box]
-            next_pt = find_detail_points(f_current_box, neighbor)
-            move_cost = distance(prev_pt, next_pt)
-            new_cost = f_costs[f_current_box] + move_cost
-
-            if neighbor in f_costs and new_cost >= f_costs[neighbor]:
-                continue
-
-            f_costs[neighbor] = new_cost
-            f_came_from[neighbor] = f_current_box
-            f_detail_points[neighbor] = next_pt
-
-            priority = new_cost + heuristic(next_pt, destination_point)
-            heappush(f_frontier, (priority, neighbor))
-
-        # Expand backward frontier
-        _, b_current_box = heappop(b_frontier)
-        b_explored.add(b_current_box)
-
-        if b_current_box in f_explored:
-            meeting_box = b_current_box
-            break
+    if not connected(src_box, dest_box, mesh):
+        # Boxes in different components of the mesh can never be joined
+        print("No Path")
+        return ([], [])
 
-        b_neighbors = mesh_adj.get(b_current_box, [])
+    if agent_radius and min(mesh[BOX_CLEARANCE][[src_box, dest_box]]) < agent_radius:
+        # The agent does not fit where it starts or ends
+        print("No Path")
+        return ([], [])
 
-        for neighbor in b_neighbors:
-            prev_pt = b_detail_points[b_current_box]
-            next_pt = find_detail_points(b_current_box, neighbor)
-            move_cost = distance(prev_pt, next_pt)
-            new_cost = b_costs[b_current_box] + move_cost
+    # Landmark lower bounds over portal points, per batch of edge ids
+    if algorithm == "alt":
+        f_box_bounds = landmark_bounds(dest_box, mesh)
+        b_box_bounds = landmark_bounds(src_box, mesh, backward=True)
+    else:
+        f_box_bounds = b_box_bounds = lambda edge_ids: repeat(0)
+
+    def estimate(goal_point):
+        # math.dist is `distance` without its two Python calls per relaxed node
+        dist = math.dist
+        return lambda node, data: max(dist(data[0], goal_point), data[1])
+
+    if optimal:
+        forward, backward, meeting_edge, path = search_portals(
+            source_point, destination_point, src_box, dest_box, mesh,
+            f_box_bounds, b_box_bounds, edge_clearance, agent_radius, estimate)
+        searched = time.perf_counter()
+        # nodes are edges, standing for the box each one leads into
+        explored_boxes = {space.data[edge][2] for space in (forward, backward) for edge in space.expanded}
+        explored_boxes.update((src_box, dest_box))
+        meeting_box = None if meeting_edge < 0 else int(neighbors[meeting_edge])
+    else:
+        # Each direction keeps, per box, the point where its path enters the box
+        # together with the landmark bound of that point; ties are broken by box,
+        # as with a heap of (priority, box) entries
+        box_order = get_box_order(mesh).__getitem__
+        forward = SearchSpace(len(offsets) - 1, key=box_order)
+        backward = SearchSpace(len(offsets) - 1, key=box_order)
+        forward.start(src_box, (source_point, 0))
+        backward.start(dest_box, (destination_point, 0))
+
+        def portal_neighbors(space, box_bounds, backwards):
+            def box_neighbors(box):
+                # the portal into each neighbor was computed when the mesh was built
+                start, end = offsets[box], offsets[box + 1]
+                ids = neighbors[start:end]
+                prev_pt = space.data[box][0]
+                # the backward path crosses each portal on the reverse edge
+                edge_ids = reverse_edges[start:end] if backwards else slice(start, end)
+                for neighbor, next_pt, bound, clearance in zip(ids.tolist(), portal_points[start:end].tolist(),
+                                                               box_bounds(edge_ids), edge_clearance(start, end)):
+                    if clearance >= agent_radius:
+                        yield neighbor, distance(prev_pt, next_pt), (next_pt, bound)
+            return box_neighbors
+
+        meeting_box = bidirectional_astar(forward, backward,
+                                          portal_neighbors(forward, f_box_bounds, False),
+                                          portal_neighbors(backward, b_box_bounds, True),
+                                          estimate(destination_point), estimate(source_point))
+        searched = time.perf_counter()
+
+        # If meeting box is found, reconstruct the path
+        path = []
+        if meeting_box >= 0:
+            path = [forward.data[box][0] for box in forward.path_to(meeting_box)]
+            path += [backward.data[box][0] for box in reversed(backward.path_to(meeting_box)[:-1])]
+        else:
+            meeting_box = None
+        explored_boxes = set(forward.expanded).union(backward.expanded)
+
+    if stats is not None:
+        stats.search_time = searched - located
+
+    if not path:
+        # No path found
+        print("No Path")
+    explored = boxes_of(explored_boxes, mesh)
 
-            if neighbor in b_costs and new_cost >= b_costs[neighbor]:
-                continue
+    if stats is not None:
+        stats.reconstruct_time = time.perf_counter() - searched
+        stats.pushes = forward.pushes() + backward.pushes()
+        stats.pops = forward.pops() + backward.pops()
+        stats.stale_pops = forward.stale_pops + backward.stale_pops
+        stats.forward_expansions = forward.seen.count(1)
+        stats.backward_expansions = backward.seen.count(1)
+        stats.meeting_box = meeting_box
 
-            b_costs[neighbor] = new_cost
-            b_came_from[neighbor] = b_current_box
-            b_detail_points[neighbor] = next_pt
+    return (path, explored)
 
-            priority = new_cost + heuristic(next_pt, source_point)
-            heappush(b_frontier, (priority, neighbor))
+def search_portals(source_point, destination_point, src_box, dest_box, mesh,
+                   f_box_bounds, b_box_bounds, edge_clearance, agent_radius, estimate):
+    """
+    Bidirectional A* over portal crossings rather than boxes: a node is a
+    directed edge of the mesh, standing for its portal point, and every step
+    is a straight line across one box. This is a true graph, so unlike the box
+    search the best meeting can be proven shortest (see
+    `graph_search.bidirectional_astar_optimal`). The backward search walks the
+    same edges the other way, from each edge to the edges into its source box.
 
-    # If meeting box is found, reconstruct the path
-    if meeting_box is not None:
-        path = reconstruct_bidirectional_path(meeting_box, f_came_from, b_came_from,
-                                              f_detail_points, b_detail_points)
-        explored = list(f_explored.union(b_explored))
-        return (path, explored)
-    else:
-        # No path found
-        print("No Path")
-        return ([], list(f_explored.union(b_explored)))
+    Returns:
+        - The forward and backward `SearchSpace`, whose data holds the box each
+          edge leads into along that direction
+        - The edge the searches met at, -1 if none
+        - The path (list of points), empty if none
+    """
+    offsets = mesh[ADJ_OFFSETS]
+    neighbors = mesh[ADJ_NEIGHBORS]
+    portal_points = mesh[PORTAL_POINTS]
+    reverse_edges = get_reverse_edges(mesh)
+
+    forward = SearchSpace(len(neighbors))
+    backward = SearchSpace(len(neighbors))
+
+    if src_box == dest_box:
+        # a box is convex, so the straight line is the shortest path
+        return forward, backward, -1, [source_point, destination_point]
+
+    # both edges of a portal cross it at the same point, except between boxes
+    # touching at a corner, so points are always those of the forward edge
+    backward_points = portal_points[reverse_edges]
+    dist = math.dist
+    # a box is entered through several portals, so its crossings are looked up
+    # once per direction
+    box_crossings = ({}, {})
+
+    def crossings(box, prev_pt, skipped_edge, box_bounds, backwards):
+        """
+        Returns the edges out of `box`, or with `backwards` the reverse edges
+        into it, with the step from `prev_pt` and their `(point, bound, box)` data.
+        """
+        found = box_crossings[backwards].get(box)
+        if found is None:
+            start, end = offsets[box], offsets[box + 1]
+            ids = neighbors[start:end]
+            if backwards:
+                edge_ids = reverse_edges[start:end]
+                edges, points = edge_ids.tolist(), backward_points[start:end].tolist()
+            else:
+                edge_ids = slice(start, end)
+                edges, points = range(start, end), portal_points[start:end].tolist()
+            found = [(edge, out_edge, next_pt, (next_pt, bound, next_box))
+                     for edge, out_edge, next_pt, next_box, bound, clearance in zip(
+                         edges, range(start, end), points, ids.tolist(), box_bounds(edge_ids),
+                         edge_clearance(start, end))
+                     if clearance >= agent_radius]
+            box_crossings[backwards][box] = found
+        # stepping back through the portal just crossed never helps
+        return [(edge, dist(prev_pt, next_pt), data)
+                for edge, out_edge, next_pt, data in found if out_edge != skipped_edge]
+
+    def edge_neighbors(space, box_bounds, backwards):
+        def next_crossings(edge):
+            pt, _, box = space.data[edge]
+            # going back through `edge` is taking its reverse out of the box
+            skipped_edge = edge if backwards else reverse_edges[edge]
+            return crossings(box, pt, skipped_edge, box_bounds, backwards)
+        return next_crossings
+
+    for space, point, box, goal_point, box_bounds, backwards in (
+            (forward, source_point, src_box, destination_point, f_box_bounds, False),
+            (backward, destination_point, dest_box, source_point, b_box_bounds, True)):
+        to_goal = estimate(goal_point)
+        for edge, cost, data in crossings(box, point, -1, box_bounds, backwards):
+            space.start(edge, data, cost, cost + to_goal(edge, data))
+
+    meeting_edge, _ = bidirectional_astar_optimal(forward, backward,
+                                                  edge_neighbors(forward, f_box_bounds, False),
+                                                  edge_neighbors(backward, b_box_bounds, True),
+                                                  estimate(destination_point), estimate(source_point))
+    if meeting_edge < 0:
+        return forward, backward, -1, []
+
+    path = [source_point] + [forward.data[edge][0] for edge in forward.path_to(meeting_edge)]
+    path += [backward.data[edge][0] for edge in reversed(backward.path_to(meeting_edge)[:-1])]
+    path.append(destination_point)
+    return forward, backward, meeting_edge, path
 
 def heuristic(current_point, goal_point):
     return distance(current_point, goal_point)
@@ -164,46 +326,26 @@ def get_edge_midpoint(edge):
     mid_y = (y1 + y2) / 2
     return (mid_x, mid_y)
 
-def reconstruct_bidirectional_path(meeting_box, f_came_from, b_came_from,
-                                   f_detail_points, b_detail_points):
-
-    # Forward path from source to meeting_box
-    path_forward = []
-    box = meeting_box
-    while box:
-        pt = f_detail_points[box]
-        path_forward.append(pt)
-        box = f_came_from.get(box)
-
-    path_forward.reverse()  # From source to meeting_box
-
-    # Backward path from meeting_box to destination
-    path_backward = []
-    box = meeting_box
-    box = b_came_from.get(box)
-    while box:
-        pt = b_detail_points[box]
-        path_backward.append(pt)
-        box = b_came_from.get(box)
-
-    # Combine the paths
-    path = path_forward + path_backward
-
-    return path
-
 def find_box_of_point(point, mesh):
     """
     Finds the box that contains the given point.
     """
-    boxes = mesh['boxes']
-    x, y = point
+    mesh = as_array_mesh(mesh)
+    box_id = find_box_id(point, mesh)
+    if box_id is None:
+        return None  # Return None if not found
+
+    return box_of(box_id, mesh)
 
-    for box in boxes:
-        xmin, xmax, ymin, ymax = box
-        if xmin <= x <= xmax and ymin <= y <= ymax:
-            return box
+def find_box_id(point, mesh):
+    """
+    Finds the id of the box that contains the given point, in an array-backed mesh.
+    """
+    box_id = locate_points([point], mesh)[0]
+    if box_id < 0:
+        return None  # Return None if not found
 
-    return None  # Return None if not found
+    return int(box_id)
 
 def find_box_middle(box):
     xmin, xmax, ymin, ymax = box
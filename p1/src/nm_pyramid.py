@@ -0,0 +1,219 @@
+import math
+
+import numpy
+
+from graph_search import EXPAND, STOP, SearchSpace, astar
+from nm_mesh import (BOXES, ADJ_OFFSETS, ADJ_NEIGHBORS, EDGE_COSTS, COMPONENTS, add_components,
+                     box_middles, boxes_of, connected, mesh_from_edges, portal_path)
+from nm_spatial import locate_points
+
+# coarse level i of a pyramid is stored in the finest mesh as "pyramid<i>_<key>"
+PYRAMID_KEY = 'pyramid%d_%s'
+PARENTS = 'parents'  # per box, the box of the next coarser level it belongs to
+CENTERS = 'centers'  # per coarse box, the center of area of the boxes it holds
+MESH_KEYS = (BOXES, ADJ_OFFSETS, ADJ_NEIGHBORS, EDGE_COSTS)
+LEVEL_KEYS = MESH_KEYS + (CENTERS,)
+CHILD_OFFSETS = 'child_offsets'  # CSR over the boxes of the next finer level
+CHILDREN = 'children'
+
+# coarse path boxes are widened by this many steps into the corridor of the finer level
+CORRIDOR_WIDTH = 1
+
+
+def add_pyramid(mesh, levels):
+    """
+    Builds a pyramid over `mesh` from `levels`, one array of cells per coarser
+    level (finest first), and stores it in `mesh`, so `save_mesh` writes it next
+    to the mesh arrays and `load_mesh` brings it back.
+
+    Each level is a quotient of the one below (see `coarsen`), so a path on a
+    coarse level always has a path of the finer level running through the
+    children of its boxes.
+
+    Returns:
+        - `mesh`, with the pyramid arrays added
+    """
+    boxes = numpy.asarray(mesh[BOXES], dtype=numpy.float64)
+    finer = {key: mesh[key] for key in MESH_KEYS}
+    finer[CENTERS] = box_middles(mesh)
+    areas = (boxes[:, 1] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 2])
+
+    for i, cells in enumerate(levels, 1):
+        level, parents, areas = coarsen(finer, cells, areas)
+        for key in LEVEL_KEYS:
+            mesh[PYRAMID_KEY % (i, key)] = level[key]
+
+        children = numpy.argsort(parents, kind='stable').astype(numpy.int32)
+        child_offsets = numpy.zeros(len(level[BOXES]) + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(parents, minlength=len(level[BOXES])), out=child_offsets[1:])
+
+        mesh[PYRAMID_KEY % (i - 1, PARENTS)] = parents
+        mesh[PYRAMID_KEY % (i, CHILD_OFFSETS)] = child_offsets
+        mesh[PYRAMID_KEY % (i, CHILDREN)] = children
+        finer = level
+    return mesh
+
+
+def coarsen(finer, cells, areas):
+    """
+    Groups the boxes of the `finer` level by the cell (row of `cells`) holding
+    their center, splitting each group into the pieces its boxes connect into
+    by themselves. Every piece becomes one box of the coarse level, spanning
+    its boxes, and two pieces are linked when any of their boxes are.
+
+    A piece need not be convex, so it is stood for by its center of area
+    (`CENTERS`), which still lies inside its cell, and links cost the distance
+    between centers.
+
+    Returns:
+        - The coarse level, an array-backed mesh with `CENTERS`
+        - Array of the coarse box of every finer box
+        - Array of the free area of every coarse box
+    """
+    offsets = finer[ADJ_OFFSETS]
+    n = len(offsets) - 1
+    src = numpy.repeat(numpy.arange(n, dtype=numpy.int32), numpy.diff(offsets))
+    dst = numpy.asarray(finer[ADJ_NEIGHBORS])
+    centers = finer[CENTERS]
+
+    cell_of = locate_points(centers, {BOXES: cells})
+    inside = cell_of[src] == cell_of[dst]
+    inside_offsets = numpy.zeros(n + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(src[inside], minlength=n), out=inside_offsets[1:])
+    pieces = add_components({ADJ_OFFSETS: inside_offsets, ADJ_NEIGHBORS: dst[inside]})[COMPONENTS]
+    _, parents = numpy.unique(pieces, return_inverse=True)
+    parents = parents.reshape(-1).astype(numpy.int32)
+    m = parents.max() + 1
+
+    boxes = numpy.asarray(finer[BOXES], dtype=numpy.float64)
+    spans = numpy.full((m, 4), numpy.inf)
+    spans[:, 1::2] = -numpy.inf
+    for column, merge in enumerate((numpy.minimum, numpy.maximum) * 2):
+        merge.at(spans[:, column], parents, boxes[:, column])
+
+    coarse_areas = numpy.bincount(parents, weights=areas, minlength=m)
+    coarse_centers = numpy.stack([numpy.bincount(parents, weights=areas * centers[:, axis], minlength=m)
+                                  for axis in (0, 1)], axis=1) / coarse_areas[:, None]
+
+    links = numpy.stack([parents[src], parents[dst]], axis=1)
+    links = numpy.unique(links[links[:, 0] < links[:, 1]], axis=0)
+    level = mesh_from_edges(spans, links)
+
+    coarse_offsets = level[ADJ_OFFSETS]
+    coarse_src = numpy.repeat(numpy.arange(m), numpy.diff(coarse_offsets))
+    level[EDGE_COSTS] = numpy.hypot(*(coarse_centers[level[ADJ_NEIGHBORS]] - coarse_centers[coarse_src]).T)
+    level[CENTERS] = coarse_centers
+    return level, parents, coarse_areas
+
+
+def pyramid_levels(mesh):
+    """
+    Returns:
+        - List of level dicts with the `LEVEL_KEYS` arrays (`mesh` itself, the
+          first one, has no `CENTERS`) and the coarsest last; every level but
+          the coarsest also has `PARENTS`, every level but `mesh` also has
+          `CHILD_OFFSETS` and `CHILDREN`
+    """
+    levels = [{key: mesh[key] for key in MESH_KEYS}]
+    while PYRAMID_KEY % (len(levels) - 1, PARENTS) in mesh:
+        i = len(levels)
+        levels[-1][PARENTS] = mesh[PYRAMID_KEY % (i - 1, PARENTS)]
+        levels.append({key: mesh[PYRAMID_KEY % (i, key)] for key in LEVEL_KEYS + (CHILD_OFFSETS, CHILDREN)})
+    return levels
+
+
+def level_search(level, src_box, dest_box, allowed=None):
+    """
+    A* over the box graph of one level, only entering boxes set in `allowed`
+    (all of them if None), with the straight line between box middles (or
+    `CENTERS`) as heuristic.
+
+    Returns:
+        - The boxes from `src_box` to `dest_box`, or None if there is no path
+        - List of boxes expanded
+    """
+    offsets = level[ADJ_OFFSETS]
+    neighbors = level[ADJ_NEIGHBORS]
+    costs = level[EDGE_COSTS]
+    middles = (level[CENTERS] if CENTERS in level else box_middles(level)).tolist()
+    goal_x, goal_y = middles[dest_box]
+
+    def box_neighbors(box):
+        start, end = offsets[box], offsets[box + 1]
+        for nb, cost in zip(neighbors[start:end].tolist(), costs[start:end].tolist()):
+            if allowed is None or allowed[nb]:
+                yield nb, cost, None
+
+    def heuristic(box, data):
+        x, y = middles[box]
+        return math.hypot(goal_x - x, goal_y - y)
+
+    space = SearchSpace(len(offsets) - 1)
+    space.start(src_box, priority=heuristic(src_box, None))
+    end = astar(space, box_neighbors, heuristic, lambda box, priority: STOP if box == dest_box else EXPAND)
+    return (space.path_to(end) if end >= 0 else None), space.expanded
+
+
+def corridor(level, box_path, finer, width=CORRIDOR_WIDTH):
+    """
+    Widens `box_path` by `width` steps over the box graph of `level`.
+
+    Returns:
+        - A bytearray over the boxes of `finer`, set for the children of the widened path
+    """
+    offsets = level[ADJ_OFFSETS]
+    neighbors = level[ADJ_NEIGHBORS]
+    child_offsets = level[CHILD_OFFSETS]
+    children = level[CHILDREN]
+
+    boxes = set(box_path)
+    ring = boxes
+    for _ in range(width):
+        ring = {nb for box in ring for nb in neighbors[offsets[box]:offsets[box + 1]].tolist()} - boxes
+        boxes |= ring
+
+    allowed = bytearray(len(finer[ADJ_OFFSETS]) - 1)
+    for box in boxes:
+        for child in children[child_offsets[box]:child_offsets[box + 1]].tolist():
+            allowed[child] = 1
+    return allowed
+
+
+def find_path_pyramid(source_point, destination_point, mesh, width=CORRIDOR_WIDTH):
+    """
+    Plans on the coarsest level of the pyramid stored in `mesh` (see
+    `add_pyramid`), then searches every finer level only inside the children
+    of the coarser path widened by `width` boxes, down to the mesh itself.
+
+    Returns:
+        - A path (list of points) from `source_point` to `destination_point` if exists
+        - List of boxes of `mesh` explored by the algorithm
+    """
+    levels = pyramid_levels(mesh)
+
+    src_box, dest_box = locate_points([source_point, destination_point], mesh).tolist()
+    if src_box < 0 or dest_box < 0 or not connected(src_box, dest_box, mesh):
+        print("No Path")
+        return ([], [])
+
+    # the boxes of both endpoints on every level
+    ends = [(src_box, dest_box)]
+    for level in levels[:-1]:
+        ends.append(tuple(level[PARENTS][list(ends[-1])].tolist()))
+
+    allowed = None
+    for i in range(len(levels) - 1, -1, -1):
+        src_box, dest_box = ends[i]
+        box_path, expanded = level_search(levels[i], src_box, dest_box, allowed)
+        if box_path is None and allowed is not None:
+            # the corridor of the coarser path can cut off the way round a
+            # wall that splits a coarse box, so the level is searched whole
+            box_path, expanded = level_search(levels[i], src_box, dest_box)
+        if box_path is None:
+            print("No Path")
+            return ([], [])
+        if i > 0:
+            allowed = corridor(levels[i], box_path, levels[i - 1], width)
+
+    path = portal_path(box_path, source_point, destination_point, mesh)
+    return (path, boxes_of(expanded, mesh))
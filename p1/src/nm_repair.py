@@ -0,0 +1,310 @@
+import numpy
+
+from nm_clearance import BOX_CLEARANCE, PORTAL_CLEARANCE, repair_clearance
+from nm_mesh import BOXES, ADJ_OFFSETS, ADJ_NEIGHBORS, add_components, add_portals, box_array, drop_derived
+from nm_meshbuilder import box_predicates, scan, split_box
+from nm_spatial import boxes_in_rect
+
+# removed boxes keep their id but get an extent no point or rectangle can hit
+TOMBSTONE = (-1, -2, -1, -2)
+# share of tombstoned ids past which a repair compacts the mesh
+COMPACT_FRACTION = 0.1
+
+
+def repair_mesh(mesh, image, rect, min_feature_size, caches=()):
+    """
+    Updates `mesh` in place after the pixels of `image` inside `rect`
+    (xmin, xmax, ymin, ymax) changed, re-meshing only the affected area.
+
+    The area is made of the smallest boxes of `scan`'s split tree that hold
+    `rect` (see `enclosing_nodes`) and is meshed with the same `scan` as
+    `build_mesh`. Boxes overlapping it become tombstones, so other ids stay
+    valid, and their parts outside the area come back as new boxes, appended
+    and linked where they touch. Once tombstones make up `COMPACT_FRACTION` of
+    the ids the mesh is compacted (see `compact_mesh`), which renumbers it.
+
+    Portals, edge costs, components and the point index are rebuilt, clearance
+    is recomputed near `rect` only, and the other derived arrays are dropped.
+    Every object in `caches` gets `invalidate(box_ids)` with the boxes through
+    which a cached path can have changed, or every id when compacting.
+
+    Limitations: a repaired mesh covers the pixels a rebuild covers, with the
+    same components, but in more boxes, so portals and costs differ slightly.
+    Repairs link every pair of boxes touching at a corner, and can keep an
+    enclosed free area a rebuild leaves out. "aligned" meshes are repaired
+    with the "middle" split.
+
+    Returns:
+        - Ids of the removed boxes, from before the repair
+        - Ids of the added boxes, after compacting if the mesh was
+    """
+    boxes = numpy.asarray(mesh[BOXES])
+    root = (0, image.shape[0], 0, image.shape[1])
+    x1, x2, y1, y2 = (int(v) for v in rect)
+    rect = (max(x1, 0), min(x2, root[1]), max(y1, 0), min(y2, root[3]))
+    areas = enclosing_nodes(root, rect, min_feature_size, image)
+    removed = numpy.unique(numpy.concatenate([boxes_in_rect(area, mesh) for area in areas]))
+
+    # mesh each area on its own, exactly as `scan` meshes it from the root
+    new_boxes, new_edges, groups = [], [], []
+    for group, area in enumerate(areas):
+        x1, x2, y1, y2 = area
+        all_free, all_blocked = box_predicates(image[x1:x2, y1:y2], offset=(x1, y1))
+        area_boxes, area_edges = scan(area, min_feature_size, all_free, all_blocked)
+        # edges may name boxes `scan` later merged away; `build_mesh` keeps those too
+        area_boxes = list(dict.fromkeys(area_boxes + [box for edge in area_edges for box in edge]))
+        new_boxes += area_boxes
+        new_edges += area_edges
+        groups += [group] * len(area_boxes)
+    num_scanned = len(new_boxes)
+
+    # removed boxes reaching out of the areas keep the pixels outside them,
+    # which did not change
+    for box in boxes[removed].tolist():
+        parts = [tuple(box)]
+        for area in areas:
+            parts = [rest for part in parts for rest in outside_parts(part, area)]
+        new_boxes += parts
+    # boxes `build_mesh` left out for having no neighbor may have one now
+    new_boxes += dropped_leaves(mesh, image, areas, new_boxes, min_feature_size)
+    groups += [len(areas)] * (len(new_boxes) - num_scanned)
+
+    n_old = len(boxes)
+    new_ids = {box: n_old + i for i, box in enumerate(new_boxes)}
+    added = numpy.arange(n_old, n_old + len(new_boxes))
+    new_array = box_array(new_boxes).reshape(-1, 4)
+
+    border = [boxes_in_rect(area, mesh, touching=True) for area in areas]
+    border += [boxes_in_rect(piece, mesh, touching=True) for piece in new_boxes[num_scanned:]]
+    border = numpy.setdiff1d(numpy.concatenate(border), removed)
+
+    # keep the directed edges between surviving boxes
+    offsets = mesh[ADJ_OFFSETS]
+    src = numpy.repeat(numpy.arange(n_old), numpy.diff(offsets))
+    dst = numpy.asarray(mesh[ADJ_NEIGHBORS], dtype=numpy.int64)
+    gone = numpy.zeros(n_old, dtype=bool)
+    gone[removed] = True
+    keep = ~gone[src] & ~gone[dst]
+    src, dst = [src[keep]], [dst[keep]]
+
+    links = [(new_ids[a], new_ids[b]) for a, b in new_edges]
+    for border_box in border.tolist():
+        for new_box in numpy.flatnonzero(touch(boxes[border_box], new_array)).tolist():
+            links.append((border_box, n_old + new_box))
+    # boxes of different areas and the parts outside them link where they
+    # touch, which only boxes on the border of their area can
+    groups = numpy.asarray(groups, dtype=numpy.int64)
+    hulls = numpy.asarray(areas + [(0, 0, 0, 0)])[groups]
+    on_border = (new_array == hulls).any(axis=1) | (groups == len(areas))
+    for box in numpy.flatnonzero(on_border).tolist():
+        for new_box in numpy.flatnonzero(touch(new_array[box], new_array) & on_border).tolist():
+            if new_box > box and (groups[box] != groups[new_box] or groups[box] == len(areas)):
+                links.append((n_old + box, n_old + new_box))
+
+    links = numpy.asarray(links, dtype=numpy.int64).reshape(-1, 2)
+    src += [links[:, 0], links[:, 1]]
+    dst += [links[:, 1], links[:, 0]]
+    src, dst = numpy.concatenate(src), numpy.concatenate(dst)
+
+    all_boxes = numpy.concatenate([boxes, new_array.astype(boxes.dtype)])
+    all_boxes[removed] = TOMBSTONE
+
+    # like `build_mesh`, keep no box without a neighbor
+    valid = all_boxes[:, 0] < all_boxes[:, 1]
+    isolated = numpy.flatnonzero(valid & (numpy.bincount(src, minlength=len(all_boxes)) == 0))
+    all_boxes[isolated] = TOMBSTONE
+    removed = numpy.union1d(removed, isolated[isolated < n_old])
+    added = numpy.setdiff1d(added, isolated)
+
+    order = numpy.argsort(src, kind='stable')
+    new_offsets = numpy.zeros(len(all_boxes) + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(src, minlength=len(all_boxes)), out=new_offsets[1:])
+
+    # clearance of the surviving edges, in their new order, NaN for the new ones
+    clearance = None
+    if PORTAL_CLEARANCE in mesh:
+        old_portals = numpy.asarray(mesh[PORTAL_CLEARANCE], dtype=numpy.float32)
+        clearance = numpy.concatenate([old_portals[keep], numpy.full(2 * len(links), numpy.nan,
+                                                                     dtype=numpy.float32)])[order]
+        box_clearance = numpy.asarray(mesh[BOX_CLEARANCE])
+
+    mesh[BOXES] = all_boxes
+    mesh[ADJ_OFFSETS] = new_offsets
+    mesh[ADJ_NEIGHBORS] = dst[order].astype(numpy.int32)
+    drop_derived(mesh)
+    add_components(add_portals(mesh))
+    if clearance is not None:
+        repair_clearance(mesh, image, rect, box_clearance, clearance)
+
+    touched = numpy.concatenate([removed, border])
+    if numpy.count_nonzero(all_boxes[:, 0] >= all_boxes[:, 1]) >= COMPACT_FRACTION * len(all_boxes):
+        kept = compact_mesh(mesh)
+        added = numpy.searchsorted(kept, added)
+        touched = numpy.arange(len(all_boxes))
+    for cache in caches:
+        cache.invalidate(touched)
+
+    return removed, added
+
+
+def compact_mesh(mesh):
+    """
+    Drops the tombstones `repair_mesh` leaves from `mesh`, renumbering the
+    boxes in their order. Clearance is kept; the other derived arrays are
+    dropped as with a repair.
+
+    Returns:
+        - The old id of every box, by new id
+    """
+    boxes = numpy.asarray(mesh[BOXES])
+    offsets = numpy.asarray(mesh[ADJ_OFFSETS])
+    neighbors = numpy.asarray(mesh[ADJ_NEIGHBORS])
+    kept = numpy.flatnonzero(boxes[:, 0] < boxes[:, 1])
+    new_ids = numpy.full(len(boxes), -1, dtype=numpy.int64)
+    new_ids[kept] = numpy.arange(len(kept))
+
+    # tombstones have no edges, so the edges keep their order
+    src = numpy.repeat(numpy.arange(len(boxes)), numpy.diff(offsets))
+    keep = (new_ids[src] >= 0) & (new_ids[neighbors] >= 0)
+    new_offsets = numpy.zeros(len(kept) + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(new_ids[src[keep]], minlength=len(kept)), out=new_offsets[1:])
+
+    clearance = None
+    if PORTAL_CLEARANCE in mesh:
+        clearance = (numpy.asarray(mesh[BOX_CLEARANCE])[kept], numpy.asarray(mesh[PORTAL_CLEARANCE])[keep])
+
+    mesh[BOXES] = boxes[kept]
+    mesh[ADJ_OFFSETS] = new_offsets
+    mesh[ADJ_NEIGHBORS] = new_ids[neighbors[keep]].astype(numpy.int32)
+    drop_derived(mesh)
+    add_components(add_portals(mesh))
+    if clearance is not None:
+        mesh[BOX_CLEARANCE], mesh[PORTAL_CLEARANCE] = clearance
+    return kept
+
+
+def enclosing_nodes(root, rect, min_feature_size, image=None):
+    """
+    The smallest boxes of the split tree `scan` builds from `root` that
+    together contain `rect`: `rect` is cut wherever it straddles a split, and
+    each part goes down the tree as far as it fits in one half, stopping at
+    boxes `scan` would not split for their size or, given `image`, because
+    they are all free or all blocked in it.
+    """
+    nodes = []
+    stack = [(root, rect)]
+    while stack:
+        node, part = stack.pop()
+        x1, x2, y1, y2 = node
+        first, second, (axis, cut) = split_box(node)
+        if (x2 - x1) * (y2 - y1) < min_feature_size or node in (first, second):
+            nodes.append(node)
+            continue
+        if image is not None and part != node and uniform(image[x1:x2, y1:y2]):
+            nodes.append(node)
+            continue
+
+        lo, hi = part[2 * axis], part[2 * axis + 1]
+        if hi <= cut:
+            stack.append((first, part))
+        elif lo >= cut:
+            stack.append((second, part))
+        elif part == node:
+            nodes.append(node)
+        else:
+            # the part straddles the cut, so each side goes on alone
+            before, after = list(part), list(part)
+            before[2 * axis + 1] = cut
+            after[2 * axis] = cut
+            stack.append((first, tuple(before)))
+            stack.append((second, tuple(after)))
+    return nodes
+
+
+def dropped_leaves(mesh, image, areas, new_boxes, min_feature_size):
+    """
+    The free leaves of `scan`'s split tree, outside `areas`, that neither
+    `mesh` nor `new_boxes` covers and that touch one of them or each other.
+    """
+    boxes = numpy.asarray(mesh[BOXES])
+    root = (0, image.shape[0], 0, image.shape[1])
+    leaves, seen = [], []
+    stack = list(new_boxes)
+    while stack:
+        x1, x2, y1, y2 = stack.pop()
+        wx1, wx2, wy1, wy2 = window = (max(x1 - 1, 0), min(x2 + 1, root[1]), max(y1 - 1, 0), min(y2 + 1, root[3]))
+        # the free pixels around the box that no box covers
+        candidates = image[wx1:wx2, wy1:wy2] == 255
+        for bx1, bx2, by1, by2 in boxes[boxes_in_rect(window, mesh)].tolist() + areas + new_boxes + leaves:
+            candidates[max(bx1 - wx1, 0):max(bx2 - wx1, 0), max(by1 - wy1, 0):max(by2 - wy1, 0)] = False
+        for px, py in (numpy.argwhere(candidates) + (wx1, wy1)).tolist():
+            if any(lx1 <= px < lx2 and ly1 <= py < ly2 for lx1, lx2, ly1, ly2 in seen):
+                continue
+            leaf = leaf_at(root, (px, py), image, min_feature_size)
+            seen.append(leaf)
+            lx1, lx2, ly1, ly2 = leaf
+            if (image[lx1:lx2, ly1:ly2] == 255).all():
+                leaves.append(leaf)
+                stack.append(leaf)
+    return leaves
+
+
+def leaf_at(root, point, image, min_feature_size):
+    """
+    The box of `scan`'s split tree, built from `root`, that holds `point` and
+    that `scan` does not split.
+    """
+    node = root
+    while True:
+        x1, x2, y1, y2 = node
+        first, second, (axis, cut) = split_box(node)
+        if (x2 - x1) * (y2 - y1) < min_feature_size or node in (first, second) or uniform(image[x1:x2, y1:y2]):
+            return node
+        node = first if point[axis] < cut else second
+
+
+def uniform(pixels):
+    """
+    Whether `pixels` are all free or all blocked, the boxes `scan` keeps whole.
+    """
+    first = pixels[0, 0]
+    if first != 255 and first != 0:
+        return False
+    # the corners and the middle settle most boxes without reading them all
+    w, h = pixels.shape
+    if (pixels[[0, 0, -1, -1, w // 2], [0, -1, 0, -1, h // 2]] != first).any():
+        return False
+    return bool((pixels == first).all())
+
+
+def outside_parts(box, area):
+    """
+    The parts of `box` outside `area`, as up to four boxes.
+    """
+    bx1, bx2, by1, by2 = box
+    x1, x2, y1, y2 = area
+    if bx2 <= x1 or x2 <= bx1 or by2 <= y1 or y2 <= by1:
+        return [box]
+    parts = []
+    if bx1 < x1:
+        parts.append((bx1, x1, by1, by2))
+    if x2 < bx2:
+        parts.append((x2, bx2, by1, by2))
+    if by1 < y1:
+        parts.append((max(bx1, x1), min(bx2, x2), by1, y1))
+    if y2 < by2:
+        parts.append((max(bx1, x1), min(bx2, x2), y2, by2))
+    return parts
+
+
+def touch(box, boxes):
+    """
+    Which of `boxes` share a border or a corner with `box`, the same contact
+    `build_mesh` links boxes across a cut for.
+    """
+    xmin, xmax, ymin, ymax = box
+    x_touch = (boxes[:, 1] == xmin) | (boxes[:, 0] == xmax)
+    y_touch = (boxes[:, 3] == ymin) | (boxes[:, 2] == ymax)
+    x_overlap = (boxes[:, 0] <= xmax) & (xmin <= boxes[:, 1])
+    y_overlap = (boxes[:, 2] <= ymax) & (ymin <= boxes[:, 3])
+    return (x_touch & y_overlap) | (y_touch & x_overlap)
@@ -0,0 +1,304 @@
+import asyncio
+import json
+import math
+import os
+import socket
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+from nm_batch import find_paths
+from nm_mesh import load_mesh
+from nm_spatial import locate_points
+
+# path queries for one mesh are held this long (seconds) to be answered together
+BATCH_DELAY = 0.002
+BATCH_SIZE = 256
+
+# longest request line (bytes) read; longer ones are skipped and answered with an error
+REQUEST_LIMIT = 16 * 1024 * 1024
+
+# latencies kept for the percentiles reported by the "stats" request
+LATENCY_SAMPLES = 10000
+
+# meshes loaded by each process pool worker, set by `init_worker`
+worker_meshes = None
+
+
+class QueryServer:
+    """
+    Serves path and point-location queries on meshes loaded once.
+
+    Clients send one JSON request per line and get one JSON response per line,
+    tagged with the request's "id". Requests on a connection are answered
+    concurrently, so responses may come back out of order:
+
+        - {"op": "path", "mesh": name, "queries": [[sx, sy, dx, dy], ...]}
+          -> {"costs": [...], "paths": [[[x, y], ...], ...]}, cost null when unreachable
+        - {"op": "locate", "mesh": name, "points": [[x, y], ...]}
+          -> {"boxes": [...]}, -1 outside the mesh
+        - {"op": "meshes"} -> {"meshes": [name, ...]}
+        - {"op": "stats"} -> request, query and batch counters, throughput and latency percentiles
+
+    Path queries for the same mesh arriving within `batch_delay` of each other
+    (up to `batch_size` of them) are answered by one `nm_batch.find_paths` call
+    in a process pool, so paths follow its cost model rather than that of
+    `find_path`. The workers memory-map the same mesh files, so the meshes
+    stay in memory once. Point location is cheap and vectorized, and is
+    answered right in the event loop.
+
+    A request line longer than `request_limit` bytes is skipped and answered
+    with an error, and the connection goes on.
+    """
+
+    def __init__(self, mesh_filenames, workers=1, batch_delay=BATCH_DELAY, batch_size=BATCH_SIZE,
+                 request_limit=REQUEST_LIMIT):
+        self.mesh_filenames = mesh_filenames
+        self.meshes = {name: load_mesh(filename) for name, filename in mesh_filenames.items()}
+        self.pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                        initargs=(mesh_filenames,))
+        self.batch_delay = batch_delay
+        self.batch_size = batch_size
+        self.request_limit = request_limit
+
+        self.pending = {}  # mesh name -> list of (query, future)
+        self.flushes = {}  # mesh name -> timer handle of the pending batch
+
+        self.started = time.monotonic()
+        self.requests = 0
+        self.queries = 0
+        self.batches = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    async def serve(self, address):
+        """
+        Listens on `address`, "host:port" or the path of a Unix socket, until cancelled.
+        """
+        if is_tcp(address):
+            host, port = address.rsplit(':', 1)
+            server = await asyncio.start_server(self.handle_connection, host, int(port),
+                                                limit=self.request_limit)
+        else:
+            if os.path.exists(address):
+                os.unlink(address)
+            server = await asyncio.start_unix_server(self.handle_connection, address,
+                                                     limit=self.request_limit)
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.pool.shutdown(cancel_futures=True)
+
+    async def handle_connection(self, reader, writer):
+        lock = asyncio.Lock()
+        tasks = set()
+
+        while (line := await read_request(reader)) != b'':
+            task = asyncio.ensure_future(self.respond(line, writer, lock))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.gather(*tasks)
+        writer.close()
+
+    async def respond(self, line, writer, lock):
+        start = time.perf_counter()
+        request_id = None
+        try:
+            if line is None:
+                raise ValueError("request longer than %d bytes" % self.request_limit)
+            request = json.loads(line)
+            request_id = request.get('id')
+            response = await self.answer(request)
+        except Exception as e:
+            self.errors += 1
+            response = {'error': "%s: %s" % (type(e).__name__, e)}
+        response['id'] = request_id
+        self.requests += 1
+        self.latencies.append(time.perf_counter() - start)
+
+        async with lock:
+            writer.write(json.dumps(response).encode() + b'\n')
+            await writer.drain()
+
+    async def answer(self, request):
+        op = request.get('op')
+
+        if op == 'path':
+            mesh_name = self.mesh_name(request)
+            queries = numpy.asarray(request['queries'], dtype=numpy.float64).reshape(-1, 4).tolist()
+            self.queries += len(queries)
+            answers = await asyncio.gather(*(self.submit(mesh_name, query) for query in queries))
+            return {'costs': [cost for cost, _ in answers], 'paths': [path for _, path in answers]}
+
+        if op == 'locate':
+            mesh = self.meshes[self.mesh_name(request)]
+            points = request['points']
+            self.queries += len(points)
+            return {'boxes': locate_points(points, mesh).tolist()}
+
+        if op == 'meshes':
+            return {'meshes': sorted(self.meshes)}
+
+        if op == 'stats':
+            return self.stats()
+
+        raise ValueError("unknown op %r" % op)
+
+    def mesh_name(self, request):
+        name = request.get('mesh')
+        if name is None and len(self.meshes) == 1:
+            return next(iter(self.meshes))
+        if name not in self.meshes:
+            raise KeyError("no mesh named %r" % name)
+        return name
+
+    def submit(self, mesh_name, query):
+        """
+        Queues one path query into the pending batch of its mesh.
+
+        Returns:
+            - A future for the `(cost, path)` of the query
+        """
+        future = asyncio.get_running_loop().create_future()
+        batch = self.pending.setdefault(mesh_name, [])
+        batch.append((query, future))
+
+        if len(batch) >= self.batch_size:
+            self.flush(mesh_name)
+        elif mesh_name not in self.flushes:
+            self.flushes[mesh_name] = asyncio.get_running_loop().call_later(
+                self.batch_delay, self.flush, mesh_name)
+        return future
+
+    def flush(self, mesh_name):
+        timer = self.flushes.pop(mesh_name, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self.pending.pop(mesh_name, [])
+        if batch:
+            self.batches += 1
+            asyncio.ensure_future(self.run_batch(mesh_name, batch))
+
+    async def run_batch(self, mesh_name, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            answers = await loop.run_in_executor(self.pool, answer_batch, mesh_name,
+                                                 [query for query, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), answer in zip(batch, answers):
+            if not future.done():
+                future.set_result(answer)
+
+    def stats(self):
+        uptime = time.monotonic() - self.started
+        stats = {'uptime': uptime, 'requests': self.requests, 'queries': self.queries,
+                 'batches': self.batches, 'errors': self.errors,
+                 'queries_per_second': self.queries / uptime if uptime > 0 else 0.0}
+        if self.latencies:
+            p50, p90, p99 = numpy.percentile(list(self.latencies), [50, 90, 99]).tolist()
+            stats.update(latency_p50=p50, latency_p90=p90, latency_p99=p99)
+        return stats
+
+
+def init_worker(mesh_filenames):
+    global worker_meshes
+    worker_meshes = {name: load_mesh(filename) for name, filename in mesh_filenames.items()}
+
+
+def answer_batch(mesh_name, queries):
+    """
+    Process pool worker: answers a batch of path queries on one mesh.
+
+    Returns:
+        - List of `(cost, path)` pairs, with cost None and an empty path when unreachable
+    """
+    costs, path_offsets, path_points = find_paths(queries, worker_meshes[mesh_name])
+    path_points = path_points.tolist()
+
+    answers = []
+    for i, cost in enumerate(costs.tolist()):
+        path = path_points[path_offsets[i]:path_offsets[i + 1]]
+        answers.append((None if math.isinf(cost) else cost, path))
+    return answers
+
+
+async def read_request(reader):
+    """
+    Reads the next line from `reader`, skipping it whole if it is longer than
+    the reader's limit.
+
+    Returns:
+        - The line, None if it was too long, or b'' at the end of the stream
+    """
+    try:
+        return await reader.readuntil(b'\n')
+    except asyncio.IncompleteReadError as e:
+        return e.partial
+    except asyncio.LimitOverrunError as e:
+        consumed = e.consumed
+
+    # the overlong data stays buffered; drop it a limit's worth at a time
+    while True:
+        try:
+            await reader.readexactly(consumed)
+            await reader.readuntil(b'\n')
+            return None
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError as e:
+            consumed = e.consumed
+
+
+def is_tcp(address):
+    return ':' in address and '/' not in address
+
+
+def send_request(address, request):
+    """
+    Sends one request to a running server and waits for its response, for
+    tools that do not run an event loop.
+    """
+    if is_tcp(address):
+        host, port = address.rsplit(':', 1)
+        sock = socket.create_connection((host, int(port)))
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(address)
+
+    with sock, sock.makefile('rwb') as f:
+        f.write(json.dumps(request).encode() + b'\n')
+        f.flush()
+        return json.loads(f.readline())
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 3:
+        print("usage: %s host:port|socket_path map.mesh [map.mesh ...] [workers]" % sys.argv[0])
+        sys.exit(-1)
+
+    address = sys.argv[1]
+    filenames = sys.argv[2:]
+    workers = 1
+    if filenames[-1].isdigit():
+        workers = int(filenames.pop())
+
+    # meshes are named by their file name, e.g. "homer.png.mesh"
+    server = QueryServer({os.path.basename(f.rstrip('/')): f for f in filenames}, workers)
+    print("Serving %s on %s with %d workers." % (", ".join(sorted(server.meshes)), address, workers))
+
+    try:
+        asyncio.run(server.serve(address))
+    except KeyboardInterrupt:
+        pass
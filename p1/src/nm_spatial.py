@@ -0,0 +1,155 @@
+import math
+
+import numpy
+
+INDEX = 'index'
+
+# number of query points resolved per vectorized chunk in `locate_points`
+LOCATE_CHUNK = 65536
+
+
+def build_box_index(boxes, cell_size=None):
+    """
+    Builds a uniform grid index over the extents of `boxes`.
+
+    Every grid cell holds the ids of all boxes whose (inclusive) extent touches
+    the cell, sorted ascending and padded with -1 so a whole batch of points can
+    be resolved with a single fancy-indexing pass. Inverted boxes (xmin > xmax),
+    which mark removed boxes, are left out.
+
+    Returns:
+        - A dict holding the box extents, the grid geometry and the bucket table
+    """
+    extents = numpy.asarray(boxes, dtype=numpy.float64).reshape(-1, 4)
+    valid = (extents[:, 0] <= extents[:, 1]) & (extents[:, 2] <= extents[:, 3])
+    n = int(valid.sum())
+
+    if n == 0:
+        return {'extents': extents, 'origin': (0.0, 0.0), 'cell_size': 1.0,
+                'shape': (1, 1), 'buckets': numpy.full((1, 1), -1, dtype=numpy.int32)}
+
+    x0 = extents[valid, 0].min()
+    y0 = extents[valid, 2].min()
+
+    if cell_size is None:
+        # one cell per box on average keeps both the table and the buckets small
+        area = ((extents[valid, 1] - extents[valid, 0]) * (extents[valid, 3] - extents[valid, 2])).sum()
+        cell_size = max(1.0, math.sqrt(area / n))
+
+    cx0, cx1 = _cell_of(extents[:, 0], x0, cell_size), _cell_of(extents[:, 1], x0, cell_size)
+    cy0, cy1 = _cell_of(extents[:, 2], y0, cell_size), _cell_of(extents[:, 3], y0, cell_size)
+    shape = (int(cx1[valid].max()) + 1, int(cy1[valid].max()) + 1)
+
+    # enumerate every (box, cell) pair covered by the box extents
+    nx = cx1 - cx0 + 1
+    ny = cy1 - cy0 + 1
+    counts = numpy.where(valid, nx * ny, 0)
+    box_ids = numpy.repeat(numpy.arange(len(extents)), counts)
+    starts = numpy.cumsum(counts) - counts
+    local = numpy.arange(counts.sum()) - numpy.repeat(starts, counts)
+    ny_rep = numpy.repeat(ny, counts)
+    cells = (numpy.repeat(cx0, counts) + local // ny_rep) * shape[1] \
+        + numpy.repeat(cy0, counts) + local % ny_rep
+
+    # bucket the pairs by cell, keeping box ids ascending inside each bucket
+    order = numpy.lexsort((box_ids, cells))
+    cells, box_ids = cells[order], box_ids[order]
+    per_cell = numpy.bincount(cells, minlength=shape[0] * shape[1])
+    cell_starts = numpy.cumsum(per_cell) - per_cell
+    slots = numpy.arange(len(cells)) - cell_starts[cells]
+
+    buckets = numpy.full((shape[0] * shape[1], max(1, int(per_cell.max()))), -1, dtype=numpy.int32)
+    buckets[cells, slots] = box_ids
+
+    return {'extents': extents, 'origin': (x0, y0), 'cell_size': cell_size,
+            'shape': shape, 'buckets': buckets}
+
+
+def get_box_index(mesh):
+    """
+    Returns the grid index of `mesh`, building it on first use and keeping it
+    in the mesh if it is array-backed.
+    """
+    index = mesh.get(INDEX)
+    if index is None:
+        index = build_box_index(mesh['boxes'])
+        # a legacy mesh is the caller's dict, and is indexed anew every time
+        if 'adj_offsets' in mesh:
+            mesh[INDEX] = index
+    return index
+
+
+def locate_points(points, mesh):
+    """
+    Resolves many points to the boxes containing them in one vectorized pass.
+
+    Matches the linear scan of `find_box_of_point`: when a point lies on the
+    border of several boxes, the box appearing first in `mesh['boxes']` wins.
+
+    Returns:
+        - An int array with the index into `mesh['boxes']` of each point, or -1
+    """
+    index = get_box_index(mesh)
+    pts = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 2)
+    result = numpy.full(len(pts), -1, dtype=numpy.int64)
+
+    for lo in range(0, len(pts), LOCATE_CHUNK):
+        result[lo:lo + LOCATE_CHUNK] = _locate_chunk(pts[lo:lo + LOCATE_CHUNK], index)
+
+    return result
+
+
+def boxes_in_rect(rect, mesh, touching=False):
+    """
+    Finds the boxes overlapping `rect` (xmin, xmax, ymin, ymax) with a positive
+    area, or, with `touching` set, every box sharing at least a point with it.
+
+    Returns:
+        - Sorted int array of box ids
+    """
+    index = get_box_index(mesh)
+    extents = index['extents']
+    x0, y0 = index['origin']
+    cell_size = index['cell_size']
+    rows, cols = index['shape']
+    xmin, xmax, ymin, ymax = rect
+
+    cx0, cx1 = _cell_of(numpy.array([xmin, xmax]), x0, cell_size).clip(0, rows - 1)
+    cy0, cy1 = _cell_of(numpy.array([ymin, ymax]), y0, cell_size).clip(0, cols - 1)
+    cells = (numpy.arange(cx0, cx1 + 1)[:, None] * cols + numpy.arange(cy0, cy1 + 1)).ravel()
+    candidates = numpy.unique(index['buckets'][cells])
+    candidates = candidates[candidates >= 0]
+
+    ext = extents[candidates]
+    if touching:
+        hit = (ext[:, 0] <= xmax) & (xmin <= ext[:, 1]) & (ext[:, 2] <= ymax) & (ymin <= ext[:, 3])
+    else:
+        hit = (ext[:, 0] < xmax) & (xmin < ext[:, 1]) & (ext[:, 2] < ymax) & (ymin < ext[:, 3])
+    return candidates[hit]
+
+
+def _locate_chunk(pts, index):
+    extents = index['extents']
+    x0, y0 = index['origin']
+    cell_size = index['cell_size']
+    rows, cols = index['shape']
+    x, y = pts[:, 0], pts[:, 1]
+
+    cx = _cell_of(x, x0, cell_size)
+    cy = _cell_of(y, y0, cell_size)
+    on_grid = (cx >= 0) & (cx < rows) & (cy >= 0) & (cy < cols)
+
+    candidates = index['buckets'][numpy.where(on_grid, cx * cols + cy, 0)]
+    ext = extents[candidates.clip(0)]
+    x, y = x[:, None], y[:, None]
+    inside = (candidates >= 0) & on_grid[:, None] \
+        & (ext[..., 0] <= x) & (x <= ext[..., 1]) \
+        & (ext[..., 2] <= y) & (y <= ext[..., 3])
+
+    first = inside.argmax(axis=1)
+    found = inside[numpy.arange(len(pts)), first]
+    return numpy.where(found, candidates[numpy.arange(len(pts)), first], -1)
+
+
+def _cell_of(values, origin, cell_size):
+    return numpy.floor((values - origin) / cell_size).astype(numpy.int64)
@@ -0,0 +1,101 @@
+import io
+import sys
+import contextlib
+
+import numpy
+
+from nm_batch import read_queries
+from nm_landmarks import LANDMARK_DISTS_TO, build_landmarks
+from nm_mesh import load_mesh
+
+# counters and timings aggregated by `summarize`
+FIELDS = ('pushes', 'pops', 'stale_pops', 'forward_expansions', 'backward_expansions',
+          'locate_time', 'search_time', 'reconstruct_time')
+
+
+class SearchStats:
+    """
+    Counters a search fills in when handed one through its `stats` argument.
+
+    Heap counters are read off the `graph_search.SearchSpace` of each direction
+    once the search is over, so a search without stats does no extra work.
+    Times are in seconds.
+    """
+
+    def __init__(self):
+        self.pushes = 0
+        self.pops = 0
+        self.stale_pops = 0  # pops skipped because their box was already expanded
+        self.forward_expansions = 0
+        self.backward_expansions = 0
+        self.meeting_box = None
+        self.locate_time = 0.0
+        self.search_time = 0.0
+        self.reconstruct_time = 0.0
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in FIELDS + ('meeting_box',)}
+
+
+def summarize(stats, percentiles=(50, 90, 99, 100)):
+    """
+    Returns:
+        - Dict of field -> list of the given percentiles over all `stats`
+    """
+    return {field: numpy.percentile([getattr(s, field) for s in stats], percentiles).tolist()
+            for field in FIELDS}
+
+
+def collect(queries, mesh, algorithm="bas"):
+    """
+    Runs every `(sx, sy, dx, dy)` query with stats, using `find_path_brs` for
+    "brs" and `find_path` with the given algorithm otherwise.
+
+    Returns:
+        - List of `SearchStats`, one per query
+        - Number of queries that found a path
+    """
+    import nm_pathfinder
+    from brs import find_path_brs
+
+    results = []
+    found = 0
+    with contextlib.redirect_stdout(io.StringIO()):  # silence "No Path"
+        for sx, sy, dx, dy in queries:
+            stats = SearchStats()
+            try:
+                if algorithm == "brs":
+                    path, _ = find_path_brs((sx, sy), (dx, dy), mesh, stats=stats)
+                else:
+                    path, _ = nm_pathfinder.find_path((sx, sy), (dx, dy), mesh, algorithm, stats=stats)
+            except ValueError:
+                path = []  # brs raises for points outside the mesh
+            found += bool(path)
+            results.append(stats)
+    return results, found
+
+
+if __name__ == '__main__':
+
+    algorithm = "bas"
+
+    if len(sys.argv) == 3:
+        mesh_filename, queries_filename = sys.argv[1:]
+    elif len(sys.argv) == 4:
+        mesh_filename, queries_filename, algorithm = sys.argv[1:]
+    else:
+        print("usage: %s map.mesh queries.csv [bas|alt|brs]" % sys.argv[0])
+        sys.exit(-1)
+
+    mesh = load_mesh(mesh_filename)
+    if algorithm == "alt" and LANDMARK_DISTS_TO not in mesh:
+        build_landmarks(mesh)
+    results, found = collect(read_queries(queries_filename), mesh, algorithm)
+
+    print("%d queries with %s, %d found a path." % (len(results), algorithm, found))
+    print("%-20s %12s %12s %12s %12s" % ("", "p50", "p90", "p99", "max"))
+    for field, values in summarize(results).items():
+        if field.endswith('_time'):
+            print("%-20s" % (field + " (ms)") + "".join(" %12.3f" % (v * 1000) for v in values))
+        else:
+            print("%-20s" % field + "".join(" %12.0f" % v for v in values))
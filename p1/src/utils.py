@@ -1,16 +1,22 @@
+from nm_mesh import BOXES, ADJ, ADJ_OFFSETS, ADJ_NEIGHBORS, as_array_mesh, box_of, connected, neighbors_of
+from nm_spatial import locate_points
+
 __all__ = [
     "BOXES",
     "ADJ",
+    "ADJ_OFFSETS",
+    "ADJ_NEIGHBORS",
+    "as_array_mesh",
+    "box_of",
+    "connected",
+    "neighbors_of",
     "find_box_of_point",
+    "find_box_id",
     "gen_path_from_boxes",
     "find_box_middle",
 ]
 
 
-BOXES = "boxes"
-ADJ = "adj"
-
-
 def find_box_of_point(point, mesh):
     """
     :param point:
@@ -20,13 +26,22 @@ def find_box_of_point(point, mesh):
     :return: box
     :rtype: tuple(int, int, int, int)
     """
-    boxes = mesh[BOXES]
-    x, y = point
+    mesh = as_array_mesh(mesh)
+    return box_of(find_box_id(point, mesh), mesh)
 
-    for box in boxes:
-        tlx, brx, tly, bry = box
-        if tlx <= x <= brx and tly <= y <= bry:
-            return box
+
+def find_box_id(point, mesh):
+    """
+    :param point:
+    :type point: tuple(int, int)
+    :param mesh: an array-backed mesh, see `as_array_mesh`
+    :type mesh: dict
+    :return: id of the box containing the point
+    :rtype: int
+    """
+    box_id = locate_points([point], mesh)[0]
+    if box_id >= 0:
+        return int(box_id)
 
     raise ValueError("can't find point in mesh")
 
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import numpy
+import pytest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+INPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input')
+sys.path.insert(0, SRC_DIR)
+
+
+def walled_map(size=64):
+    """
+    A free square split by a wall with one gap, plus a blocked island, a
+    closed-off pocket and a few grey (neither free nor blocked) pixels.
+    """
+    image = numpy.full((size, size), 255, dtype=numpy.uint8)
+    image[:, size // 2] = 0
+    image[size // 4:size // 4 + 4, size // 2] = 255  # the gap
+    image[40:48, 8:16] = 0
+    image[50:60, 40:60] = 0
+    image[52:58, 42:58] = 255  # pocket inside the blocked block
+    image[5, 5:9] = 128
+    return image
+
+
+@pytest.fixture
+def small_map():
+    return walled_map()
+
+
+@pytest.fixture(scope='session')
+def homer():
+    from nm_meshbuilder import load_occupancy, occupancy_image
+    return occupancy_image(*load_occupancy(os.path.join(INPUT_DIR, 'homer.png')))
@@ -0,0 +1,135 @@
+import importlib
+import os
+import random
+
+import pytest
+
+from conftest import SRC_DIR
+
+DFS_DIR = os.path.join(SRC_DIR, 'Dijkstra_Forward_Search')
+
+
+@pytest.fixture
+def dfs(monkeypatch):
+    monkeypatch.syspath_prepend(DFS_DIR)
+    return importlib.import_module('Dijkstra_forward_search')
+
+
+def random_level(tmp_path, seed, digits='1', size=24, walls=0.3):
+    """
+    Writes a level of random `digits` and walls inside a wall border, with
+    waypoints a to e on free cells, and returns its filename.
+    """
+    rng = random.Random(seed)
+    rows = [['X'] * size for _ in range(size)]
+    for y in range(1, size - 1):
+        for x in range(1, size - 1):
+            if rng.random() >= walls:
+                rows[y][x] = rng.choice(digits)
+    free = [(x, y) for y in range(size) for x in range(size) if rows[y][x] != 'X']
+    for letter, (x, y) in zip('abcde', rng.sample(free, 5)):
+        rows[y][x] = letter
+    filename = str(tmp_path / ('level%d.txt' % seed))
+    with open(filename, 'w') as f:
+        f.write('\n'.join(''.join(row) for row in rows))
+    return filename
+
+
+def path_cost(dfs, level, path):
+    return sum(dfs.transition_cost(level, cell, previous) for previous, cell in zip(path, path[1:]))
+
+
+def waypoint_pairs(level):
+    cells = sorted(level['waypoints'].values())
+    return [(src, dst) for src in cells for dst in cells]
+
+
+# the denser mazes leave some waypoints walled off
+@pytest.mark.parametrize('seed, walls', [(seed, 0.3) for seed in range(6)] + [(0, 0.45), (7, 0.45)])
+def test_jump_costs_match_dijkstra_on_uniform_mazes(dfs, tmp_path, seed, walls):
+    filename = random_level(tmp_path, seed, walls=walls)
+    level, grid = dfs.load_level(filename), dfs.load_level_grid(filename)
+    tables = dfs.jump_tables(grid)
+    dijkstra_expanded, jump_expanded = [], []
+    for src, dst in waypoint_pairs(level):
+        expected = dfs.grid_shortest_path(src, dst, grid, expanded=dijkstra_expanded)
+        path = dfs.jump_shortest_path(src, dst, grid, tables, expanded=jump_expanded)
+        if not expected:
+            assert path is False
+            continue
+        assert path[0] == src and path[-1] == dst
+        assert all(cell in level['spaces'] for cell in path)
+        assert path_cost(dfs, level, path) == pytest.approx(path_cost(dfs, level, expected))
+    assert len(jump_expanded) < len(dijkstra_expanded)
+
+
+def test_jump_falls_back_to_dijkstra_on_weighted_cells(dfs, tmp_path):
+    filename = random_level(tmp_path, 0, digits='123456789', walls=0.1)
+    level, grid = dfs.load_level(filename), dfs.load_level_grid(filename)
+    # with random costs hardly a cell has all its neighbors at its own cost
+    assert sum(dfs.uniform_cells(grid)) <= 2
+    for src, dst in waypoint_pairs(level):
+        dijkstra_expanded, jump_expanded = [], []
+        expected = dfs.grid_shortest_path(src, dst, grid, expanded=dijkstra_expanded)
+        path = dfs.jump_shortest_path(src, dst, grid, expanded=jump_expanded)
+        assert path_cost(dfs, level, path) == pytest.approx(path_cost(dfs, level, expected))
+        # no cell is jumped over, so about as many are expanded as by Dijkstra
+        assert len(jump_expanded) >= len(dijkstra_expanded) - 2
+
+
+def test_matrix_routes_are_cheapest(dfs, tmp_path):
+    filename = random_level(tmp_path, 0, walls=0.45)
+    level, grid = dfs.load_level(filename), dfs.load_level_grid(filename)
+    matrix = dfs.waypoint_matrix(filename)
+    for src in level['waypoints']:
+        for dst in level['waypoints']:
+            expected = dfs.grid_shortest_path(level['waypoints'][src], level['waypoints'][dst], grid)
+            route = dfs.matrix_route(matrix, src, dst)
+            if not expected:
+                assert route is False
+                continue
+            assert route[0] == level['waypoints'][src] and route[-1] == level['waypoints'][dst]
+            assert path_cost(dfs, level, route) == pytest.approx(path_cost(dfs, level, expected))
+            assert matrix['costs'][matrix['waypoints'].index(src), matrix['waypoints'].index(dst)] == (
+                pytest.approx(path_cost(dfs, level, expected)))
+
+
+def test_matrix_cache_is_kept_next_to_the_level(dfs, tmp_path, monkeypatch):
+    filename = random_level(tmp_path, 1)
+    monkeypatch.chdir(DFS_DIR)
+    matrix = dfs.waypoint_matrix(filename)
+    cached = [name for name in os.listdir(tmp_path) if name.endswith('.npz')]
+    assert len(cached) == 1
+    assert not any(name.endswith('.npz') for name in os.listdir(DFS_DIR))
+    dfs.waypoint_matrix(filename, str(tmp_path / 'cache'))
+    assert os.listdir(tmp_path / 'cache') == cached
+
+    # a hit loads the same matrix without searching again
+    monkeypatch.setattr(dfs, 'grid_distances', None)
+    again = dfs.waypoint_matrix(filename)
+    assert again['waypoints'] == matrix['waypoints']
+    for key in ('cells', 'costs', 'trees', 'shape'):
+        assert (again[key] == matrix[key]).all()
+
+
+def test_matrix_cache_follows_level_changes(dfs, tmp_path):
+    filename = random_level(tmp_path, 2)
+    level = dfs.load_level(filename)
+    before = dfs.waypoint_matrix(filename)
+
+    # wall in waypoint a, so it no longer reaches any other
+    x, y = level['waypoints']['a']
+    with open(filename) as f:
+        rows = [list(row) for row in f.read().split('\n')]
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            if dx or dy:
+                rows[y + dy][x + dx] = 'X'
+    with open(filename, 'w') as f:
+        f.write('\n'.join(''.join(row) for row in rows))
+
+    after = dfs.waypoint_matrix(filename)
+    assert len([name for name in os.listdir(tmp_path) if name.endswith('.npz')]) == 2
+    assert before['costs'][0, 1] < float('inf')
+    assert after['costs'][0, 1] == float('inf')
+    assert dfs.matrix_route(after, 'a', 'b') is False
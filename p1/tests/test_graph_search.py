@@ -0,0 +1,223 @@
+import importlib
+import math
+import os
+import pickle
+import random
+from heapq import heappop, heappush
+
+import pytest
+
+import nm_pathfinder
+from brs import find_path_brs
+from conftest import INPUT_DIR, SRC_DIR
+from nm_mesh import as_array_mesh, box_middles, connected
+from nm_pathfinder import distance, find_detail_points, heuristic
+from utils import gen_path_from_boxes
+
+REPO_DIR = os.path.join(SRC_DIR, '..', '..')
+
+
+# The searches below are copies of the heapq (and stack) loops the searches
+# had before graph_search, kept as the reference they match.
+
+def find_box_of_point(point, mesh):
+    x, y = point
+    for box in mesh['boxes']:
+        xmin, xmax, ymin, ymax = box
+        if xmin <= x <= xmax and ymin <= y <= ymax:
+            return box
+    return None
+
+
+def reference_find_path(source_point, destination_point, mesh):
+    mesh_adj = mesh['adj']
+    f_explored, b_explored = set(), set()
+    f_costs, b_costs = {}, {}
+    f_came_from, b_came_from = {}, {}
+    f_detail_points, b_detail_points = {}, {}
+    f_frontier, b_frontier = [], []
+
+    src_box = find_box_of_point(source_point, mesh)
+    dest_box = find_box_of_point(destination_point, mesh)
+
+    f_costs[src_box] = 0
+    f_came_from[src_box] = None
+    f_detail_points[src_box] = source_point
+    heappush(f_frontier, (0, src_box))
+    b_costs[dest_box] = 0
+    b_came_from[dest_box] = None
+    b_detail_points[dest_box] = destination_point
+    heappush(b_frontier, (0, dest_box))
+
+    meeting_box = None
+    while f_frontier and b_frontier and meeting_box is None:
+        for frontier, explored, other, costs, came_from, detail_points, goal in (
+                (f_frontier, f_explored, b_explored, f_costs, f_came_from, f_detail_points, destination_point),
+                (b_frontier, b_explored, f_explored, b_costs, b_came_from, b_detail_points, source_point)):
+            _, current_box = heappop(frontier)
+            explored.add(current_box)
+            if current_box in other:
+                meeting_box = current_box
+                break
+            for neighbor in mesh_adj.get(current_box, []):
+                next_pt = find_detail_points(current_box, neighbor)
+                new_cost = costs[current_box] + distance(detail_points[current_box], next_pt)
+                if neighbor in costs and new_cost >= costs[neighbor]:
+                    continue
+                costs[neighbor] = new_cost
+                came_from[neighbor] = current_box
+                detail_points[neighbor] = next_pt
+                heappush(frontier, (new_cost + heuristic(next_pt, goal), neighbor))
+
+    path = []
+    box = meeting_box
+    while box:
+        path.append(f_detail_points[box])
+        box = f_came_from.get(box)
+    path.reverse()
+    box = b_came_from.get(meeting_box)
+    while box:
+        path.append(b_detail_points[box])
+        box = b_came_from.get(box)
+    return path, f_explored | b_explored
+
+
+def reference_find_path_brs(source_point, destination_point, mesh):
+    mesh_adj = mesh['adj']
+    src_box = find_box_of_point(source_point, mesh)
+    dest_box = find_box_of_point(destination_point, mesh)
+
+    explored = {src_box: None}
+    frontier = [src_box]
+    while frontier:
+        current_box = frontier.pop()
+        for nei_box in mesh_adj[current_box]:
+            if nei_box in explored:
+                continue
+            explored[nei_box] = current_box
+            frontier.append(nei_box)
+        if dest_box in explored:
+            break
+
+    boxes_path = []
+    box = dest_box
+    while box:
+        boxes_path.append(box)
+        box = explored[box]
+    boxes_path.reverse()
+    return gen_path_from_boxes(boxes_path, source_point, destination_point), explored
+
+
+def reference_grid_dijkstra(initial_position, destination, graph, adj, transition_cost):
+    paths = {initial_position: []}
+    pathcosts = {initial_position: 0}
+    queue = [(0, initial_position)]
+    while queue:
+        priority, cell = heappop(queue)
+        if cell == destination:
+            path = []
+            while cell != []:
+                path.append(cell)
+                cell = paths[cell]
+            return path[::-1]
+        for (child, step_cost) in adj(graph, cell):
+            cost_to_child = priority + transition_cost(graph, cell, child)
+            if child not in pathcosts or cost_to_child < pathcosts[child]:
+                pathcosts[child] = cost_to_child
+                paths[child] = cell
+                heappush(queue, (cost_to_child, child))
+    return False
+
+
+def reference_p5_dijkstra(src, isdst, adj, subOptimal):
+    dist = {src: 0}
+    prev = {src: None}
+    heap = [(0, src)]
+    pathLength = math.inf
+    paths = []
+    while heap:
+        node = heappop(heap)
+        if isdst(node[1]):
+            if node[0] < pathLength:
+                pathLength = node[0]
+            elif node[0] > pathLength + subOptimal:
+                break
+            path = []
+            nodeR = node[1]
+            while nodeR:
+                path.append(nodeR)
+                nodeR = prev[nodeR]
+            paths.append((node[0], path[::-1]))
+            continue
+        for next_node in adj(node):
+            if next_node[1] not in dist or next_node[0] < dist[next_node[1]]:
+                dist[next_node[1]] = next_node[0]
+                prev[next_node[1]] = node[1]
+                heappush(heap, tuple(next_node))
+    return paths
+
+
+@pytest.fixture(scope='module')
+def homer_queries():
+    with open(os.path.join(INPUT_DIR, 'homer.png.mesh.pickle'), 'rb') as f:
+        mesh = pickle.load(f)
+    arrays = as_array_mesh(mesh)
+    middles = [tuple(pt) for pt in box_middles(arrays).tolist()]
+    rng = random.Random(0)
+    queries = []
+    while len(queries) < 40:
+        src, dest = rng.randrange(len(middles)), rng.randrange(len(middles))
+        if connected(src, dest, arrays):
+            queries.append((middles[src], middles[dest]))
+    return mesh, queries
+
+
+def test_find_path_matches_reference(homer_queries):
+    mesh, queries = homer_queries
+    for source, destination in queries:
+        path, explored = nm_pathfinder.find_path(source, destination, mesh)
+        expected_path, expected_explored = reference_find_path(source, destination, mesh)
+        assert [tuple(pt) for pt in path] == expected_path
+        assert {tuple(box) for box in explored} == expected_explored
+
+
+def test_brs_matches_reference(homer_queries):
+    mesh, queries = homer_queries
+    for source, destination in queries:
+        assert find_path_brs(source, destination, mesh) == reference_find_path_brs(source, destination, mesh)
+
+
+def test_grid_dijkstra_matches_reference(monkeypatch):
+    monkeypatch.syspath_prepend(os.path.join(SRC_DIR, 'Dijkstra_Forward_Search'))
+    monkeypatch.chdir(os.path.join(SRC_DIR, 'Dijkstra_Forward_Search'))
+    dfs = importlib.import_module('Dijkstra_forward_search')
+    level = dfs.load_level('example.txt')
+    grid = dfs.load_level_grid('example.txt')
+    waypoints = sorted(level['waypoints'].values())
+    for src in waypoints:
+        for dst in waypoints:
+            expected = reference_grid_dijkstra(src, dst, level, dfs.navigation_edges, dfs.transition_cost)
+            assert dfs.dijkstras_shortest_path(src, dst, level, dfs.navigation_edges) == expected
+            assert dfs.grid_shortest_path(src, dst, grid) == expected
+
+
+@pytest.mark.parametrize('sub_optimal', [0, 1.5, 4])
+def test_p5_dijkstra_matches_reference(monkeypatch, sub_optimal):
+    monkeypatch.syspath_prepend(os.path.join(REPO_DIR, 'p5', 'src'))
+    pathfinding = importlib.import_module('pathfinding')
+
+    # a grid of rows with random step costs, searched from the left column to the right one
+    rng = random.Random(1)
+    width, height = 12, 6
+    weights = {(x, y): rng.choice([1, 1.4, 2]) for x in range(1, width + 1) for y in range(1, height + 1)}
+
+    def adj(node):
+        dist, (x, y) = node
+        return [[dist + weights[nb], nb] for nb in ((x + 1, y), (x, y - 1), (x, y + 1), (x - 1, y))
+                if nb in weights]
+
+    def isdst(state):
+        return state[0] == width
+
+    assert (pathfinding.dijkstras_shortest_path((1, 3), isdst, adj, sub_optimal)
+            == reference_p5_dijkstra((1, 3), isdst, adj, sub_optimal))
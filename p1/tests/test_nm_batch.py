@@ -0,0 +1,76 @@
+import math
+import os
+import subprocess
+import sys
+
+import numpy
+import pytest
+
+from conftest import INPUT_DIR, SRC_DIR
+from nm_batch import find_paths
+from nm_mesh import save_mesh
+from nm_meshbuilder import build_mesh, load_occupancy, occupancy_image
+from nm_pathfinder import find_path
+from test_nm_pathfinder import path_length
+
+# batch paths follow the box graph costs rather than the portal distances of
+# find_path; over 2000 homer queries they were about 3% longer in total
+TOTAL_BOUND = 1.05
+
+
+@pytest.fixture(scope='module')
+def homer_batch():
+    image = occupancy_image(*load_occupancy(os.path.join(INPUT_DIR, 'homer.png')))
+    mesh = build_mesh(image, 16)
+    free = numpy.argwhere(image == 255)
+    rng = numpy.random.default_rng(0)
+    queries = [tuple(free[i].tolist()) + tuple(free[j].tolist()) for i, j in rng.integers(0, len(free), (300, 2))]
+    # one endpoint off every box, and a repeated source box
+    queries += [(-5, -5, 100, 100), queries[0][:2] + queries[1][2:]]
+    return mesh, queries
+
+
+def test_batch_joins_what_find_path_joins(homer_batch):
+    mesh, queries = homer_batch
+    costs, path_offsets, points = find_paths(queries, mesh)
+    assert len(costs) == len(queries) and len(path_offsets) == len(queries) + 1
+
+    total = single_total = 0
+    for i, (sx, sy, dx, dy) in enumerate(queries):
+        path = [tuple(pt) for pt in points[path_offsets[i]:path_offsets[i + 1]].tolist()]
+        single, _ = find_path((sx, sy), (dx, dy), mesh)
+        if not single:
+            assert costs[i] == math.inf and path == []
+            continue
+        assert path[0] == (sx, sy) and path[-1] == (dx, dy)
+        assert costs[i] == pytest.approx(path_length(path))
+        if tuple(single[-1]) != (dx, dy):
+            single = single + [(dx, dy)]
+        total += costs[i]
+        single_total += path_length(single)
+    assert total <= TOTAL_BOUND * single_total
+
+
+def test_workers_give_the_same_answers(homer_batch):
+    mesh, queries = homer_batch
+    for one, many in zip(find_paths(queries, mesh), find_paths(queries, mesh, workers=2)):
+        assert numpy.array_equal(one, many)
+
+
+def test_cli_writes_the_paths(homer_batch, tmp_path):
+    mesh, queries = homer_batch
+    dirname = str(tmp_path / 'homer.png.mesh')
+    save_mesh(mesh, dirname)
+    queries_filename = str(tmp_path / 'queries.csv')
+    with open(queries_filename, 'w') as f:
+        f.write('sx,sy,dx,dy\n')
+        f.writelines('%s,%s,%s,%s\n' % query for query in queries)
+
+    result = subprocess.run([sys.executable, os.path.join(SRC_DIR, 'nm_batch.py'), dirname, queries_filename],
+                            capture_output=True, text=True, check=True)
+    costs, path_offsets, points = find_paths(queries, mesh)
+    assert "Answered %d queries (%d without a path)" % (len(queries), numpy.isinf(costs).sum()) in result.stdout
+    with numpy.load(queries_filename + '.paths.npz') as saved:
+        assert numpy.array_equal(saved['costs'], costs)
+        assert numpy.array_equal(saved['path_offsets'], path_offsets)
+        assert numpy.array_equal(saved['path_points'], points)
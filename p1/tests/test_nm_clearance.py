@@ -0,0 +1,56 @@
+import math
+
+import numpy
+import pytest
+
+from nm_clearance import MAX_CLEARANCE, PORTAL_CLEARANCE, add_clearance, distance_transform, portal_contacts
+from nm_mesh import ADJ_NEIGHBORS, ADJ_OFFSETS, BOXES, PORTAL_POINTS
+from nm_meshbuilder import build_mesh
+from nm_pathfinder import find_path
+
+
+def test_corner_contacts_take_corner_clearance(homer):
+    mesh = add_clearance(build_mesh(homer, 8), homer)
+    distances = distance_transform(homer)
+    contacts = portal_contacts(mesh)
+    corner = (contacts[:, 0] == contacts[:, 2]) & (contacts[:, 1] == contacts[:, 3])
+    assert corner.any()
+
+    sources = numpy.repeat(numpy.arange(len(mesh[BOXES])), numpy.diff(mesh[ADJ_OFFSETS]))[corner]
+    targets = mesh[ADJ_NEIGHBORS][corner]
+    clearances = mesh[PORTAL_CLEARANCE][corner]
+    for (x, y, _, _), src, dest, clearance in zip(contacts[corner].astype(int).tolist(), sources, targets,
+                                                   clearances.tolist()):
+        for x1, x2, y1, y2 in (mesh[BOXES][src], mesh[BOXES][dest]):
+            assert x in (x1, x2) and y in (y1, y2)
+        assert clearance == distances[x - 1:x + 1, y - 1:y + 1].min()
+    # most diagonal steps have room for an agent
+    assert (clearances > 0).mean() > 0.5
+
+
+def test_portals_take_clearance_where_paths_cross(homer):
+    mesh = add_clearance(build_mesh(homer, 8), homer)
+    distances = distance_transform(homer)
+    rows, cols = distances.shape
+
+    contacts = portal_contacts(mesh)
+    corner = (contacts[:, 0] == contacts[:, 2]) & (contacts[:, 1] == contacts[:, 3])
+    crossings = set(map(tuple, mesh[PORTAL_POINTS][~corner].tolist()))
+
+    # every portal a path for an agent crosses has room for it where it does
+    free = numpy.argwhere(homer == 255)
+    rng = numpy.random.default_rng(0)
+    for radius in (2, 5):
+        for i, j in rng.integers(0, len(free), (20, 2)):
+            path, _ = find_path(tuple(free[i].tolist()), tuple(free[j].tolist()), mesh, agent_radius=radius)
+            for x, y in path[1:-1]:
+                if (x, y) in crossings:
+                    around = distances[max(math.ceil(x) - 1, 0):min(math.floor(x) + 1, rows),
+                                       max(math.ceil(y) - 1, 0):min(math.floor(y) + 1, cols)]
+                    assert around.min() >= radius
+
+
+def test_radius_past_the_stored_clearance_is_rejected(small_map):
+    mesh = add_clearance(build_mesh(small_map, 4), small_map)
+    with pytest.raises(ValueError, match="largest clearance"):
+        find_path((1, 1), (62, 62), mesh, agent_radius=MAX_CLEARANCE + 1)
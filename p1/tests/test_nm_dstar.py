@@ -0,0 +1,97 @@
+import math
+import random
+
+import numpy
+import pytest
+
+from nm_dstar import DStarLite
+from nm_landmarks import graph_distances, transpose_graph
+from nm_mesh import ADJ_NEIGHBORS, ADJ_OFFSETS, EDGE_COSTS, box_middles, connected
+from nm_meshbuilder import build_mesh
+
+
+def costs_to(goal, mesh, overrides):
+    """
+    Dijkstra toward box `goal` over the edge costs of `mesh`, with the costs
+    set through `DStarLite.set_edge_cost` in `overrides`.
+    """
+    offsets = numpy.asarray(mesh[ADJ_OFFSETS], dtype=numpy.int64)
+    neighbors = numpy.asarray(mesh[ADJ_NEIGHBORS], dtype=numpy.int64)
+    sources = numpy.repeat(numpy.arange(len(offsets) - 1), numpy.diff(offsets))
+    costs = numpy.array(mesh[EDGE_COSTS], dtype=numpy.float64)
+    for (box_a, box_b), cost in overrides.items():
+        # boxes may be linked more than once, and the cost holds for every link
+        costs[(sources == box_a) & (neighbors == box_b)] = cost
+    offsets, targets, weights = transpose_graph(offsets, neighbors, costs)
+    return graph_distances(goal, offsets, targets, weights)
+
+
+def next_box(planner, box):
+    return min(planner.successors(box), key=lambda pair: pair[1] + planner.g.get(pair[0], math.inf))[0]
+
+
+@pytest.fixture(scope='module')
+def homer_mesh(homer):
+    return build_mesh(homer, 16)
+
+
+def test_replan_matches_dijkstra(homer_mesh):
+    mesh = homer_mesh
+    middles = [tuple(pt) for pt in box_middles(mesh).tolist()]
+    rng = random.Random(0)
+    for _ in range(5):
+        start, goal = rng.randrange(len(middles)), rng.randrange(len(middles))
+        if start == goal or not connected(start, goal, mesh):
+            continue
+        planner = DStarLite(mesh, middles[goal])
+        overrides = {}
+        for step in range(6):
+            path, _ = planner.replan(middles[start])
+            expected = costs_to(goal, mesh, overrides)[start]
+            assert planner.g.get(start, math.inf) == pytest.approx(expected)
+            if math.isinf(expected):
+                assert path == []
+                break
+            assert path[0] == middles[start] and path[-1] == middles[goal]
+            if start == goal:
+                break
+
+            if step % 2:
+                # walk one box along the path
+                start = next_box(planner, start)
+            else:
+                # make a step of the path much dearer, or close it
+                box = next_box(planner, start)
+                cost = math.inf if step == 4 else 10 * planner.g[start]
+                planner.set_edge_cost(start, box, cost)
+                overrides[(start, box)] = overrides[(box, start)] = cost
+
+
+def test_local_change_expands_less_than_a_new_search(homer_mesh):
+    mesh = homer_mesh
+    middles = [tuple(pt) for pt in box_middles(mesh).tolist()]
+    rng = random.Random(1)
+    repaired = fresh = 0
+    for _ in range(30):
+        start, goal = rng.randrange(len(middles)), rng.randrange(len(middles))
+        if not connected(start, goal, mesh):
+            continue
+        planner = DStarLite(mesh, middles[goal])
+        planner.replan(middles[start])
+        if start == goal or next_box(planner, start) == goal:
+            continue
+
+        # the agent takes a step and finds the next one dearer
+        start = next_box(planner, start)
+        box = next_box(planner, start)
+        cost = 2 * planner.g[start]
+        planner.set_edge_cost(start, box, cost)
+        planner.replan(middles[start])
+        repaired += planner.expansions
+
+        new = DStarLite(mesh, middles[goal])
+        new.set_edge_cost(start, box, cost)
+        new.replan(middles[start])
+        fresh += new.expansions
+        assert planner.g[start] == pytest.approx(new.g[start])
+    assert 0 < repaired < fresh / 2
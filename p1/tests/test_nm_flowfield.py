@@ -0,0 +1,85 @@
+import math
+from itertools import repeat
+
+import numpy
+import pytest
+
+from graph_search import SearchSpace, dijkstra
+from nm_flowfield import FlowFieldCache
+from nm_mesh import ADJ_NEIGHBORS, ADJ_OFFSETS, BOXES, EDGE_COSTS
+from nm_meshbuilder import build_mesh
+from nm_pathfinder import find_path
+from nm_spatial import locate_points
+from test_nm_pathfinder import path_length, random_queries
+
+# flow fields follow the box graph costs rather than the portal distances of
+# find_path; over random homer queries they were a few percent longer in total
+TOTAL_BOUND = 1.05
+
+
+def box_costs(source, mesh):
+    offsets, neighbors, edge_costs = mesh[ADJ_OFFSETS], mesh[ADJ_NEIGHBORS], mesh[EDGE_COSTS]
+
+    def box_neighbors(box):
+        start, end = offsets[box], offsets[box + 1]
+        return zip(neighbors[start:end].tolist(), edge_costs[start:end].tolist(), repeat(None))
+
+    space = SearchSpace(len(offsets) - 1)
+    space.start(source)
+    dijkstra(space, box_neighbors)
+    return space.costs
+
+
+def test_following_reaches_the_goal(homer):
+    mesh = build_mesh(homer, 16)
+    cache = FlowFieldCache(mesh)
+    total = single_total = 0
+    for source, destination in random_queries(mesh, 100, seed=5):
+        path, boxes = cache.find_path(source, destination)
+        src_box, dest_box = locate_points([source, destination], mesh).tolist()
+        assert path[0] == source and path[-1] == destination
+        assert {tuple(mesh[BOXES][box].tolist()) for box in (src_box, dest_box)} <= set(boxes)
+
+        # the field holds the cheapest box graph cost, and the walk adds up to it
+        field = cache.get(dest_box)
+        assert field['cost'][src_box] == pytest.approx(box_costs(src_box, mesh)[dest_box])
+        walked, box = 0.0, src_box
+        while box != dest_box:
+            edge = field['next_edge'][box]
+            assert mesh[ADJ_NEIGHBORS][edge] == field['next_box'][box]
+            walked += mesh[EDGE_COSTS][edge]
+            box = int(field['next_box'][box])
+        assert walked == pytest.approx(field['cost'][src_box])
+
+        single, _ = find_path(source, destination, mesh)
+        if tuple(single[-1]) != destination:
+            single = single + [destination]
+        total += path_length(path)
+        single_total += path_length(single)
+    assert total <= TOTAL_BOUND * single_total
+
+
+def test_least_recently_used_field_is_dropped(small_map):
+    mesh = build_mesh(small_map, 4)
+    cache = FlowFieldCache(mesh, maxsize=2)
+    first, second = cache.get(0), cache.get(1)
+    assert cache.get(0) is first  # now the most recently used
+    third = cache.get(2)
+    assert list(cache.fields) == [0, 2]
+    assert cache.get(0) is first and cache.get(2) is third
+    assert cache.get(1) is not second
+
+
+def test_invalidate_drops_fields_reaching_the_boxes(small_map):
+    mesh = build_mesh(small_map, 4)
+    cache = FlowFieldCache(mesh)
+    # (55, 50) lies in the pocket closed off inside the blocked block
+    main, pocket, other = locate_points([(1, 1), (55, 50), (62, 62)], mesh).tolist()
+    assert math.isinf(cache.get(main)['cost'][pocket])
+    cache.get(pocket)
+
+    cache.invalidate([other])
+    assert list(cache.fields) == [pocket]
+    cache.get(main)
+    cache.invalidate(numpy.array([pocket]))
+    assert list(cache.fields) == [main]
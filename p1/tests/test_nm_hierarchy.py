@@ -0,0 +1,29 @@
+from nm_hierarchy import build_hierarchy, find_path_hierarchical
+from nm_meshbuilder import build_mesh
+from nm_pathfinder import find_path
+from test_nm_pathfinder import path_length, random_queries
+
+# the hierarchy routes through box middles and region entrances; over a few
+# thousand queries on small_map and homer no path was more than 1.55 times the
+# "bas" one, and all of them together were under 3% longer
+LENGTH_BOUND = 2
+TOTAL_BOUND = 1.05
+
+
+def test_hierarchical_joins_the_same_endpoints(small_map, homer):
+    for mesh in (build_mesh(small_map, 4), build_mesh(homer, 16)):
+        build_hierarchy(mesh)
+        total = plain_total = 0
+        for source, destination in random_queries(mesh, 100, seed=3):
+            plain, _ = find_path(source, destination, mesh)
+            path, _ = find_path_hierarchical(source, destination, mesh)
+            assert plain[0] == path[0] == source
+            assert path[-1] == destination
+            # "bas" stops at the portal into the destination box when both
+            # searches meet there
+            if tuple(plain[-1]) != destination:
+                plain = plain + [destination]
+            assert path_length(path) <= LENGTH_BOUND * path_length(plain) + 1e-9
+            total += path_length(path)
+            plain_total += path_length(plain)
+        assert total <= TOTAL_BOUND * plain_total
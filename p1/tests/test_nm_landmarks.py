@@ -0,0 +1,33 @@
+import random
+
+import pytest
+
+from nm_landmarks import build_landmarks
+from nm_mesh import box_middles
+from nm_meshbuilder import build_mesh
+from nm_pathfinder import find_path
+
+
+def path_length(path):
+    return sum(((x2 - x1) ** 2 + (y2 - y1) ** 2) ** 0.5 for (x1, y1), (x2, y2) in zip(path, path[1:]))
+
+
+def test_landmark_bounds_keep_optimal_paths(homer):
+    mesh = build_landmarks(build_mesh(homer, 16), 4)
+    rng = random.Random(0)
+    middles = [tuple(pt) for pt in box_middles(mesh).tolist()]
+    explored = [0, 0]
+    for _ in range(40):
+        source, destination = rng.choice(middles), rng.choice(middles)
+        shortest, straight = find_path(source, destination, mesh, "bas", optimal=True)
+        path, landmark = find_path(source, destination, mesh, "alt", optimal=True)
+        assert path_length(path) == pytest.approx(path_length(shortest))
+        explored[0] += len(straight)
+        explored[1] += len(landmark)
+    assert explored[1] < explored[0]
+
+
+def test_alt_without_landmarks(small_map):
+    mesh = build_mesh(small_map, 4)
+    with pytest.raises(ValueError, match="build_landmarks"):
+        find_path((1, 1), (62, 62), mesh, "alt")
@@ -0,0 +1,61 @@
+import os
+
+import numpy
+
+from nm_hierarchy import build_hierarchy
+from nm_landmarks import LANDMARKS, LANDMARK_KEYS, build_landmarks
+from nm_mesh import BOXES, COMPONENTS, load_mesh, save_mesh
+from nm_meshbuilder import build_mesh, build_pyramid
+from nm_pathfinder import find_path
+from nm_pyramid import PARENTS, PYRAMID_KEY
+
+
+def test_save_load_round_trip(tmp_path, small_map):
+    mesh = build_mesh(small_map, 4)
+    dirname = str(tmp_path / 'map.mesh')
+    save_mesh(mesh, dirname)
+    loaded = load_mesh(dirname)
+
+    for key, value in mesh.items():
+        if isinstance(value, numpy.ndarray):
+            assert numpy.array_equal(loaded[key], value), key
+    assert not os.path.exists(dirname + '.partial')
+
+
+def test_rebuild_over_existing_directory(tmp_path, homer):
+    dirname = str(tmp_path / 'homer.mesh')
+    mesh = build_mesh(homer, 16)
+    build_pyramid(mesh, homer, [256, 4096])
+    build_landmarks(mesh, 4)
+    save_mesh(mesh, dirname)
+
+    rebuilt = build_mesh(homer, 8)
+    save_mesh(rebuilt, dirname)
+    loaded = load_mesh(dirname)
+
+    assert sorted(os.listdir(dirname)) == sorted(key + '.npy' for key, value in rebuilt.items()
+                                                 if isinstance(value, numpy.ndarray))
+    assert LANDMARKS not in loaded
+    assert PYRAMID_KEY % (0, PARENTS) not in loaded
+    assert numpy.array_equal(loaded[BOXES], rebuilt[BOXES])
+
+
+def test_save_keys_adds_to_directory(tmp_path, small_map):
+    dirname = str(tmp_path / 'map.mesh')
+    save_mesh(build_mesh(small_map, 4), dirname)
+    mesh = load_mesh(dirname)
+    build_landmarks(mesh, 2)
+    save_mesh(mesh, dirname, keys=LANDMARK_KEYS)
+
+    loaded = load_mesh(dirname)
+    assert LANDMARKS in loaded and COMPONENTS in loaded
+    path, _ = find_path((1, 1), (62, 62), loaded, "alt")
+    assert path[0] == (1, 1) and path[-1] == (62, 62)
+
+
+def test_hierarchy_is_opt_in(small_map):
+    mesh = build_mesh(small_map, 4)
+    plain = find_path((1, 1), (62, 62), mesh)
+    build_hierarchy(mesh)
+    assert find_path((1, 1), (62, 62), mesh) == plain
+    assert find_path((1, 1), (62, 62), mesh, "bas") == plain
@@ -0,0 +1,113 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import numpy
+import pytest
+from matplotlib.pyplot import imread
+
+from conftest import INPUT_DIR, SRC_DIR
+from nm_mesh import BOXES, mesh_filename
+from nm_meshbuilder import (MESH_KEY_FILE, build_mesh, build_mesh_tiled, load_occupancy, mesh_key,
+                            occupancy_image, saved_mesh_key, scan, split_box)
+
+
+def covered(image, boxes):
+    """
+    Checks that `boxes` are free and pairwise disjoint.
+
+    Returns:
+        - Number of pixels they cover
+    """
+    cover = numpy.zeros(image.shape, dtype=numpy.int32)
+    for x1, x2, y1, y2 in boxes.tolist():
+        assert (image[x1:x2, y1:y2] == 255).all()
+        cover[x1:x2, y1:y2] += 1
+    assert cover.max() <= 1
+    return int(cover.sum())
+
+
+def test_split_box_always_shrinks():
+    for box in [(0, 2, 0, 2), (0, 1, 0, 2), (0, 2, 0, 1), (3, 5, 7, 8), (0, 3, 0, 3), (0, 16, 0, 9)]:
+        first, second, _ = split_box(box)
+        assert box not in (first, second)
+        assert first[0] < first[1] and first[2] < first[3]
+        assert second[0] < second[1] and second[2] < second[3]
+
+
+@pytest.mark.parametrize('min_feature_size', [0, 1, 2, 3, 4])
+def test_small_min_feature_size(min_feature_size):
+    image = numpy.full((8, 8), 255, dtype=numpy.uint8)
+    image[3, 4] = 0
+    image[6, 6] = 128
+    mesh = build_mesh(image, min_feature_size)
+
+    # free pixels are only lost in leaves smaller than min_feature_size
+    # around a non-free pixel
+    lost = int((image == 255).sum()) - covered(image, mesh[BOXES])
+    assert 0 <= lost <= int((image != 255).sum()) * max(min_feature_size - 2, 0)
+
+
+@pytest.mark.parametrize('min_feature_size', [1, 4, 16])
+def test_small_min_feature_size_aligned(small_map, min_feature_size):
+    mesh = build_mesh(small_map, min_feature_size, split="aligned")
+    assert covered(small_map, mesh[BOXES]) > 0
+
+
+def test_single_pixel_root():
+    for value, count in ((255, 1), (0, 0), (128, 0)):
+        boxes, _ = scan((0, 1, 0, 1), 1, lambda box: value == 255, lambda box: value == 0)
+        assert len(boxes) == count
+
+
+def test_integral_matches_pixel_tests(small_map):
+    for min_feature_size in (2, 8, 32):
+        plain = build_mesh(small_map, min_feature_size, integral=False)
+        integral = build_mesh(small_map, min_feature_size, integral=True)
+        assert numpy.array_equal(plain[BOXES], integral[BOXES])
+
+
+def test_tiled_matches_whole(homer):
+    whole = build_mesh(homer, 16)
+    tiled = build_mesh_tiled(homer, 16, tile_area=256 * 256, workers=1)
+    assert sorted(map(tuple, tiled[BOXES].tolist())) == sorted(map(tuple, whole[BOXES].tolist()))
+
+
+def run_builder(*args):
+    result = subprocess.run([sys.executable, os.path.join(SRC_DIR, 'nm_meshbuilder.py')] + list(args),
+                            capture_output=True, text=True, check=True)
+    return result.stdout
+
+
+def test_occupancy_meshes_like_image():
+    for name in ('test_image.png', 'ucsc_banana_slug.png'):
+        image = (imread(os.path.join(INPUT_DIR, name)) * 255).astype(numpy.uint8)
+        if image.ndim > 2:
+            image = image[:, :, 0]
+        occupancy = occupancy_image(*load_occupancy(os.path.join(INPUT_DIR, name)))
+        assert numpy.array_equal(build_mesh(occupancy, 16)[BOXES], build_mesh(image, 16)[BOXES])
+
+
+def test_mesh_key_skips_and_rebuilds(tmp_path):
+    filename = str(tmp_path / 'map.png')
+    shutil.copy(os.path.join(INPUT_DIR, 'test_image.png'), filename)
+    dirname = mesh_filename(filename)
+
+    assert "Built a mesh" in run_builder(filename, '16', 'middle', '256')
+    assert "up to date" in run_builder(filename, '16', 'middle', '256')
+
+    # other options rebuild, and nothing of the pyramid build is left over
+    assert "Built a mesh" in run_builder(filename, '8')
+    assert not any(name.startswith('pyramid') for name in os.listdir(dirname))
+    assert saved_mesh_key(dirname) == mesh_key(*load_occupancy(filename), 8, 'middle', [], False)
+
+    # the hierarchy is only built when asked for
+    assert not any(name.startswith('hier') for name in os.listdir(dirname))
+    assert "Built a mesh" in run_builder('--hierarchy', filename, '8')
+    assert any(name.startswith('hier') for name in os.listdir(dirname))
+    assert "Built a mesh" in run_builder(filename, '8')
+
+    # a directory without a key is never taken as current
+    os.remove(os.path.join(dirname, MESH_KEY_FILE))
+    assert "Built a mesh" in run_builder(filename, '8')
@@ -0,0 +1,66 @@
+import math
+import random
+from itertools import repeat
+
+import pytest
+
+from graph_search import EXPAND, STOP, SearchSpace, dijkstra
+from nm_landmarks import build_landmarks, portal_graph
+from nm_mesh import ADJ_NEIGHBORS, ADJ_OFFSETS, PORTAL_POINTS, box_middles, connected
+from nm_meshbuilder import build_mesh
+from nm_pathfinder import find_box_id, find_path
+
+
+def path_length(path):
+    return sum(math.dist(a, b) for a, b in zip(path, path[1:]))
+
+
+def shortest_length(source, destination, mesh, graph):
+    """
+    Dijkstra over the portal points of `mesh`, linked as in `graph` (see
+    `nm_landmarks.portal_graph`), from `source` to `destination`.
+    """
+    src_box, dest_box = find_box_id(source, mesh), find_box_id(destination, mesh)
+    if src_box == dest_box:
+        return math.dist(source, destination)
+    offsets, targets, weights = graph
+    box_offsets, neighbors = mesh[ADJ_OFFSETS], mesh[ADJ_NEIGHBORS]
+    points = mesh[PORTAL_POINTS].tolist()
+
+    # the edges are nodes 0..E-1, and E stands for the destination
+    goal = len(neighbors)
+    space = SearchSpace(goal + 1)
+    for edge in range(box_offsets[src_box], box_offsets[src_box + 1]):
+        space.start(edge, cost=math.dist(source, points[edge]))
+
+    def edge_neighbors(edge):
+        steps = list(zip(targets[offsets[edge]:offsets[edge + 1]].tolist(),
+                         weights[offsets[edge]:offsets[edge + 1]].tolist(), repeat(None)))
+        if neighbors[edge] == dest_box:
+            steps.append((goal, math.dist(points[edge], destination), None))
+        return steps
+
+    dijkstra(space, edge_neighbors, lambda node, priority: STOP if node == goal else EXPAND)
+    return space.costs[goal]
+
+
+def random_queries(mesh, count, seed):
+    middles = [tuple(pt) for pt in box_middles(mesh).tolist()]
+    rng = random.Random(seed)
+    queries = []
+    while len(queries) < count:
+        src, dest = rng.randrange(len(middles)), rng.randrange(len(middles))
+        if connected(src, dest, mesh):
+            queries.append((middles[src], middles[dest]))
+    return queries
+
+
+@pytest.mark.parametrize('algorithm', ["bas", "alt"])
+def test_optimal_is_shortest_through_portals(small_map, homer, algorithm):
+    for mesh, count in ((build_mesh(small_map, 4), 20), (build_mesh(homer, 16), 25)):
+        build_landmarks(mesh, 4)
+        graph = portal_graph(mesh)
+        for source, destination in random_queries(mesh, count, 0):
+            path, _ = find_path(source, destination, mesh, algorithm, optimal=True)
+            assert path[0] == source and path[-1] == destination
+            assert path_length(path) == pytest.approx(shortest_length(source, destination, mesh, graph))
@@ -0,0 +1,42 @@
+import numpy
+import pytest
+
+from nm_mesh import ADJ_OFFSETS
+from nm_meshbuilder import build_mesh, build_pyramid
+from nm_pathfinder import find_path
+from nm_pyramid import PYRAMID_KEY, find_path_pyramid
+from test_nm_pathfinder import path_length, random_queries
+
+# the pyramid follows the portal path of its finest box path; over a few
+# thousand queries on small_map and homer no path was more than 1.86 times
+# the "bas" one, and all of them together were under 3% longer
+LENGTH_BOUND = 2
+TOTAL_BOUND = 1.05
+
+
+def test_pyramid_joins_the_same_endpoints(small_map, homer):
+    for image, min_feature_size, sizes in ((small_map, 4, [16, 64]), (homer, 16, [64, 256])):
+        mesh = build_pyramid(build_mesh(image, min_feature_size), image, sizes)
+        total = plain_total = 0
+        for source, destination in random_queries(mesh, 100, seed=3):
+            plain, _ = find_path(source, destination, mesh)
+            path, _ = find_path(source, destination, mesh, "pyramid")
+            assert plain[0] == path[0] == source
+            assert path[-1] == destination
+            # "bas" stops at the portal into the destination box when both
+            # searches meet there
+            if tuple(plain[-1]) != destination:
+                plain = plain + [destination]
+            assert path_length(path) <= LENGTH_BOUND * path_length(plain) + 1e-9
+            total += path_length(path)
+            plain_total += path_length(plain)
+        assert total <= TOTAL_BOUND * plain_total
+
+
+@pytest.mark.parametrize('sizes', [[16], [16, 64]])
+def test_level_without_a_way_has_no_path(small_map, sizes):
+    # level 1 is the coarsest with one size, and searched inside a corridor with two
+    mesh = build_pyramid(build_mesh(small_map, 4), small_map, sizes)
+    offsets = PYRAMID_KEY % (1, ADJ_OFFSETS)
+    mesh[offsets] = numpy.zeros_like(mesh[offsets])
+    assert find_path_pyramid((1, 1), (62, 62), mesh) == ([], [])
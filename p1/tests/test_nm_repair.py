@@ -0,0 +1,145 @@
+import numpy
+import pytest
+
+import nm_repair
+from nm_clearance import BOX_CLEARANCE, PORTAL_CLEARANCE, add_clearance
+from nm_flowfield import FlowFieldCache
+from nm_hierarchy import build_hierarchy
+from nm_landmarks import build_landmarks
+from nm_mesh import BOXES, COMPONENTS, DERIVED_PREFIXES, drop_derived
+from nm_meshbuilder import build_mesh, build_pyramid
+from nm_pathfinder import find_path
+from nm_repair import compact_mesh, enclosing_nodes, repair_mesh
+
+
+def test_repair_drops_derived_arrays(homer):
+    image = homer.copy()
+    mesh = build_mesh(image, 16)
+    build_hierarchy(mesh)
+    build_landmarks(mesh, 4)
+    build_pyramid(mesh, image, [256, 4096])
+
+    image[300:340, 300:340] = 0
+    repair_mesh(mesh, image, (300, 340, 300, 340), 16)
+
+    assert not any(key.startswith(('hier_', 'landmark', 'pyramid')) for key in mesh)
+    free = numpy.argwhere(image == 255)
+    source, destination = tuple(free[0].tolist()), tuple(free[-1].tolist())
+    for algorithm in ("bas", "pyramid"):
+        path, _ = find_path(source, destination, mesh, algorithm)
+        assert path[0] == source and path[-1] == destination
+
+
+def test_drop_derived_keeps_mesh_arrays(small_map):
+    mesh = build_mesh(small_map, 4)
+    built = set(mesh)
+    add_clearance(mesh, small_map)
+    build_hierarchy(mesh)
+    build_landmarks(mesh, 4)
+    build_pyramid(mesh, small_map, [16])
+    assert all(key.startswith(DERIVED_PREFIXES) for key in set(mesh) - built)
+    drop_derived(mesh)
+    assert set(mesh) == built
+
+
+def pixel_components(mesh, shape):
+    """
+    Returns:
+        - The component of the box covering every pixel, -1 where none does
+    """
+    labels = numpy.full(shape, -1, dtype=numpy.int64)
+    for (x1, x2, y1, y2), component in zip(mesh[BOXES].tolist(), mesh[COMPONENTS].tolist()):
+        if x1 < x2 and y1 < y2:
+            labels[x1:x2, y1:y2] = component
+    return labels
+
+
+def random_edits(image, rng, count):
+    for _ in range(count):
+        x, y = int(rng.integers(0, image.shape[0] - 8)), int(rng.integers(0, image.shape[1] - 8))
+        w, h = int(rng.integers(4, 60)), int(rng.integers(4, 60))
+        image[x:x + w, y:y + h] = 0 if rng.random() < 0.5 else 255
+        yield x, x + w, y, y + h
+
+
+# these seeds free enclosed areas, revive boxes left out for having no neighbor
+# and turn split boxes whole again
+@pytest.mark.parametrize('seed', [0, 1, 4, 28, 33, 36])
+def test_repair_matches_rebuild(homer, seed):
+    image = homer.copy()
+    mesh = build_mesh(image, 16)
+    add_clearance(mesh, image)
+    for rect in random_edits(image, numpy.random.default_rng(seed), 10):
+        repair_mesh(mesh, image, rect, 16)
+    rebuilt = build_mesh(image, 16)
+
+    repaired_labels = pixel_components(mesh, image.shape)
+    rebuilt_labels = pixel_components(rebuilt, image.shape)
+    covered = rebuilt_labels >= 0
+    assert (repaired_labels[covered] >= 0).all()
+
+    # a rebuild leaves out enclosed free areas it meshes as one box, which
+    # repairs may split into linked boxes: only such whole components are extra
+    extra = numpy.unique(repaired_labels[(repaired_labels >= 0) & ~covered])
+    assert not numpy.isin(repaired_labels[covered], extra).any()
+
+    # the same pixels end up together: the labels map one to one
+    pairs = numpy.unique(numpy.stack([repaired_labels[covered], rebuilt_labels[covered]]), axis=1)
+    assert len(numpy.unique(pairs[0])) == len(numpy.unique(pairs[1])) == pairs.shape[1]
+
+    # clearance is only recomputed near the edits, and matches recomputing it all
+    full = add_clearance(dict(mesh), image)
+    assert numpy.array_equal(full[BOX_CLEARANCE], mesh[BOX_CLEARANCE])
+    assert numpy.array_equal(full[PORTAL_CLEARANCE], mesh[PORTAL_CLEARANCE])
+
+
+def test_enclosing_nodes_hold_rect():
+    root = (0, 768, 0, 1024)
+    for rect in [(331, 377, 486, 543), (0, 768, 0, 1024), (10, 12, 10, 12), (700, 768, 1000, 1024)]:
+        nodes = enclosing_nodes(root, rect, 16)
+        area = sum((x2 - x1) * (y2 - y1) for x1, x2, y1, y2 in nodes)
+        held = sum((min(x2, rect[1]) - max(x1, rect[0])) * (min(y2, rect[3]) - max(y1, rect[2]))
+                   for x1, x2, y1, y2 in nodes)
+        assert held == (rect[1] - rect[0]) * (rect[3] - rect[2])
+        assert area < 4 * (rect[1] - rect[0] + 64) * (rect[3] - rect[2] + 64)
+
+
+def test_compact_keeps_paths(homer, monkeypatch):
+    image = homer.copy()
+    mesh = build_mesh(image, 16)
+    add_clearance(mesh, image)
+    monkeypatch.setattr(nm_repair, 'COMPACT_FRACTION', 2)
+    for rect in random_edits(image, numpy.random.default_rng(0), 20):
+        repair_mesh(mesh, image, rect, 16)
+
+    free = numpy.argwhere(image == 255)
+    queries = [(tuple(free[i].tolist()), tuple(free[j].tolist()))
+               for i, j in numpy.random.default_rng(1).integers(0, len(free), (50, 2))]
+    paths = [find_path(source, destination, mesh)[0] for source, destination in queries]
+    old_boxes = mesh[BOXES].copy()
+
+    kept = compact_mesh(mesh)
+    assert (mesh[BOXES][:, 0] < mesh[BOXES][:, 1]).all()
+    assert numpy.array_equal(mesh[BOXES], old_boxes[kept])
+    assert [find_path(source, destination, mesh)[0] for source, destination in queries] == paths
+    full = add_clearance(dict(mesh), image)
+    assert numpy.array_equal(full[BOX_CLEARANCE], mesh[BOX_CLEARANCE])
+    assert numpy.array_equal(full[PORTAL_CLEARANCE], mesh[PORTAL_CLEARANCE])
+
+
+def test_repeated_repairs_compact(homer):
+    image = homer.copy()
+    mesh = build_mesh(image, 16)
+    cache = FlowFieldCache(mesh)
+    compacted = False
+    for rect in random_edits(image, numpy.random.default_rng(0), 40):
+        cache.get(0)
+        before = len(mesh[BOXES])
+        removed, added = repair_mesh(mesh, image, rect, 16, caches=[cache])
+        boxes = mesh[BOXES]
+        assert numpy.count_nonzero(boxes[:, 0] >= boxes[:, 1]) < nm_repair.COMPACT_FRACTION * len(boxes)
+        assert (boxes[added, 0] < boxes[added, 1]).all()
+        if len(boxes) < before:
+            compacted = True
+            assert not cache.fields
+    assert compacted
@@ -0,0 +1,79 @@
+import asyncio
+import json
+import os
+
+import numpy
+import pytest
+
+from conftest import INPUT_DIR
+from nm_mesh import save_mesh
+from nm_meshbuilder import build_mesh, load_occupancy, occupancy_image
+from nm_server import QueryServer
+
+
+@pytest.fixture(scope='module')
+def mesh_dir(tmp_path_factory):
+    image = occupancy_image(*load_occupancy(os.path.join(INPUT_DIR, 'test_image.png')))
+    dirname = str(tmp_path_factory.mktemp('server') / 'test_image.png.mesh')
+    save_mesh(build_mesh(image, 16), dirname)
+    return dirname, numpy.argwhere(image == 255)
+
+
+async def exchange(server, address, lines):
+    """
+    Serves `address` and sends `lines` on one connection.
+
+    Returns:
+        - The responses, in the order they arrived
+    """
+    serving = asyncio.ensure_future(server.serve(address))
+    while not os.path.exists(address):
+        await asyncio.sleep(0.01)
+
+    reader, writer = await asyncio.open_unix_connection(address, limit=64 * 1024 * 1024)
+    for line in lines:
+        writer.write(line + b'\n')
+    await writer.drain()
+    responses = [json.loads(await reader.readline()) for _ in lines]
+    writer.close()
+
+    serving.cancel()
+    try:
+        await serving
+    except asyncio.CancelledError:
+        pass
+    return responses
+
+
+def request(**fields):
+    return json.dumps(fields).encode()
+
+
+def test_large_batch_request(tmp_path, mesh_dir):
+    dirname, free = mesh_dir
+    rng = numpy.random.default_rng(0)
+    queries = free[rng.integers(0, len(free), size=(5000, 2))].reshape(-1, 4).tolist()
+    line = request(id=1, op='path', queries=queries)
+    assert len(line) > 64 * 1024  # asyncio's default line limit
+    server = QueryServer({'map': dirname})
+
+    responses = asyncio.run(exchange(server, str(tmp_path / 'socket'), [line]))
+
+    assert responses[0]['id'] == 1
+    assert len(responses[0]['costs']) == 5000
+    assert server.errors == 0
+
+
+def test_request_over_limit(tmp_path, mesh_dir):
+    dirname, _ = mesh_dir
+    server = QueryServer({'map': dirname}, request_limit=1024)
+    too_long = request(id=1, op='locate', points=[[1, 1]] * 1000)
+
+    responses = asyncio.run(exchange(server, str(tmp_path / 'socket'),
+                                     [too_long, request(id=2, op='locate', points=[[1, 1]]), b'not json']))
+    errors = sorted(response['error'] for response in responses if 'error' in response)
+
+    # the lines after the long one are still read as requests
+    assert [response['boxes'] for response in responses if response['id'] == 2] == [[25]]
+    assert len(errors) == 2 and any("longer than 1024 bytes" in error for error in errors)
+    assert server.errors == 2
@@ -0,0 +1,21 @@
+import os
+import pickle
+
+import numpy
+
+from conftest import INPUT_DIR
+from nm_spatial import locate_points
+
+
+def test_locate_points_matches_linear_scan():
+    with open(os.path.join(INPUT_DIR, 'homer.png.mesh.pickle'), 'rb') as f:
+        mesh = pickle.load(f)
+    boxes = numpy.asarray(mesh['boxes'], dtype=numpy.float64)
+    rng = numpy.random.default_rng(0)
+    # whole pixels land on box borders, where the first box in the list wins
+    points = numpy.concatenate([rng.integers(0, 1024, (2000, 2)), rng.uniform(0, 1024, (2000, 2))])
+
+    found = locate_points(points, mesh)
+    for (x, y), box in zip(points.tolist(), found.tolist()):
+        inside = numpy.flatnonzero((boxes[:, 0] <= x) & (x <= boxes[:, 1]) & (boxes[:, 2] <= y) & (y <= boxes[:, 3]))
+        assert box == (inside[0] if len(inside) else -1)
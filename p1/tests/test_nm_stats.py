@@ -0,0 +1,22 @@
+import pytest
+
+from nm_meshbuilder import build_mesh
+from nm_pathfinder import find_path
+from nm_stats import SearchStats
+
+
+def test_stats_filled_by_bidirectional_search(small_map):
+    mesh = build_mesh(small_map, 4)
+    stats = SearchStats()
+    path, _ = find_path((1, 1), (62, 62), mesh, "bas", stats=stats)
+    assert path
+    assert stats.pushes >= stats.pops > 0
+    assert stats.forward_expansions > 0 and stats.backward_expansions > 0
+    assert stats.meeting_box is not None
+
+
+@pytest.mark.parametrize('algorithm', ["hpa", "pyramid"])
+def test_stats_rejected_by_other_searches(small_map, algorithm):
+    mesh = build_mesh(small_map, 4)
+    with pytest.raises(ValueError, match=algorithm):
+        find_path((1, 1), (62, 62), mesh, algorithm, stats=SearchStats())
@@ -0,0 +1,38 @@
+import os
+import pickle
+
+import pytest
+
+import utils
+from conftest import INPUT_DIR
+from nm_pathfinder import find_path
+from nm_spatial import locate_points
+
+
+@pytest.fixture
+def legacy_mesh():
+    with open(os.path.join(INPUT_DIR, 'homer.png.mesh.pickle'), 'rb') as f:
+        return pickle.load(f)
+
+
+def test_find_box_of_point_returns_the_box(legacy_mesh):
+    for box in [legacy_mesh['boxes'][i] for i in (0, 10, 500)]:
+        point = utils.find_box_middle(box)
+        box_id = utils.find_box_id(point, utils.as_array_mesh(legacy_mesh))
+        box = utils.find_box_of_point(point, legacy_mesh)
+        assert box == tuple(legacy_mesh['boxes'][box_id])
+        x, y = point
+        assert box[0] <= x <= box[1] and box[2] <= y <= box[3]
+    with pytest.raises(ValueError):
+        utils.find_box_of_point((-5, -5), legacy_mesh)
+    assert {'BOXES', 'ADJ', 'find_box_of_point', 'find_box_id'} <= set(utils.__all__)
+
+
+def test_legacy_mesh_is_left_as_it_is(legacy_mesh):
+    keys = set(legacy_mesh)
+    source, destination = (utils.find_box_middle(box) for box in legacy_mesh['boxes'][:2])
+    locate_points([source], legacy_mesh)
+    utils.find_box_of_point(source, legacy_mesh)
+    path, _ = find_path(source, destination, legacy_mesh)
+    assert path
+    assert set(legacy_mesh) == keys
@@ -1,46 +1,40 @@
-
+import os
+import sys
 from math import sqrt
-from heapq import heappush, heappop
+
+# the shared search module lives with the navmesh code
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'p1', 'src'))
+from graph_search import SearchSpace
 
 def dijkstras_shortest_path(src, isdst, adj,subOptimal):
-    dist = {}
-    prev = {}
-    dist[src] = 0
-    prev[src] = None
-    heap = [(dist[src], src)]
+    states = [src]          # states by node id, numbered as they are found
+    ids = {src: 0}
+    # ties are broken by state, as with a heap of (dist, state) entries
+    space = SearchSpace(1, key=states.__getitem__)
+    space.start(0)
 
     pathLength = float('inf')
     paths = []
-    while heap:
-        node = heappop(heap)
+    while space.heap:
+        dist, node = space.pop()
+        if node < 0:
+            continue  # stale entry
 
-        if isdst(node[1]):
-            if node[0] < pathLength:
-                pathLength = node[0]
-                path = []
-                nodeR = node[1]
-                while nodeR:
-                    path.append(nodeR)
-                    nodeR = prev[nodeR]
-                path.reverse()
-                paths.append((node[0],path))
-                continue
-            elif node[0] > pathLength+subOptimal:
+        # destinations are never expanded, so every entry of one is popped
+        if isdst(states[node]):
+            if dist < pathLength:
+                pathLength = dist
+            elif dist > pathLength+subOptimal:
                 break
-            else:
-                path = []
-                nodeR = node[1]
-                while nodeR:
-                    path.append(nodeR)
-                    nodeR = prev[nodeR]
-                path.reverse()
-                paths.append((node[0],path))
-                continue
+            paths.append((dist,[states[i] for i in space.path_to(node)]))
+            continue
 
-        for next_node in adj(node):
-            if next_node[1] not in dist or next_node[0] < dist[next_node[1]]:
-                dist[next_node[1]] = next_node[0]
-                prev[next_node[1]] = node[1]
-                heappush(heap, next_node)
+        space.close(node)
+        for next_node in adj((dist, states[node])):
+            if next_node[1] not in ids:
+                ids[next_node[1]] = len(states)
+                states.append(next_node[1])
+                space.grow(len(states))
+            space.relax(ids[next_node[1]], next_node[0], node, next_node[0])
 
     return paths